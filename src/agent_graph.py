@@ -0,0 +1,74 @@
+from contextlib import asynccontextmanager
+from typing import Callable, List, Optional, Tuple
+from autogen import Agent, ConversableAgent, GroupChat, GroupChatManager
+from botbuilder.core import TurnContext
+
+from state import AppTurnState
+
+
+class AgentGraph:
+    """
+    An agent topology that is built once and then reused for many turns.
+    Builders register what changes between turns: `on_bind` callbacks receive each turn's context and state, and the agents
+    and group chats added here are reset before the graph is reused.
+    """
+    def __init__(self):
+        self.user_proxy: Optional[ConversableAgent] = None
+        self.manager: Optional[GroupChatManager] = None
+        self._binders: List[Callable[[TurnContext, AppTurnState], None]] = []
+        self._agents: List[Agent] = []
+        # Each group chat with its send_introductions, which resuming the chat turns off
+        self._group_chats: List[Tuple[GroupChat, bool]] = []
+
+    def on_bind(self, binder: Callable[[TurnContext, AppTurnState], None]):
+        self._binders.append(binder)
+
+    def add_agents(self, *agents: Agent):
+        self._agents.extend(agent for agent in agents if agent not in self._agents)
+
+    def add_group_chat(self, group_chat: GroupChat, manager: Optional[GroupChatManager] = None):
+        self._group_chats.append((group_chat, group_chat.send_introductions))
+        self.add_agents(*group_chat.agents)
+        if manager is not None:
+            self.add_agents(manager)
+
+    def bind(self, context: TurnContext, state: AppTurnState):
+        for binder in self._binders:
+            binder(context, state)
+
+    def reset(self):
+        for agent in self._agents:
+            if isinstance(agent, ConversableAgent):
+                agent.reset()
+        for group_chat, send_introductions in self._group_chats:
+            group_chat.reset()
+            group_chat.send_introductions = send_introductions
+
+
+class AgentGraphPool:
+    """
+    Keeps built agent graphs for reuse, so a turn only binds its state instead of building agents and LLM clients.
+    Each graph serves one turn at a time; concurrent turns get their own graph, built on demand.
+    At most `max_idle` graphs are kept between turns.
+    """
+    def __init__(self, build_graph: Callable[[], AgentGraph], max_idle: int = 4):
+        self.build_graph = build_graph
+        self.max_idle = max_idle
+        self.built = 0
+        self._idle: List[AgentGraph] = []
+
+    @asynccontextmanager
+    async def acquire(self, context: TurnContext, state: AppTurnState):
+        if self._idle:
+            graph = self._idle.pop()
+        else:
+            graph = self.build_graph()
+            self.built += 1
+        graph.bind(context, state)
+        try:
+            yield graph
+        finally:
+            graph.reset()
+            graph.bind(None, None)
+            if len(self._idle) < self.max_idle:
+                self._idle.append(graph)
@@ -11,7 +11,10 @@ from http import HTTPStatus
 from aiohttp import web
 from botbuilder.core.integration import aiohttp_error_middleware
 
-from bot import app
+from bot import app, message_log, storage
+from llm_clients import llm_client_registry
+from rag_agents import search_client_pool, search_executor
+from threat_model_visualizer import render_executor
 
 routes = web.RouteTableDef()
 
@@ -30,5 +33,30 @@ async def ping(_req: web.Request) -> web.Response:
     return web.Response(status=HTTPStatus.OK, text='pong')
 
 
+async def shutdown_render_executor(_app: web.Application) -> None:
+    render_executor.shutdown(wait=False)
+
+
+async def close_search_clients(_app: web.Application) -> None:
+    search_executor.shutdown(wait=False, cancel_futures=True)
+    search_client_pool.close()
+
+
+async def close_llm_clients(_app: web.Application) -> None:
+    llm_client_registry.close()
+
+
+async def close_storage(_app: web.Application) -> None:
+    # Flushes the buffered state writes
+    if hasattr(storage, "a_close"):
+        await storage.a_close()
+    if hasattr(message_log, "a_close"):
+        await message_log.a_close()
+
+
 api = web.Application(middlewares=[aiohttp_error_middleware])
 api.add_routes(routes)
+api.on_cleanup.append(shutdown_render_executor)
+api.on_cleanup.append(close_search_clients)
+api.on_cleanup.append(close_llm_clients)
+api.on_cleanup.append(close_storage)
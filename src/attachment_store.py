@@ -0,0 +1,167 @@
+import base64
+import hashlib
+import io
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+from PIL import Image
+
+from config import Config
+
+HANDLE_PATTERN = re.compile(r"attachment:([\w.+-]+/[\w.+-]+);sha256,([0-9a-f]{64})")
+DATA_URI_PATTERN = re.compile(r"data:([\w.+-]+/[\w.+-]+);base64,([A-Za-z0-9+/=]+)")
+
+
+class AttachmentStore:
+    """
+    Content addressed store for the images in chat transcripts.
+    Transcripts hold a short handle like `attachment:image/jpeg;sha256,<hex>` instead of the base64 data, and the data
+    is only looked up when it is sent to Teams or a model.
+    Keeps up to `max_bytes` in memory. When `directory` is set every attachment is also written there, so handles in
+    persisted conversations still resolve after a restart.
+    """
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, directory: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def put(self, data: bytes, content_type: str) -> str:
+        """
+        Store an attachment.
+        :param data: The attachment bytes.
+        :param content_type: The MIME type.
+        :return: The handle.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        if self.directory:
+            path = os.path.join(self.directory, digest)
+            if not os.path.exists(path):
+                # Written to a temporary file first, so a concurrent reader never sees part of it
+                temp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(temp_path, "wb") as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+        self._remember(digest, data)
+        return f"attachment:{content_type};sha256,{digest}"
+
+    def put_image(self, image: Image.Image) -> str:
+        # Saved as PNG, like autogen's pil_to_data_uri
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        return self.put(buffer.getvalue(), "image/png")
+
+    def _remember(self, digest: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if digest in self._entries:
+                self._entries.move_to_end(digest)
+                return
+            self._entries[digest] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def get(self, handle: str) -> Optional[Tuple[str, bytes]]:
+        """
+        Look up an attachment.
+        :param handle: The handle from `put`.
+        :return: The MIME type and bytes, or None when the attachment is not stored.
+        """
+        match = HANDLE_PATTERN.fullmatch(handle.strip())
+        if match is None:
+            return None
+        content_type, digest = match.groups()
+        with self._lock:
+            data = self._entries.get(digest)
+            if data is not None:
+                self._entries.move_to_end(digest)
+                return content_type, data
+        if not self.directory:
+            return None
+        try:
+            with open(os.path.join(self.directory, digest), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        self._remember(digest, data)
+        return content_type, data
+
+    def to_data_uri(self, handle: str) -> Optional[str]:
+        attachment = self.get(handle)
+        if attachment is None:
+            return None
+        content_type, data = attachment
+        return f"data:{content_type};base64,{base64.b64encode(data).decode('ascii')}"
+
+    @staticmethod
+    def _replace_in_content(content, pattern: re.Pattern, replace):
+        if isinstance(content, str):
+            return pattern.sub(replace, content)
+        if isinstance(content, list):
+            parts = []
+            for part in content:
+                if isinstance(part, dict) and part.get("type") == "image_url" and isinstance(part.get("image_url", {}).get("url"), str):
+                    parts.append({**part, "image_url": {**part["image_url"], "url": pattern.sub(replace, part["image_url"]["url"])}})
+                elif isinstance(part, dict) and part.get("type") == "text":
+                    parts.append({**part, "text": pattern.sub(replace, part.get("text", ""))})
+                else:
+                    parts.append(part)
+            return parts
+        return content
+
+    def externalize(self, content):
+        """
+        Replace the base64 data URIs in a message's content with handles.
+        :param content: The message content, a string or a list of content parts.
+        :return: The content with handles.
+        """
+        return self._replace_in_content(content, DATA_URI_PATTERN, lambda match: self.put(base64.b64decode(match.group(2)), match.group(1)))
+
+    def rehydrate(self, content):
+        """
+        Turn the handles in a message's content into image parts with the data, for sending to a multimodal model.
+        Handles that are no longer stored are left as text.
+        :param content: The message content, a string or a list of content parts.
+        :return: The content, as content parts when it had handles.
+        """
+        if isinstance(content, str):
+            if HANDLE_PATTERN.search(content) is None:
+                return content
+            content = [{"type": "text", "text": content}]
+        if not isinstance(content, list):
+            return content
+        parts = []
+        for part in content:
+            if isinstance(part, dict) and part.get("type") == "text":
+                text = part.get("text", "")
+                last_end = 0
+                for match in HANDLE_PATTERN.finditer(text):
+                    data_uri = self.to_data_uri(match.group(0))
+                    if data_uri is None:
+                        continue
+                    if text[last_end:match.start()].strip():
+                        parts.append({"type": "text", "text": text[last_end:match.start()]})
+                    parts.append({"type": "image_url", "image_url": {"url": data_uri}})
+                    last_end = match.end()
+                if text[last_end:].strip() or last_end == 0:
+                    parts.append({**part, "text": text[last_end:]})
+            elif isinstance(part, dict) and part.get("type") == "image_url" and isinstance(part.get("image_url", {}).get("url"), str):
+                data_uri = self.to_data_uri(part["image_url"]["url"])
+                parts.append({**part, "image_url": {**part["image_url"], "url": data_uri}} if data_uri else part)
+            else:
+                parts.append(part)
+        return parts
+
+
+attachment_store = AttachmentStore(
+    max_bytes=Config.ATTACHMENT_STORE_MAX_BYTES,
+    directory=Config.ATTACHMENT_STORE_DIR,
+)
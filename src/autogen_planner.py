@@ -1,13 +1,19 @@
 import re
-from typing import List, Callable, Optional, Union
+from typing import Awaitable, List, Callable, Optional, Union
 from datetime import datetime
 from dataclasses import dataclass
 from dataclasses_json import dataclass_json
 from botbuilder.schema import Attachment
-from botbuilder.core import CardFactory, TurnContext
+from botbuilder.core import TurnContext
 from teams.ai.prompts import Message
 from teams.ai.planners import Planner, Plan, PredictedSayCommand
-from autogen import Agent, GroupChat, GroupChatManager, ChatResult
+from autogen import Agent, GroupChat, GroupChatManager
+from agent_graph import AgentGraph, AgentGraphPool
+from attachment_store import HANDLE_PATTERN, attachment_store
+from chat_history_card import create_chat_history_ac
+from config import Config
+from history_compactor import HistoryCompactor, build_summarize_function
+from message_log import MemoryMessageLog, MessageLog
 from state import AppTurnState
 from teams_user_proxy import TeamsUserProxy
 
@@ -21,26 +27,60 @@ class PredictedSayCommandWithAttachments(PredictedSayCommand):
 
 
 class AutoGenPlanner(Planner):
-    def __init__(self, llm_config, build_group_chat: Callable[[TurnContext, AppTurnState, Agent], Union[GroupChat,None]], messageBuilder: Optional[Callable[[TurnContext, AppTurnState], str]] = None) -> None:
+    def __init__(self, llm_config, build_group_chat: Callable[[Agent, AgentGraph], Union[GroupChat,None]], messageBuilder: Optional[Callable[[TurnContext, AppTurnState], str]] = None, prepare_turn: Optional[Callable[[TurnContext, AppTurnState], Awaitable[None]]] = None, message_log: Optional[MessageLog] = None) -> None:
         self.llm_config = llm_config
         self.build_group_chat = build_group_chat
         self.messageBuilder = messageBuilder
+        self.prepare_turn = prepare_turn
+        self.message_log = message_log if message_log is not None else MemoryMessageLog()
+        self.history_compactor = HistoryCompactor(
+            build_summarize_function(llm_config),
+            user_name="User",
+            keep_last_turns=Config.HISTORY_KEEP_LAST_TURNS,
+            max_tokens=Config.HISTORY_MAX_TOKENS,
+        )
+        # Agents and their LLM clients are built once and bound to each turn's context and state
+        self.graph_pool = AgentGraphPool(self._build_graph, max_idle=Config.AGENT_GRAPH_POOL_MAX_IDLE)
         super().__init__()
 
-    async def begin_task(self, context, state: AppTurnState):
-        return await self.continue_task(context, state)
-
-    async def continue_task(self, context, state: AppTurnState):               
+    def _build_graph(self) -> AgentGraph:
+        graph = AgentGraph()
         user_proxy = TeamsUserProxy(
             name="User",
             system_message="A human admin. This agent is a proxy for the user. This agent can help answer questions too.",
             llm_config=self.llm_config
         )
+        groupchat = self.build_group_chat(user_proxy, graph)
+        if groupchat is not None:
+            graph.user_proxy = user_proxy
+            graph.manager = GroupChatManager(
+                groupchat=groupchat,
+                llm_config=self.llm_config
+            )
+            graph.add_group_chat(groupchat, graph.manager)
+            graph.add_agents(user_proxy)
+        return graph
+
+    async def a_create_chat_history_ac(self, conversation_id: str, chat_start: int, offset: int = 0) -> Attachment:
+        """
+        Build a page of the card showing the agents' discussion, from the message log.
+        :param conversation_id: The conversation id.
+        :param chat_start: Where the group chat starts in the message log.
+        :param offset: The index of the first message on the page.
+        :return: The card.
+        """
+        messages = await self.message_log.a_load(conversation_id, chat_start)
+        return create_chat_history_ac(messages, chat_start, offset, max_bytes=Config.CHAT_HISTORY_CARD_MAX_BYTES,
+                                      max_fact_chars=Config.CHAT_HISTORY_CARD_MAX_FACT_CHARS)
+
+    async def begin_task(self, context, state: AppTurnState):
+        return await self.continue_task(context, state)
+
+    async def continue_task(self, context, state: AppTurnState):
+        # Async work (e.g. rendering uploads) is done up front since parts of the group chat run synchronously
+        if self.prepare_turn is not None:
+            await self.prepare_turn(context, state)
 
-        groupchat = self.build_group_chat(context, state, user_proxy)
-        if groupchat is None:
-            return Plan(commands=[])
-        
         if state.conversation.is_waiting_for_user_input and state.conversation.started_waiting_for_user_input_at is not None:
             # if the user has not responded in 2 minutes
             started_waiting_for_user_input_at = state.conversation.started_waiting_for_user_input_at if isinstance(
@@ -50,99 +90,67 @@ class AutoGenPlanner(Planner):
                 state.conversation.is_waiting_for_user_input = False
                 state.conversation.started_waiting_for_user_input_at = None
 
-        is_existing_group_chat = state.conversation.is_waiting_for_user_input and state.conversation.message_history is not None
-        manager = GroupChatManager(
-            groupchat=groupchat,
-            llm_config=self.llm_config
-        )
-        if is_existing_group_chat and state.conversation.message_history is not None:
-            await manager.a_resume(messages=state.conversation.message_history)
-
-        incoming_message = self.messageBuilder(context, state) if self.messageBuilder is not None else context.activity.text
-        chat_result = await user_proxy.a_initiate_chat(recipient=manager, message=incoming_message, clear_history=False)
-        chat_history = chat_result.chat_history[:]
-        for chat in chat_history:
-            if chat.get("content") == "":
-                chat_result.chat_history.remove(chat)
+        async with self.graph_pool.acquire(context, state) as graph:
+            if graph.manager is None:
+                return Plan(commands=[])
 
-        if user_proxy.question_for_user is not None:
-            state.conversation.is_waiting_for_user_input = True
-            state.conversation.started_waiting_for_user_input_at = datetime.now()
-            message = user_proxy.question_for_user
-        else:
-            state.conversation.is_waiting_for_user_input = False
-            state.conversation.started_waiting_for_user_input_at = None
-            message = chat_result.summary
-
-        state.conversation.message_history = chat_result.chat_history
-        attachments = []
-        if isinstance(message, str) and message.startswith('data:'):
-            mime_type = re.search(r'data:(.*?);', message)
-            if mime_type is not None and mime_type.group(1) is not None:
-                attachments.append(Attachment(content_type=mime_type.group(1), content_url=message))
-                message = "👇"
-        if len(attachments) == 0:
-            attachments.append(create_chat_history_ac(chat_result))
-        return Plan(
-            commands=[
-                PredictedSayCommandWithAttachments(
-                    'SAY', 
-                    MessageWithAttachments(
-                        'assistant', 
-                        content=message, 
-                            attachments=attachments
-                        )
-                    )
-                ]
-            )
+            conversation_id = context.activity.conversation.id
+            is_existing_group_chat = state.conversation.is_waiting_for_user_input and state.conversation.message_log_start is not None
+            resumed_count = 0
+            if is_existing_group_chat:
+                # Only the messages not yet loaded by this process are read from the log
+                message_history = await self.message_log.a_load(conversation_id, state.conversation.message_log_start)
+                if message_history:
+                    # The log keeps every message, the agents only get the compacted history
+                    message_history = await self.history_compactor.a_compact(message_history)
+                    await graph.manager.a_resume(messages=message_history)
+                    resumed_count = len(graph.user_proxy.chat_messages[graph.manager])
+            else:
+                state.conversation.message_log_start = await self.message_log.a_start(conversation_id)
 
+            incoming_message = self.messageBuilder(context, state) if self.messageBuilder is not None else context.activity.text
+            chat_result = await graph.user_proxy.a_initiate_chat(recipient=graph.manager, message=incoming_message, clear_history=False)
+            # Only this turn's messages are logged, the earlier ones already are
+            new_messages = chat_result.chat_history[resumed_count:]
+            chat_history = chat_result.chat_history[:]
+            for chat in chat_history:
+                if chat.get("content") == "":
+                    chat_result.chat_history.remove(chat)
 
-def create_chat_history_ac(message: ChatResult) -> Attachment:
-    facts = []
-    for value in message.chat_history:
-        if value.get("name") is not None:
-            facts.append({
-                "title": value["name"],
-                "value": value["content"]
-            })
+            if graph.user_proxy.question_for_user is not None:
+                state.conversation.is_waiting_for_user_input = True
+                state.conversation.started_waiting_for_user_input_at = datetime.now()
+                message = graph.user_proxy.question_for_user
+            else:
+                state.conversation.is_waiting_for_user_input = False
+                state.conversation.started_waiting_for_user_input_at = None
+                message = chat_result.summary
 
-    return CardFactory.adaptive_card(
-        {
-            "type": "AdaptiveCard",
-            "speak": "3 minute energy flow with kayo video",
-            "$schema": "https://adaptivecards.io/schemas/adaptive-card.json",
-            "version": "1.5",
-            "body": [
-                {
-                    "type": "TextBlock",
-                    "wrap": True,
-                    "text": "Agent Reasoning",
-                    "style": "heading",
-                    "size": "Medium"
-                },
-                {
-                    "type": "TextBlock",
-                    "wrap": True,
-                    "text": "You can view the agent's internal conversation by toggling the card below"
-                },
-                {
-                    "type": "ActionSet",
-                    "actions": [
-                        {
-                            "type": "Action.ShowCard",
-                            "title": "Show internal discussion",
-                            "card": {
-                                "type": "AdaptiveCard",
-                                "body": [
-                                    {
-                                        "type": "FactSet",
-                                        "facts": facts
-                                    }
-                                ]
-                            }
-                        }
+            # Any image data left in the messages is logged by handle
+            await self.message_log.a_append(conversation_id, [
+                {**chat, "content": attachment_store.externalize(chat.get("content"))} for chat in new_messages if chat.get("content") != ""
+            ])
+            attachments = []
+            if isinstance(message, str):
+                # A handle that no longer resolves, or is part of a longer text, is not shown to the user as is
+                message = attachment_store.to_data_uri(message) or HANDLE_PATTERN.sub("(image not available)", message)
+            if isinstance(message, str) and message.startswith('data:'):
+                mime_type = re.search(r'data:(.*?);', message)
+                if mime_type is not None and mime_type.group(1) is not None:
+                    attachments.append(Attachment(content_type=mime_type.group(1), content_url=message))
+                    message = "👇"
+            if len(attachments) == 0:
+                attachments.append(await self.a_create_chat_history_ac(conversation_id, state.conversation.message_log_start))
+            return Plan(
+                commands=[
+                    PredictedSayCommandWithAttachments(
+                        'SAY', 
+                        MessageWithAttachments(
+                            'assistant', 
+                            content=message, 
+                                attachments=attachments
+                            )
+                        )
                     ]
-                }
-            ]
-        }
-    )
+                )
+
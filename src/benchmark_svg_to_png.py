@@ -0,0 +1,80 @@
+import sys
+import time
+import tracemalloc
+import types
+
+from svg_to_png import svg_to_png
+from svg_to_png.svg_to_png import build_surface_elements
+from svg_to_png.tm7_parser import parse_tm7
+
+def without_slots(cls, clones: dict):
+    """
+    Copy an element class and its bases without `__slots__`, as the classes were before they had them.
+    :param cls: The element class.
+    :param clones: The classes copied so far, shared so that common bases are copied once.
+    :return: The copy.
+    """
+    if cls is object:
+        return object
+    if cls not in clones:
+        slots = getattr(cls, "__slots__", ())
+        namespace = {name: value for name, value in vars(cls).items()
+                     if name not in ("__slots__", "__dict__", "__weakref__") and name not in slots}
+        clone = type(cls.__name__, tuple(without_slots(base, clones) for base in cls.__bases__), namespace)
+        for name, value in namespace.items():
+            if isinstance(value, types.FunctionType) and "__class__" in value.__code__.co_freevars:
+                # Zero-argument super() looks up the class the method was defined in, so it must find the copy
+                closure = tuple(types.CellType(clone) if free_var == "__class__" else cell
+                                for free_var, cell in zip(value.__code__.co_freevars, value.__closure__))
+                method = types.FunctionType(value.__code__, value.__globals__, value.__name__, value.__defaults__, closure)
+                method.__kwdefaults__ = value.__kwdefaults__
+                setattr(clone, name, method)
+        clones[cls] = clone
+    return clones[cls]
+
+def measure(document, iterations: int, element_count: int):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for surface in document.surfaces:
+            build_surface_elements(surface, document.icons)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    elements = [build_surface_elements(surface, document.icons) for surface in document.surfaces]
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed / iterations / element_count * 1e6, memory / element_count, elements
+
+def measure_without_slots(document, iterations: int, element_count: int):
+    clones = {}
+    shape_classes, curve_classes = svg_to_png.SHAPE_CLASSES, svg_to_png.CURVE_CLASSES
+    svg_to_png.SHAPE_CLASSES = {type_id: without_slots(cls, clones) for type_id, cls in shape_classes.items()}
+    svg_to_png.CURVE_CLASSES = {type_id: without_slots(cls, clones) for type_id, cls in curve_classes.items()}
+    try:
+        return measure(document, iterations, element_count)
+    finally:
+        svg_to_png.SHAPE_CLASSES, svg_to_png.CURVE_CLASSES = shape_classes, curve_classes
+
+def main():
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python3 script.py <input_file> [iterations]")
+        sys.exit(1)
+
+    input_file = sys.argv[1]
+    iterations = int(sys.argv[2]) if len(sys.argv) == 3 else 20
+    document = parse_tm7(file=input_file)
+    element_count = sum(len(surface.borders) + len(surface.lines) for surface in document.surfaces)
+    if element_count == 0:
+        print("The threat model has no elements.")
+        sys.exit(1)
+
+    baseline_time, baseline_memory, _ = measure_without_slots(document, iterations, element_count)
+    construction_time, memory, elements = measure(document, iterations, element_count)
+
+    print(f"Elements: {element_count}")
+    print(f"Construction time: {baseline_time:.2f} us/element without slots, {construction_time:.2f} us/element with slots")
+    print(f"Memory: {baseline_memory:.1f} bytes/element without slots, {memory:.1f} bytes/element with slots")
+    return elements
+
+if __name__ == "__main__":
+    main()
@@ -9,18 +9,20 @@ import sys
 import traceback
 from botbuilder.schema import Activity, ActivityTypes
 
-from botbuilder.core import TurnContext, MemoryStorage
+from botbuilder.core import TurnContext
 from teams import Application, ApplicationOptions, TeamsAdapter
 from teams.ai import AIOptions
 from teams.ai.actions import ActionTypes, ActionTurnContext
 from teams.teams_attachment_downloader.teams_attachment_downloader import TeamsAttachmentDownloader
 from teams.teams_attachment_downloader.teams_attachment_downloader_options import TeamsAttachmentDownloaderOptions
 from autogen_planner import AutoGenPlanner, PredictedSayCommandWithAttachments
-# from botbuilder.azure import BlobStorage, BlobStorageSettings
 from privacy_review_assistant_group import PrivacyReviewAssistantGroup
+from chat_history_card import SHOW_MORE_VERB
 
 from config import Config
 from state import AppTurnState
+from state_storage import build_storage
+from message_log import build_message_log
 
 config = Config()
 llm_config = config.build_llm_config()
@@ -30,7 +32,8 @@ if config.OPENAI_KEY is None and config.AZURE_OPENAI_KEY is None:
         "Unable to build LLM config - please check that OPENAI_KEY or AZURE_OPENAI_KEY is set."
     )
 
-storage = MemoryStorage()
+storage = build_storage()
+message_log = build_message_log()
 
 threat_model_reviewer_group = PrivacyReviewAssistantGroup(llm_config=llm_config)
 
@@ -38,13 +41,17 @@ adapter = TeamsAdapter(config)
 downloader = TeamsAttachmentDownloader(
     TeamsAttachmentDownloaderOptions(config.APP_ID, adapter))
 
+planner = AutoGenPlanner(llm_config=llm_config,
+                         build_group_chat=threat_model_reviewer_group.group_chat_builder,
+                         prepare_turn=threat_model_reviewer_group.prepare_turn,
+                         message_log=message_log)
+
 app = Application[AppTurnState](
     ApplicationOptions(
         bot_app_id=config.APP_ID,
         storage=storage,
         adapter=adapter,
-        ai=AIOptions(planner=AutoGenPlanner(llm_config=llm_config,
-                     build_group_chat=threat_model_reviewer_group.group_chat_builder)),
+        ai=AIOptions(planner=planner),
         file_downloaders=[downloader],
     ),
 )
@@ -87,6 +94,17 @@ async def on_login(context: TurnContext, state: AppTurnState):
     return True
 
 
+@app.adaptive_cards.action_submit(SHOW_MORE_VERB)
+async def on_show_more_chat_history(context: TurnContext, state: AppTurnState, data: dict):
+    # The next page is read from the message log, as long as the discussion is still the current one
+    chat_start = data.get("chat_start")
+    if chat_start is None or chat_start != state.conversation.message_log_start:
+        await context.send_activity("That discussion is no longer available.")
+        return
+    card = await planner.a_create_chat_history_ac(context.activity.conversation.id, chat_start, data.get("offset", 0))
+    await context.send_activity(Activity(type=ActivityTypes.message, attachments=[card]))
+
+
 @app.turn_state_factory
 async def turn_state_factory(context: TurnContext):
     return await AppTurnState.load(context, storage)
@@ -0,0 +1,129 @@
+import json
+from typing import Dict, Iterator, List, Optional, Tuple
+from autogen.code_utils import content_str
+from botbuilder.core import CardFactory
+from botbuilder.schema import Attachment
+
+from attachment_store import DATA_URI_PATTERN, HANDLE_PATTERN
+
+SHOW_MORE_VERB = "chat_history_page"
+
+
+def iter_history_facts(messages: List[Dict], offset: int = 0, max_fact_chars: int = 2000) -> Iterator[Tuple[int, Dict]]:
+    """
+    Turn the named messages of a transcript into card facts, one at a time.
+    Images are replaced by a placeholder and long messages are cut to `max_fact_chars`.
+    :param messages: The transcript.
+    :param offset: The index of the first message to turn into a fact.
+    :param max_fact_chars: The longest fact value.
+    :return: The message indexes and facts.
+    """
+    for index in range(offset, len(messages)):
+        message = messages[index]
+        if message.get("name") is None:
+            continue
+        value = content_str(message.get("content"))
+        value = DATA_URI_PATTERN.sub("(image)", HANDLE_PATTERN.sub("(image)", value)).replace("<image>", "(image)")
+        if len(value) > max_fact_chars:
+            value = value[:max_fact_chars] + "…"
+        yield index, {"title": message["name"], "value": value}
+
+
+def _json_length(value) -> int:
+    return len(json.dumps(value))
+
+
+def _build_card(facts: List[Dict], offset: int, show_more_data: Optional[Dict]) -> Dict:
+    discussion = [
+        {
+            "type": "FactSet",
+            "facts": facts
+        }
+    ]
+    if show_more_data is not None:
+        discussion.append({
+            "type": "ActionSet",
+            "actions": [
+                {
+                    "type": "Action.Submit",
+                    "title": "Show more",
+                    "data": show_more_data
+                }
+            ]
+        })
+    return {
+        "type": "AdaptiveCard",
+        "speak": "3 minute energy flow with kayo video",
+        "$schema": "https://adaptivecards.io/schemas/adaptive-card.json",
+        "version": "1.5",
+        "body": [
+            {
+                "type": "TextBlock",
+                "wrap": True,
+                "text": "Agent Reasoning" if offset == 0 else "Agent Reasoning (continued)",
+                "style": "heading",
+                "size": "Medium"
+            },
+            {
+                "type": "TextBlock",
+                "wrap": True,
+                "text": "You can view the agent's internal conversation by toggling the card below"
+            },
+            {
+                "type": "ActionSet",
+                "actions": [
+                    {
+                        "type": "Action.ShowCard",
+                        "title": "Show internal discussion",
+                        "card": {
+                            "type": "AdaptiveCard",
+                            "body": discussion
+                        }
+                    }
+                ]
+            }
+        ]
+    }
+
+
+def build_chat_history_card(messages: List[Dict], chat_start: Optional[int] = None, offset: int = 0, max_bytes: int = 24000,
+                            max_fact_chars: int = 2000) -> Dict:
+    """
+    Build one page of the "Agent Reasoning" card, as many facts from `offset` on as fit in `max_bytes` of JSON.
+    When the transcript does not fit, the page ends with a "Show more" action for the next page.
+    :param messages: The transcript.
+    :param chat_start: Where the chat starts in the message log, sent back with "Show more".
+    :param offset: The index of the first message on the page.
+    :param max_bytes: The largest JSON size of the card.
+    :param max_fact_chars: The longest fact value.
+    :return: The card content.
+    """
+    # The "Show more" data with the largest offset it can have, so its size is reserved up front
+    reserved_data = {"verb": SHOW_MORE_VERB, "chat_start": chat_start, "offset": len(messages)}
+    size = _json_length(_build_card([], offset, reserved_data))
+    facts = []
+    next_offset = None
+    for index, fact in iter_history_facts(messages, offset, max_fact_chars):
+        # Facts after the first are preceded by ", "
+        fact_size = _json_length(fact) + (2 if facts else 0)
+        if size + fact_size > max_bytes and not facts:
+            # A page always has one fact, cut to fit, so "Show more" always moves on.
+            # Every character takes at least one byte of JSON.
+            for key in ("value", "title"):
+                text = fact[key].rstrip("…")
+                while size + fact_size > max_bytes and text:
+                    text = text[:max(len(text) - (size + fact_size - max_bytes), 0)]
+                    fact[key] = text + "…"
+                    fact_size = _json_length(fact)
+        elif size + fact_size > max_bytes:
+            next_offset = index
+            break
+        facts.append(fact)
+        size += fact_size
+    show_more_data = {"verb": SHOW_MORE_VERB, "chat_start": chat_start, "offset": next_offset} if next_offset is not None else None
+    return _build_card(facts, offset, show_more_data)
+
+
+def create_chat_history_ac(messages: List[Dict], chat_start: Optional[int] = None, offset: int = 0, max_bytes: int = 24000,
+                           max_fact_chars: int = 2000) -> Attachment:
+    return CardFactory.adaptive_card(build_chat_history_card(messages, chat_start, offset, max_bytes, max_fact_chars))
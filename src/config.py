@@ -20,11 +20,67 @@ class Config:
     AZURE_OPENAI_ENDPOINT = os.environ.get("AZURE_OPENAI_ENDPOINT", "")
     AZURE_SEARCH_SERVICE_ENDPOINT = os.environ.get("AZURE_SEARCH_SERVICE_ENDPOINT", "")
     AZURE_SEARCH_API_KEY = os.environ.get("AZURE_SEARCH_API_KEY")
+    AZURE_SEARCH_POOL_SIZE = int(os.environ.get("AZURE_SEARCH_POOL_SIZE", "10"))
+    AZURE_SEARCH_CONNECTION_TIMEOUT_SECONDS = float(os.environ.get("AZURE_SEARCH_CONNECTION_TIMEOUT_SECONDS", "5"))
+    AZURE_SEARCH_READ_TIMEOUT_SECONDS = float(os.environ.get("AZURE_SEARCH_READ_TIMEOUT_SECONDS", "30"))
+    AZURE_SEARCH_MAX_CONCURRENT_QUERIES = int(os.environ.get("AZURE_SEARCH_MAX_CONCURRENT_QUERIES", "4"))
+    AZURE_SEARCH_QUERY_TIMEOUT_SECONDS = float(os.environ.get("AZURE_SEARCH_QUERY_TIMEOUT_SECONDS", "20"))
+    # How long a resolved dated index is used before checking for a newer one
+    AZURE_SEARCH_INDEX_TTL_SECONDS = float(os.environ.get("AZURE_SEARCH_INDEX_TTL_SECONDS", "900"))
+    # "azure_ai_search", or "local" for the on-prem vector store
+    RAG_VECTOR_DB = os.environ.get("RAG_VECTOR_DB", "azure_ai_search")
+    RAG_LOCAL_VECTOR_DB_PATH = os.environ.get("RAG_LOCAL_VECTOR_DB_PATH", "vector_db")
+    RAG_LOCAL_VECTOR_DB_COLLECTION = os.environ.get("RAG_LOCAL_VECTOR_DB_COLLECTION", "privacy-docs")
+    RAG_LOCAL_VECTOR_DB_DOCS_PATH = os.environ.get("RAG_LOCAL_VECTOR_DB_DOCS_PATH")
+    RAG_LOCAL_VECTOR_DB_EMBEDDING_MODEL = os.environ.get("RAG_LOCAL_VECTOR_DB_EMBEDDING_MODEL")
+    # Search results further than this from the question are not used, where 0 is the most relevant and 1 the least. Off when negative.
+    RAG_DISTANCE_THRESHOLD = float(os.environ.get("RAG_DISTANCE_THRESHOLD", "-1"))
+    RAG_CONTEXT_MAX_TOKENS = int(os.environ.get("RAG_CONTEXT_MAX_TOKENS", "2000"))
+    RAG_ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("RAG_ANSWER_CACHE_MAX_ENTRIES", "512"))
+    # Answers also expire when a newer dated search index is found
+    RAG_ANSWER_CACHE_TTL_SECONDS = float(os.environ.get("RAG_ANSWER_CACHE_TTL_SECONDS", str(24 * 60 * 60)))
+    # Enables matching similar questions, not just identical ones
+    RAG_ANSWER_CACHE_EMBEDDING_MODEL = os.environ.get("RAG_ANSWER_CACHE_EMBEDDING_MODEL")
+    RAG_ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.environ.get("RAG_ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95"))
+    # Built agent graphs kept between turns, more are built when turns run concurrently
+    AGENT_GRAPH_POOL_MAX_IDLE = int(os.environ.get("AGENT_GRAPH_POOL_MAX_IDLE", "4"))
+    # LLM requests in flight at once across all agents
+    LLM_MAX_CONCURRENT_REQUESTS = int(os.environ.get("LLM_MAX_CONCURRENT_REQUESTS", "8"))
+    LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", "20"))
+    LLM_KEEPALIVE_EXPIRY_SECONDS = float(os.environ.get("LLM_KEEPALIVE_EXPIRY_SECONDS", "60"))
+    # "memory", or "sqlite" to keep the bot state on disk
+    STATE_STORAGE = os.environ.get("STATE_STORAGE", "memory")
+    STATE_STORAGE_PATH = os.environ.get("STATE_STORAGE_PATH", "state")
+    STATE_STORAGE_SHARDS = int(os.environ.get("STATE_STORAGE_SHARDS", "8"))
+    STATE_STORAGE_FLUSH_INTERVAL_SECONDS = float(os.environ.get("STATE_STORAGE_FLUSH_INTERVAL_SECONDS", "1"))
+    # In-process cache in front of the sqlite storage, 0 turns it off
+    STATE_STORAGE_CACHE_MAX_BYTES = int(os.environ.get("STATE_STORAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    STATE_STORAGE_CACHE_TTL_SECONDS = float(os.environ.get("STATE_STORAGE_CACHE_TTL_SECONDS", "60"))
+    # Resumed group chats keep this many user turns verbatim and summarize the older ones
+    HISTORY_KEEP_LAST_TURNS = int(os.environ.get("HISTORY_KEEP_LAST_TURNS", "4"))
+    HISTORY_MAX_TOKENS = int(os.environ.get("HISTORY_MAX_TOKENS", "12000"))
+    ATTACHMENT_STORE_MAX_BYTES = int(os.environ.get("ATTACHMENT_STORE_MAX_BYTES", str(64 * 1024 * 1024)))
+    # Keeps the images referenced by persisted conversations across restarts
+    ATTACHMENT_STORE_DIR = os.environ.get("ATTACHMENT_STORE_DIR")
+    # Teams rejects cards over about 28KB, longer discussions are paged with "Show more"
+    CHAT_HISTORY_CARD_MAX_BYTES = int(os.environ.get("CHAT_HISTORY_CARD_MAX_BYTES", "24000"))
+    CHAT_HISTORY_CARD_MAX_FACT_CHARS = int(os.environ.get("CHAT_HISTORY_CARD_MAX_FACT_CHARS", "2000"))
     AZURE_MANAGED_IDENTITY_CLIENT_ID = os.environ.get("AZURE_MANAGED_IDENTITY_CLIENT_ID")
     AZURE_LLM_MODEL = os.environ.get("AZURE_LLM_MODEL")
     AZURE_LLM_BASE_URL = os.environ.get("AZURE_LLM_BASE_URL")
+    THREAT_MODEL_RENDER_CACHE_MAX_ENTRIES = int(os.environ.get("THREAT_MODEL_RENDER_CACHE_MAX_ENTRIES", "32"))
+    THREAT_MODEL_RENDER_CACHE_MAX_BYTES = int(os.environ.get("THREAT_MODEL_RENDER_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    # Rendered threat models evicted from memory are spilled here when set
+    THREAT_MODEL_RENDER_CACHE_DIR = os.environ.get("THREAT_MODEL_RENDER_CACHE_DIR")
+    THREAT_MODEL_RENDER_CACHE_MAX_SPILL_BYTES = int(os.environ.get("THREAT_MODEL_RENDER_CACHE_MAX_SPILL_BYTES", str(512 * 1024 * 1024)))
+    # Defaults to one render process per CPU
+    THREAT_MODEL_RENDER_POOL_SIZE = int(os.environ["THREAT_MODEL_RENDER_POOL_SIZE"]) if os.environ.get("THREAT_MODEL_RENDER_POOL_SIZE") else None
+    THREAT_MODEL_RENDER_TIMEOUT_SECONDS = float(os.environ.get("THREAT_MODEL_RENDER_TIMEOUT_SECONDS", "60"))
+    THREAT_MODEL_RENDER_MAX_QUEUE_DEPTH = int(os.environ.get("THREAT_MODEL_RENDER_MAX_QUEUE_DEPTH", "8"))
 
     def build_llm_config(self):
+        # Agents share the clients and tokens in the registry, however many configs are built
+        from llm_clients import llm_client_registry
         if self.OPENAI_KEY:
             autogen_llm_config = {"model": "gpt-4o-mini", "api_key": self.OPENAI_KEY}
         elif self.AZURE_OPENAI_KEY and self.AZURE_OPENAI_ENDPOINT:
@@ -36,20 +92,17 @@ class Config:
                 "base_url": self.AZURE_OPENAI_ENDPOINT,
             }
         elif self.AZURE_MANAGED_IDENTITY_CLIENT_ID and self.AZURE_LLM_MODEL and self.AZURE_LLM_BASE_URL:
-            import azure.identity
             autogen_llm_config = {
                 "model": self.AZURE_LLM_MODEL,
                 "base_url": self.AZURE_LLM_BASE_URL,
                 "api_type": "azure",
                 "api_version": "2023-05-15",
                 "cache_seed": None,
-                "azure_ad_token_provider": azure.identity.get_bearer_token_provider(
-                    azure.identity.DefaultAzureCredential(
-                        managed_identity_client_id = self.AZURE_MANAGED_IDENTITY_CLIENT_ID,
-                        exclude_environment_credential = True
-                    ), "https://cognitiveservices.azure.com/.default"
+                "azure_ad_token_provider": llm_client_registry.get_token_provider(
+                    self.AZURE_MANAGED_IDENTITY_CLIENT_ID, "https://cognitiveservices.azure.com/.default"
                 )
             }
         else:
             raise ValueError("Neither OPENAI_KEY nor AZURE_OPENAI_KEY nor azure managed identity (AZURE_MANAGED_IDENTITY_CLIENT_ID, AZURE_LLM_MODEL, AZURE_LLM_BASE_URL) environment variables are set.")
+        autogen_llm_config["http_client"] = llm_client_registry.get_http_client(autogen_llm_config.get("base_url"), autogen_llm_config["model"])
         return autogen_llm_config
\ No newline at end of file
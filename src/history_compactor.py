@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+from autogen import OpenAIWrapper
+from autogen.code_utils import content_str
+from autogen.token_count_utils import count_token
+
+DATA_URI_PATTERN = re.compile(r"data:([\w.+-]+/[\w.+-]+)?(;[\w=.+-]+)*;base64,[A-Za-z0-9+/=]+")
+
+SUMMARY_PROMPT = """Summarize this part of a privacy review conversation between a user and review agents.
+Keep every fact about the system being reviewed, decisions, open questions and action items. Leave out greetings and repetition.
+Answer with the summary only."""
+
+
+def strip_images(content):
+    """
+    Replace inlined image data in a message's content with a short reference, so it is not resent to the LLM.
+    :param content: The message content, a string or a list of content parts.
+    :return: The content without image data.
+    """
+    if isinstance(content, str):
+        return DATA_URI_PATTERN.sub(lambda match: f"<image {match.group(1) or ''} omitted>", content)
+    if isinstance(content, list):
+        parts = []
+        for part in content:
+            if isinstance(part, dict) and part.get("type") == "image_url":
+                parts.append({"type": "text", "text": "<image omitted>"})
+            elif isinstance(part, dict) and part.get("type") == "text":
+                parts.append({**part, "text": strip_images(part.get("text", ""))})
+            else:
+                parts.append(part)
+        return parts
+    return content
+
+
+def build_summarize_function(llm_config: dict) -> Callable[[List[Dict]], str]:
+    """
+    Build a function that summarizes messages with the LLM in `llm_config`.
+    :param llm_config: The autogen LLM config from `Config.build_llm_config`.
+    :return: The summarize function.
+    """
+    client = OpenAIWrapper(config_list=[llm_config], cache_seed=None)
+
+    def summarize(messages: List[Dict]) -> str:
+        transcript = "\n\n".join(f"{message.get('name', 'User')}: {content_str(message.get('content'))}" for message in messages)
+        response = client.create(messages=[
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": transcript},
+        ])
+        return client.extract_text_or_completion_object(response)[0]
+    return summarize
+
+
+class HistoryCompactor:
+    """
+    Compacts a group chat's messages before they are resumed, so the prompts stop growing as a review goes on.
+    The last `keep_last_turns` to twice that many user turns are kept verbatim. Older turns are summarized in blocks of
+    `keep_last_turns`, which never change once complete, so each block is summarized once and then cached.
+    Image data is replaced by a reference, and the oldest messages are dropped when the result is over `max_tokens`.
+    """
+    def __init__(self, summarize: Optional[Callable[[List[Dict]], str]], user_name: str = "User", keep_last_turns: int = 4,
+                 max_tokens: int = 12000, cache_max_entries: int = 256):
+        self.summarize = summarize
+        self.user_name = user_name
+        self.keep_last_turns = keep_last_turns
+        self.max_tokens = max_tokens
+        self.cache_max_entries = cache_max_entries
+        self.summary_hits = 0
+        self.summary_misses = 0
+        self._summaries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _is_turn_start(self, message: Dict) -> bool:
+        # The user proxy's own messages are logged without a name
+        return message.get("name", self.user_name) == self.user_name
+
+    def _split_turns(self, messages: List[Dict]) -> List[List[Dict]]:
+        turns = []
+        for message in messages:
+            if not turns or self._is_turn_start(message):
+                turns.append([])
+            turns[-1].append(message)
+        return turns
+
+    def _summarize_block(self, block: List[Dict]) -> Optional[str]:
+        key = hashlib.sha256(json.dumps(block, sort_keys=True).encode()).hexdigest()
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is not None:
+                self._summaries.move_to_end(key)
+                self.summary_hits += 1
+                return summary
+            self.summary_misses += 1
+        try:
+            summary = self.summarize(block)
+        except Exception as e:
+            print(f"Failed to summarize the earlier messages, they are left out: {e}")
+            return None
+        with self._lock:
+            self._summaries[key] = summary
+            while len(self._summaries) > self.cache_max_entries:
+                self._summaries.popitem(last=False)
+        return summary
+
+    @staticmethod
+    def _count_tokens(message: Dict) -> int:
+        # Roughly the per message overhead of the chat format
+        return count_token(content_str(message.get("content"))) + 4
+
+    def _fit(self, messages: List[Dict]) -> List[Dict]:
+        tokens = [self._count_tokens(message) for message in messages]
+        total = sum(tokens)
+        first = 0
+        # The last message is always kept, the chat continues from it
+        while total > self.max_tokens and first < len(messages) - 1:
+            total -= tokens[first]
+            first += 1
+        return messages[first:]
+
+    async def a_compact(self, messages: List[Dict]) -> List[Dict]:
+        """
+        Compact a group chat's messages.
+        :param messages: The messages in order, they are not changed.
+        :return: The compacted messages.
+        """
+        messages = [{**message, "content": strip_images(message.get("content"))} for message in messages]
+        turns = self._split_turns(messages)
+        summarized_blocks = max(len(turns) - self.keep_last_turns, 0) // self.keep_last_turns if self.keep_last_turns > 0 else 0
+        if self.summarize is None or summarized_blocks == 0:
+            return self._fit(messages)
+
+        blocks = [
+            [message for turn in turns[i * self.keep_last_turns:(i + 1) * self.keep_last_turns] for message in turn]
+            for i in range(summarized_blocks)
+        ]
+        summaries = await asyncio.gather(*[asyncio.to_thread(self._summarize_block, block) for block in blocks])
+        compacted = [
+            # Without a name the message is resumed as the manager's
+            {"role": "assistant", "content": f"Summary of earlier messages:\n{summary}"}
+            for summary in summaries if summary
+        ]
+        compacted.extend(message for turn in turns[summarized_blocks * self.keep_last_turns:] for message in turn)
+        return self._fit(compacted)
@@ -0,0 +1,125 @@
+import threading
+import time
+from typing import Dict, Optional, Tuple
+import httpx
+
+from config import Config
+
+
+class _LimitedTransport(httpx.HTTPTransport):
+    """
+    An HTTP transport that sends at most as many requests at once as the shared limiter allows.
+    """
+    def __init__(self, limiter: threading.BoundedSemaphore, **kwargs):
+        super().__init__(**kwargs)
+        self.limiter = limiter
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        with self.limiter:
+            response = super().handle_request(request)
+            # The body is read while holding the limiter, so a slow stream still counts as in flight
+            response.read()
+            return response
+
+
+class SharedHttpClient(httpx.Client):
+    """
+    An httpx client that is shared by every agent using the same LLM endpoint and deployment.
+    autogen deep copies each agent's llm_config, so copying returns the client itself.
+    """
+    def __deepcopy__(self, _memo):
+        return self
+
+
+class CachedTokenProvider:
+    """
+    A bearer token provider that fetches a new Azure AD token only when the cached one is about to expire.
+    :param credential: The azure.identity credential.
+    :param scope: The token scope.
+    :param refresh_margin_seconds: How long before expiry the token is refreshed.
+    """
+    def __init__(self, credential, scope: str, refresh_margin_seconds: float = 300):
+        self.credential = credential
+        self.scope = scope
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.refreshes = 0
+        self._token = None
+        self._lock = threading.Lock()
+
+    def __call__(self) -> str:
+        with self._lock:
+            if self._token is None or self._token.expires_on - self.refresh_margin_seconds <= time.time():
+                self._token = self.credential.get_token(self.scope)
+                self.refreshes += 1
+            return self._token.token
+
+    def __deepcopy__(self, _memo):
+        return self
+
+
+class LlmClientRegistry:
+    """
+    Process wide HTTP clients and tokens for the LLM endpoints, so agents share keep-alive connections and Azure AD tokens
+    instead of each building its own.
+    All requests go through one limiter, which caps the LLM requests in flight across every agent and endpoint.
+    """
+    def __init__(self, max_concurrent_requests: int = 8, max_connections: int = 20, keepalive_expiry: float = 60):
+        self.max_connections = max_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.limiter = threading.BoundedSemaphore(max_concurrent_requests)
+        self._http_clients: Dict[Tuple[str, str], SharedHttpClient] = {}
+        self._token_providers: Dict[Tuple[Optional[str], str], CachedTokenProvider] = {}
+        self._lock = threading.Lock()
+
+    def get_http_client(self, endpoint: Optional[str], deployment: str) -> SharedHttpClient:
+        """
+        Get the shared HTTP client for an LLM endpoint and deployment.
+        :param endpoint: The base URL, or None for the OpenAI API.
+        :param deployment: The model or Azure deployment name.
+        :return: The HTTP client to set as `http_client` in the llm_config.
+        """
+        key = (endpoint or "", deployment)
+        with self._lock:
+            client = self._http_clients.get(key)
+            if client is None:
+                limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections,
+                                      keepalive_expiry=self.keepalive_expiry)
+                client = SharedHttpClient(transport=_LimitedTransport(self.limiter, limits=limits), limits=limits)
+                self._http_clients[key] = client
+            return client
+
+    def get_token_provider(self, managed_identity_client_id: Optional[str], scope: str) -> CachedTokenProvider:
+        """
+        Get the shared, caching Azure AD token provider for a managed identity.
+        :param managed_identity_client_id: The client id of the managed identity.
+        :param scope: The token scope.
+        :return: The token provider to set as `azure_ad_token_provider` in the llm_config.
+        """
+        key = (managed_identity_client_id, scope)
+        with self._lock:
+            provider = self._token_providers.get(key)
+            if provider is None:
+                import azure.identity
+                credential = azure.identity.DefaultAzureCredential(
+                    managed_identity_client_id = managed_identity_client_id,
+                    exclude_environment_credential = True
+                )
+                provider = CachedTokenProvider(credential, scope)
+                self._token_providers[key] = provider
+            return provider
+
+    def close(self):
+        with self._lock:
+            for client in self._http_clients.values():
+                client.close()
+            self._http_clients.clear()
+            for provider in self._token_providers.values():
+                provider.credential.close()
+            self._token_providers.clear()
+
+
+llm_client_registry = LlmClientRegistry(
+    max_concurrent_requests=Config.LLM_MAX_CONCURRENT_REQUESTS,
+    max_connections=Config.LLM_MAX_CONNECTIONS,
+    keepalive_expiry=Config.LLM_KEEPALIVE_EXPIRY_SECONDS,
+)
@@ -0,0 +1,356 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+from typing import Callable, Dict, List, Optional
+import numpy as np
+from autogen.agentchat.contrib.vectordb.base import Document, ItemID, QueryResults
+
+EMBEDDINGS_FILE = "embeddings.f32"
+DOCUMENTS_FILE = "documents.json"
+INDEX_FILE = "ivf.npz"
+# Rows assigned to centroids at a time, so large collections are not copied out of the memory map at once
+ASSIGN_BATCH_ROWS = 65536
+
+
+class HashingEmbeddingFunction:
+    """
+    Embeds text by hashing its words into a fixed number of buckets.
+    Needs no model or network access, so it is the default for on-prem use and for tests.
+    """
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def __call__(self, texts: List[str]) -> List[np.ndarray]:
+        embeddings = []
+        for text in texts:
+            embedding = np.zeros(self.dim, dtype=np.float32)
+            for word in re.findall(r"\w+", text.lower()):
+                bucket = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+                embedding[bucket % self.dim] += 1 if bucket & (1 << 63) else -1
+            embeddings.append(embedding)
+        return embeddings
+
+
+class _Collection:
+    """
+    The documents of one collection and their normalized embeddings.
+    Embeddings are rows of a memory-mapped float32 matrix. Deleted rows are masked out until the collection is compacted.
+    The IVF centroids are saved when trained, and the rows are listed under them again on load.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.dim = None
+        self.documents: List[Optional[dict]] = []
+        self.row_by_id: Dict[ItemID, int] = {}
+        self.matrix = None
+        self.live = np.zeros(0, dtype=bool)
+        # Bumped on every change, so callers can tell when cached results are stale
+        self.version = 0
+        self.centroids = None
+        self.lists = []
+        self.trained_count = 0
+
+    @property
+    def rows(self) -> int:
+        return len(self.documents)
+
+    @property
+    def count(self) -> int:
+        return len(self.row_by_id)
+
+    def load(self):
+        with open(os.path.join(self.path, DOCUMENTS_FILE), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.dim = data["dim"]
+        self.version = data.get("version", 0)
+        self.documents = data["documents"]
+        self.row_by_id = {document["id"]: row for row, document in enumerate(self.documents) if document is not None}
+        self.live = np.array([document is not None for document in self.documents], dtype=bool)
+        if self.dim is not None and self.rows:
+            self.matrix = np.memmap(os.path.join(self.path, EMBEDDINGS_FILE), dtype=np.float32, mode="r+").reshape(-1, self.dim)
+            self.live = np.concatenate([self.live, np.zeros(len(self.matrix) - self.rows, dtype=bool)])
+            index_path = os.path.join(self.path, INDEX_FILE)
+            if os.path.exists(index_path):
+                with np.load(index_path) as index:
+                    self.centroids = index["centroids"]
+                    self.trained_count = int(index["trained_count"])
+                self._build_lists()
+
+    def save(self):
+        if self.matrix is not None:
+            self.matrix.flush()
+        temp_path = os.path.join(self.path, DOCUMENTS_FILE + ".tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "version": self.version, "documents": self.documents}, f)
+        os.replace(temp_path, os.path.join(self.path, DOCUMENTS_FILE))
+
+    def _reserve(self, rows: int):
+        capacity = len(self.matrix) if self.matrix is not None else 0
+        if rows <= capacity:
+            return
+        new_capacity = max(rows, capacity * 2, 64)
+        if self.matrix is not None:
+            self.matrix.flush()
+            self.matrix = None
+        with open(os.path.join(self.path, EMBEDDINGS_FILE), "ab") as f:
+            f.truncate(new_capacity * self.dim * 4)
+        self.matrix = np.memmap(os.path.join(self.path, EMBEDDINGS_FILE), dtype=np.float32, mode="r+").reshape(-1, self.dim)
+        self.live = np.concatenate([self.live, np.zeros(new_capacity - len(self.live), dtype=bool)])
+
+    def put(self, document: Document, embedding: np.ndarray):
+        if self.dim is None:
+            self.dim = len(embedding)
+        elif len(embedding) != self.dim:
+            raise ValueError(f"Expected an embedding of size {self.dim}, got {len(embedding)}.")
+        row = self.row_by_id.get(document["id"])
+        if row is None:
+            row = self.rows
+            self._reserve(row + 1)
+            self.documents.append(None)
+            self.row_by_id[document["id"]] = row
+            if self.centroids is not None:
+                self.lists[self._assign(embedding[None, :])[0]].append(row)
+        elif self.centroids is not None:
+            # The document moves to the list of its new embedding's centroid
+            for rows in self.lists:
+                if row in rows:
+                    rows.remove(row)
+            self.lists[self._assign(embedding[None, :])[0]].append(row)
+        self.matrix[row] = embedding
+        self.live[row] = True
+        self.documents[row] = {"id": document["id"], "content": document.get("content", ""), "metadata": document.get("metadata")}
+
+    def delete(self, document_id: ItemID):
+        row = self.row_by_id.pop(document_id, None)
+        if row is not None:
+            self.documents[row] = None
+            self.live[row] = False
+
+    def compact(self):
+        live_rows = [row for row, document in enumerate(self.documents) if document is not None]
+        if len(live_rows) == self.rows:
+            return
+        embeddings = np.array(self.matrix[live_rows]) if live_rows else None
+        self.documents = [self.documents[row] for row in live_rows]
+        self.row_by_id = {document["id"]: row for row, document in enumerate(self.documents)}
+        self.matrix = None
+        os.remove(os.path.join(self.path, EMBEDDINGS_FILE))
+        self.live = np.zeros(0, dtype=bool)
+        if embeddings is not None:
+            self._reserve(len(live_rows))
+            self.matrix[:len(live_rows)] = embeddings
+            self.live[:len(live_rows)] = True
+        self._set_centroids(None)
+
+    def _set_centroids(self, centroids: Optional[np.ndarray]):
+        self.centroids = centroids
+        index_path = os.path.join(self.path, INDEX_FILE)
+        if centroids is None:
+            self.lists = []
+            self.trained_count = 0
+            if os.path.exists(index_path):
+                os.remove(index_path)
+            return
+        temp_path = index_path + ".tmp"
+        with open(temp_path, "wb") as f:
+            np.savez(f, centroids=centroids, trained_count=self.trained_count)
+        os.replace(temp_path, index_path)
+
+    def _build_lists(self):
+        live_rows = np.flatnonzero(self.live[:self.rows])
+        self.lists = [[] for _ in range(len(self.centroids))]
+        for start in range(0, len(live_rows), ASSIGN_BATCH_ROWS):
+            batch = live_rows[start:start + ASSIGN_BATCH_ROWS]
+            for row, index in zip(batch.tolist(), self._assign(np.asarray(self.matrix[batch])).tolist()):
+                self.lists[index].append(row)
+
+    def _assign(self, embeddings: np.ndarray) -> np.ndarray:
+        return np.argmax(embeddings @ self.centroids.T, axis=1)
+
+    def train(self, n_lists: int, iterations: int = 10, sample_size: int = 20000):
+        """
+        Build the inverted file index: a spherical k-means clustering of the embeddings, with each row listed under its
+        nearest centroid. Queries then only score the rows of the centroids closest to them.
+        """
+        live_rows = np.flatnonzero(self.live[:self.rows])
+        rng = np.random.default_rng(0)
+        sample = np.asarray(self.matrix[rng.choice(live_rows, size=min(sample_size, len(live_rows)), replace=False)])
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)]
+        for _ in range(iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            for index in range(n_lists):
+                members = sample[assignments == index]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[index] = centroid / max(np.linalg.norm(centroid), 1e-12)
+        self.trained_count = len(live_rows)
+        self._set_centroids(centroids)
+        self._build_lists()
+
+    def get_candidates(self, query: np.ndarray, n_probe: int) -> np.ndarray:
+        closest = np.argsort(-(self.centroids @ query))[:n_probe]
+        rows = np.array([row for index in closest for row in self.lists[index]], dtype=np.int64)
+        return rows[self.live[rows]] if len(rows) else rows
+
+
+class LocalVectorDB:
+    """
+    A `VectorDB` stored in local files, for on-prem retrieval without network access.
+    Each collection is a directory with a memory-mapped embedding matrix and a JSON file of the documents.
+    Collections with more than `exact_search_max_docs` documents are searched through an inverted file (IVF) index of
+    `sqrt(count)` clusters, probing the `n_probe` closest ones. Distances are cosine distances, 0 being the most similar.
+    """
+    type = "local"
+
+    def __init__(self, path: str, embedding_function: Optional[Callable[[List[str]], List]] = None,
+                 exact_search_max_docs: int = 2048, n_probe: int = 8):
+        self.path = path
+        self.embedding_function = embedding_function or HashingEmbeddingFunction()
+        self.exact_search_max_docs = exact_search_max_docs
+        self.n_probe = n_probe
+        self.active_collection = None
+        self._collections: Dict[str, _Collection] = {}
+        self._lock = threading.RLock()
+        os.makedirs(self.path, exist_ok=True)
+
+    def _get_collection_path(self, collection_name: str) -> str:
+        return os.path.join(self.path, collection_name)
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        embeddings = np.asarray(self.embedding_function(texts), dtype=np.float32).reshape(len(texts), -1)
+        return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+    def create_collection(self, collection_name: str, overwrite: bool = False, get_or_create: bool = True):
+        with self._lock:
+            path = self._get_collection_path(collection_name)
+            exists = os.path.exists(os.path.join(path, DOCUMENTS_FILE))
+            if exists and overwrite:
+                self.delete_collection(collection_name)
+                exists = False
+            if exists:
+                if not get_or_create:
+                    raise ValueError(f"Collection {collection_name} already exists.")
+                return self.get_collection(collection_name)
+            os.makedirs(path, exist_ok=True)
+            collection = _Collection(path)
+            collection.save()
+            self._collections[collection_name] = collection
+            self.active_collection = collection_name
+            return collection_name
+
+    def get_collection(self, collection_name: str = None):
+        with self._lock:
+            collection_name = collection_name or self.active_collection
+            self._get(collection_name)
+            self.active_collection = collection_name
+            return collection_name
+
+    def _get(self, collection_name: str) -> _Collection:
+        collection = self._collections.get(collection_name)
+        if collection is None:
+            path = self._get_collection_path(collection_name) if collection_name else None
+            if not path or not os.path.exists(os.path.join(path, DOCUMENTS_FILE)):
+                raise ValueError(f"Collection {collection_name} does not exist.")
+            collection = _Collection(path)
+            collection.load()
+            self._collections[collection_name] = collection
+        return collection
+
+    def delete_collection(self, collection_name: str):
+        with self._lock:
+            collection = self._collections.pop(collection_name, None)
+            if collection is not None:
+                collection.matrix = None
+            shutil.rmtree(self._get_collection_path(collection_name), ignore_errors=True)
+            if self.active_collection == collection_name:
+                self.active_collection = None
+
+    def _write(self, docs: List[Document], collection_name: str, insert: bool, update: bool):
+        with self._lock:
+            collection = self._get(collection_name or self.active_collection)
+            for document in docs:
+                exists = document["id"] in collection.row_by_id
+                if exists and not update:
+                    raise ValueError(f"Document {document['id']} already exists.")
+                if not exists and not insert:
+                    raise ValueError(f"Document {document['id']} does not exist.")
+            missing = [document for document in docs if document.get("embedding") is None]
+            embeddings = dict(zip((document["id"] for document in missing), self._embed([document.get("content", "") for document in missing]))) if missing else {}
+            for document in docs:
+                embedding = embeddings.get(document["id"])
+                if embedding is None:
+                    embedding = np.asarray(document["embedding"], dtype=np.float32)
+                    embedding = embedding / max(np.linalg.norm(embedding), 1e-12)
+                collection.put(document, embedding)
+            collection.version += 1
+            collection.save()
+
+    def insert_docs(self, docs: List[Document], collection_name: str = None, upsert: bool = False, **kwargs):
+        self._write(docs, collection_name, insert=True, update=upsert)
+
+    def update_docs(self, docs: List[Document], collection_name: str = None, **kwargs):
+        self._write(docs, collection_name, insert=False, update=True)
+
+    def delete_docs(self, ids: List[ItemID], collection_name: str = None, **kwargs):
+        with self._lock:
+            collection = self._get(collection_name or self.active_collection)
+            for document_id in ids:
+                collection.delete(document_id)
+            if collection.rows > 64 and collection.count < collection.rows / 2:
+                collection.compact()
+            collection.version += 1
+            collection.save()
+
+    def get_docs_by_ids(self, ids: List[ItemID] = None, collection_name: str = None, include=None, **kwargs) -> List[Document]:
+        with self._lock:
+            collection = self._get(collection_name or self.active_collection)
+            rows = collection.row_by_id.values() if ids is None else [collection.row_by_id[document_id] for document_id in ids if document_id in collection.row_by_id]
+            include = include or ["documents", "metadatas"]
+            documents = []
+            for row in rows:
+                document = collection.documents[row]
+                documents.append({
+                    "id": document["id"],
+                    "content": document["content"] if "documents" in include else None,
+                    "metadata": document["metadata"] if "metadatas" in include else None,
+                    "embedding": np.array(collection.matrix[row]).tolist() if "embeddings" in include else None,
+                })
+            return documents
+
+    def get_index_name(self, collection_name: str = None) -> str:
+        # Identifies the current contents, for caches scoped to what the answers came from
+        with self._lock:
+            collection_name = collection_name or self.active_collection
+            return f"local-{collection_name}-{self._get(collection_name).version}"
+
+    def retrieve_docs(self, queries: List[str], collection_name: str = None, n_results: int = 10, distance_threshold: float = -1, **kwargs) -> QueryResults:
+        """
+        Find the documents closest to each query, nearest first. The results are in the same order as `queries`.
+        :param distance_threshold: Only documents with a distance up to this are returned. Not applied when negative.
+        """
+        with self._lock:
+            collection = self._get(collection_name or self.active_collection)
+            if collection.count == 0:
+                return [[] for _ in queries]
+            embeddings = self._embed(queries)
+            if collection.count > self.exact_search_max_docs and (collection.centroids is None or collection.count > 2 * collection.trained_count):
+                collection.train(int(np.sqrt(collection.count)))
+            results = []
+            for query in embeddings:
+                if collection.count > self.exact_search_max_docs:
+                    rows = collection.get_candidates(query, self.n_probe)
+                else:
+                    rows = np.flatnonzero(collection.live[:collection.rows])
+                distances = 1 - np.asarray(collection.matrix[rows]) @ query
+                order = np.argsort(distances, kind="stable")[:n_results]
+                documents = []
+                for index in order.tolist():
+                    if distance_threshold >= 0 and distances[index] > distance_threshold:
+                        break
+                    document = collection.documents[rows[index]]
+                    documents.append(({"id": document["id"], "content": document["content"], "metadata": document["metadata"], "embedding": None}, float(distances[index])))
+                results.append(documents)
+            return results
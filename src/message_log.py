@@ -0,0 +1,207 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+from config import Config
+
+
+class MessageLog(ABC):
+    """
+    An append-only log of each conversation's group chat messages, numbered by sequence.
+    A turn appends only the messages it added, instead of the state rewriting the whole transcript.
+    Loading reads only the messages this process has not loaded before, the rest come from a cache of
+    the `cache_max_conversations` most recent conversations.
+    """
+    def __init__(self, cache_max_conversations: int = 64):
+        self.cache_max_conversations = cache_max_conversations
+        # conversation id -> (first sequence number, next sequence number, messages)
+        self._cache: OrderedDict = OrderedDict()
+
+    @abstractmethod
+    async def _append(self, conversation_id: str, messages: List[Dict]) -> int:
+        """
+        Append messages to a conversation's log.
+        :return: The sequence number of the first appended message.
+        """
+
+    @abstractmethod
+    async def _read(self, conversation_id: str, from_seq: int) -> List[Tuple[int, Dict]]:
+        """
+        Read a conversation's messages from a sequence number on, in order.
+        """
+
+    @abstractmethod
+    async def _get_next_seq(self, conversation_id: str) -> int:
+        pass
+
+    @abstractmethod
+    async def _truncate(self, conversation_id: str, before_seq: int):
+        pass
+
+    def _cache_put(self, conversation_id: str, start_seq: int, next_seq: int, messages: List[Dict]):
+        self._cache[conversation_id] = (start_seq, next_seq, messages)
+        self._cache.move_to_end(conversation_id)
+        while len(self._cache) > self.cache_max_conversations:
+            self._cache.popitem(last=False)
+
+    async def a_start(self, conversation_id: str) -> int:
+        """
+        Start a new group chat in a conversation, dropping the messages of the previous one.
+        :param conversation_id: The conversation id.
+        :return: The sequence number the new chat starts at, to keep in the conversation state.
+        """
+        start_seq = await self._get_next_seq(conversation_id)
+        await self._truncate(conversation_id, start_seq)
+        self._cache_put(conversation_id, start_seq, start_seq, [])
+        return start_seq
+
+    async def a_append(self, conversation_id: str, messages: List[Dict]):
+        if not messages:
+            return
+        first_seq = await self._append(conversation_id, messages)
+        cached = self._cache.get(conversation_id)
+        if cached is not None and cached[1] == first_seq:
+            self._cache_put(conversation_id, cached[0], first_seq + len(messages), cached[2] + messages)
+        else:
+            self._cache.pop(conversation_id, None)
+
+    async def a_load(self, conversation_id: str, start_seq: int) -> List[Dict]:
+        """
+        Load a group chat's messages.
+        :param conversation_id: The conversation id.
+        :param start_seq: The sequence number the chat started at.
+        :return: The messages in order.
+        """
+        cached = self._cache.get(conversation_id)
+        if cached is None or cached[0] != start_seq:
+            cached = (start_seq, start_seq, [])
+        _, next_seq, messages = cached
+        # Another process may have appended since, so the tail is always read
+        tail = await self._read(conversation_id, next_seq)
+        if tail:
+            messages = messages + [message for _, message in tail]
+            next_seq = tail[-1][0] + 1
+        self._cache_put(conversation_id, start_seq, next_seq, messages)
+        return messages[:]
+
+
+class MemoryMessageLog(MessageLog):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # conversation id -> (first sequence number, messages)
+        self._logs: Dict[str, Tuple[int, List[str]]] = {}
+
+    async def _append(self, conversation_id: str, messages: List[Dict]) -> int:
+        start_seq, log = self._logs.setdefault(conversation_id, (0, []))
+        first_seq = start_seq + len(log)
+        # Stored serialized, like the other logs, so later changes to the messages are not logged
+        log.extend(json.dumps(message) for message in messages)
+        return first_seq
+
+    async def _read(self, conversation_id: str, from_seq: int) -> List[Tuple[int, Dict]]:
+        start_seq, log = self._logs.get(conversation_id, (0, []))
+        first = max(from_seq - start_seq, 0)
+        return [(start_seq + i, json.loads(message)) for i, message in enumerate(log[first:], first)]
+
+    async def _get_next_seq(self, conversation_id: str) -> int:
+        start_seq, log = self._logs.get(conversation_id, (0, []))
+        return start_seq + len(log)
+
+    async def _truncate(self, conversation_id: str, before_seq: int):
+        start_seq, log = self._logs.get(conversation_id, (0, []))
+        drop = min(max(before_seq - start_seq, 0), len(log))
+        self._logs[conversation_id] = (start_seq + drop, log[drop:])
+
+
+class SqliteMessageLog(MessageLog):
+    """
+    Keeps the message logs in SQLite files next to the bot state, sharded by conversation id.
+    """
+    def __init__(self, path: str, shards: int = 8, **kwargs):
+        super().__init__(**kwargs)
+        os.makedirs(path, exist_ok=True)
+        self._connections = []
+        for i in range(shards):
+            connection = sqlite3.connect(os.path.join(path, f"messages-{i}.sqlite3"), check_same_thread=False, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS messages (conversation_id TEXT NOT NULL, seq INTEGER NOT NULL, message TEXT NOT NULL, PRIMARY KEY (conversation_id, seq))")
+            # Sequence numbers keep growing after a truncation, so a stale start never reads a newer chat
+            connection.execute("CREATE TABLE IF NOT EXISTS heads (conversation_id TEXT PRIMARY KEY, next_seq INTEGER NOT NULL)")
+            self._connections.append(connection)
+        self._locks = [threading.Lock() for _ in range(shards)]
+        self._executor = ThreadPoolExecutor(max_workers=shards, thread_name_prefix="message-log")
+
+    async def _run(self, conversation_id: str, fn, *args):
+        shard = zlib.crc32(conversation_id.encode()) % len(self._connections)
+
+        def run():
+            with self._locks[shard]:
+                return fn(self._connections[shard], conversation_id, *args)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, run)
+
+    @staticmethod
+    def _next_seq(connection: sqlite3.Connection, conversation_id: str) -> int:
+        row = connection.execute("SELECT next_seq FROM heads WHERE conversation_id = ?", (conversation_id,)).fetchone()
+        return row[0] if row is not None else 0
+
+    @classmethod
+    def _append_messages(cls, connection: sqlite3.Connection, conversation_id: str, messages: List[Dict]) -> int:
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            first_seq = cls._next_seq(connection, conversation_id)
+            connection.executemany(
+                "INSERT INTO messages (conversation_id, seq, message) VALUES (?, ?, ?)",
+                [(conversation_id, first_seq + i, json.dumps(message)) for i, message in enumerate(messages)]
+            )
+            connection.execute("INSERT OR REPLACE INTO heads (conversation_id, next_seq) VALUES (?, ?)", (conversation_id, first_seq + len(messages)))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return first_seq
+
+    @staticmethod
+    def _read_messages(connection: sqlite3.Connection, conversation_id: str, from_seq: int) -> List[Tuple[int, Dict]]:
+        rows = connection.execute(
+            "SELECT seq, message FROM messages WHERE conversation_id = ? AND seq >= ? ORDER BY seq", (conversation_id, from_seq)
+        ).fetchall()
+        return [(seq, json.loads(message)) for seq, message in rows]
+
+    @staticmethod
+    def _truncate_messages(connection: sqlite3.Connection, conversation_id: str, before_seq: int):
+        connection.execute("DELETE FROM messages WHERE conversation_id = ? AND seq < ?", (conversation_id, before_seq))
+
+    async def _append(self, conversation_id: str, messages: List[Dict]) -> int:
+        return await self._run(conversation_id, self._append_messages, messages)
+
+    async def _read(self, conversation_id: str, from_seq: int) -> List[Tuple[int, Dict]]:
+        return await self._run(conversation_id, self._read_messages, from_seq)
+
+    async def _get_next_seq(self, conversation_id: str) -> int:
+        return await self._run(conversation_id, self._next_seq)
+
+    async def _truncate(self, conversation_id: str, before_seq: int):
+        await self._run(conversation_id, self._truncate_messages, before_seq)
+
+    async def a_close(self):
+        self._executor.shutdown(wait=True)
+        for connection in self._connections:
+            connection.close()
+
+
+def build_message_log() -> MessageLog:
+    """
+    Build the message log that goes with the storage selected by `Config.STATE_STORAGE`.
+    :return: The message log.
+    """
+    if Config.STATE_STORAGE == "sqlite":
+        return SqliteMessageLog(Config.STATE_STORAGE_PATH, shards=Config.STATE_STORAGE_SHARDS)
+    return MemoryMessageLog()
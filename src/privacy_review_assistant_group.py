@@ -1,19 +1,28 @@
+import asyncio
 from autogen import AssistantAgent, GroupChat, GroupChatManager, Agent
 from botbuilder.core import TurnContext
 
+from agent_graph import AgentGraph
 from state import AppTurnState
 from rag_agents import setup_rag_assistant
 from threat_model_reviewer_group import ThreatModelReviewerGroup
-from threat_model_visualizer import ThreatModelImageVisualizerCapability
+from threat_model_visualizer import ThreatModelImageVisualizer, ThreatModelImageVisualizerCapability
 
 class PrivacyReviewAssistantGroup:
     def __init__(self, llm_config):
         self.llm_config = llm_config
+        self.threat_model_reviewer_group = ThreatModelReviewerGroup(llm_config=self.llm_config)
         
-    def group_chat_builder(self, context: TurnContext, state: AppTurnState, user_agent: Agent) -> GroupChat:
-        rag_assistant = setup_rag_assistant(self.llm_config)
-        threat_modeling_assistant = self.setup_threat_modeling_assistant(context, state, user_agent)
-        visualizer_agent = self.setup_visualizer_assistant(context, state, user_agent)
+    async def prepare_turn(self, context: TurnContext, state: AppTurnState):
+        await asyncio.gather(
+            ThreatModelImageVisualizer(state).a_prerender(),
+            self.threat_model_reviewer_group.prepare_turn(context, state),
+        )
+
+    def group_chat_builder(self, user_agent: Agent, graph: AgentGraph) -> GroupChat:
+        rag_assistant = setup_rag_assistant(self.llm_config, graph)
+        threat_modeling_assistant = self.setup_threat_modeling_assistant(user_agent, graph)
+        visualizer_agent = self.setup_visualizer_assistant(graph)
         group = GroupChat(
             agents=[user_agent, rag_assistant, threat_modeling_assistant, visualizer_agent],
             messages=[],
@@ -29,7 +38,7 @@ class PrivacyReviewAssistantGroup:
         
         return group
     
-    def setup_threat_modeling_assistant(self, context: TurnContext, state: AppTurnState, user_agent: Agent) -> Agent:
+    def setup_threat_modeling_assistant(self, user_agent: Agent, graph: AgentGraph) -> Agent:
         def terminate_chat(message):
             message_sender_name = message.get("name", "")
             return message_sender_name != user_agent.name
@@ -39,11 +48,12 @@ class PrivacyReviewAssistantGroup:
             is_termination_msg=terminate_chat
         )
         
-        threat_modeling_group = ThreatModelReviewerGroup(llm_config=self.llm_config).group_chat_builder(context, state, assistant)
+        threat_modeling_group = self.threat_model_reviewer_group.group_chat_builder(assistant, graph)
         threat_modeling_group_manager = GroupChatManager(
             groupchat=threat_modeling_group,
             llm_config=self.llm_config,
         )
+        graph.add_group_chat(threat_modeling_group, threat_modeling_group_manager)
         def trigger(sender):
             return sender not in [assistant]
         assistant.register_nested_chats([
@@ -56,11 +66,12 @@ class PrivacyReviewAssistantGroup:
         ], trigger=trigger)
         return assistant
 
-    def setup_visualizer_assistant(self, _context: TurnContext, state: AppTurnState, _user_agent: Agent) -> Agent:        
+    def setup_visualizer_assistant(self, graph: AgentGraph) -> Agent:
         visualizer_assistant = AssistantAgent(
             name="Visualizer",
             description="An agent that visualizes the threat model.",
         )
-        visualizer_capability = ThreatModelImageVisualizerCapability(state=state)
+        visualizer_capability = ThreatModelImageVisualizerCapability()
         visualizer_capability.add_to_agent(visualizer_assistant)
+        graph.on_bind(lambda _context, state: visualizer_capability.bind(state))
         return visualizer_assistant
\ No newline at end of file
@@ -1,22 +1,39 @@
+import asyncio
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
+from functools import lru_cache, partial
 import re
 import os
-from typing import List, Union, Tuple
+import time
+from typing import Any, Callable, List, Union, Tuple
 from autogen.agentchat.contrib.vectordb.base import QueryResults, VectorDB, Document
 from autogen.agentchat.contrib.retrieve_user_proxy_agent import RetrieveUserProxyAgent
 from autogen.agentchat.contrib.retrieve_assistant_agent import RetrieveAssistantAgent
 from autogen import AssistantAgent, ConversableAgent
-from azure.core.credentials import AzureKeyCredential
-from azure.search.documents import SearchClient
+from autogen.token_count_utils import count_token
 from azure.core.exceptions import ResourceNotFoundError
+from agent_graph import AgentGraph
 from config import Config
+from local_vector_db import LocalVectorDB
+from rag_answer_cache import RagAnswerCache, build_embedding_function
+from search_client_pool import SearchClientPool
+from search_index_resolver import SearchIndexResolver
 
-def build_config(suffix: str, previous_day_index: int = 0):
+search_client_pool = SearchClientPool(
+    Config.AZURE_SEARCH_SERVICE_ENDPOINT,
+    Config.AZURE_SEARCH_API_KEY,
+    pool_size=Config.AZURE_SEARCH_POOL_SIZE,
+    connection_timeout=Config.AZURE_SEARCH_CONNECTION_TIMEOUT_SECONDS,
+    read_timeout=Config.AZURE_SEARCH_READ_TIMEOUT_SECONDS,
+)
+
+def build_config(suffix: str, previous_day_index: int = 0, date: datetime = None):
     if os.getenv("SEARCH_INDEX_PREFIX") is not None:
         return f"{os.getenv('SEARCH_INDEX_PREFIX')}-{suffix}"
     # Get the current date
-    date = datetime.now()
-    date = date - timedelta(days=previous_day_index)
+    if date is None:
+        date = datetime.now()
+        date = date - timedelta(days=previous_day_index)
 
     # Format the date as YYYYMMDD
     formatted_date = date.strftime("%Y%m%d")
@@ -25,7 +42,44 @@ def build_config(suffix: str, previous_day_index: int = 0):
     return f"{formatted_date}-{suffix}"
     
 
+search_index_resolver = SearchIndexResolver(
+    search_client_pool,
+    # index name is YYYYMMDD-1-home-index
+    lambda date: build_config("1-home-index", date=date),
+    ttl_seconds=Config.AZURE_SEARCH_INDEX_TTL_SECONDS,
+)
+
+@lru_cache(maxsize=None)
+def get_rag_answer_cache() -> RagAnswerCache:
+    # Built on first use rather than at import, so importing this module does not build an LLM config
+    return RagAnswerCache(
+        max_entries=Config.RAG_ANSWER_CACHE_MAX_ENTRIES,
+        ttl_seconds=Config.RAG_ANSWER_CACHE_TTL_SECONDS,
+        similarity_threshold=Config.RAG_ANSWER_CACHE_SIMILARITY_THRESHOLD,
+        embedding_function=build_embedding_function(Config().build_llm_config(), Config.RAG_ANSWER_CACHE_EMBEDDING_MODEL) if Config.RAG_ANSWER_CACHE_EMBEDDING_MODEL else None,
+    )
+
+local_vector_db = None
+if Config.RAG_VECTOR_DB == "local":
+    local_vector_db = LocalVectorDB(
+        Config.RAG_LOCAL_VECTOR_DB_PATH,
+        # Without an embedding model, words are hashed into embeddings locally
+        embedding_function=build_embedding_function(Config().build_llm_config(), Config.RAG_LOCAL_VECTOR_DB_EMBEDDING_MODEL) if Config.RAG_LOCAL_VECTOR_DB_EMBEDDING_MODEL else None,
+    )
+    local_vector_db.create_collection(Config.RAG_LOCAL_VECTOR_DB_COLLECTION, get_or_create=True)
+
+# Shared by all AzureAISearch instances, so the concurrency limit holds across conversations
+search_executor = ThreadPoolExecutor(max_workers=Config.AZURE_SEARCH_MAX_CONCURRENT_QUERIES, thread_name_prefix="azure-search")
+
 class AzureAISearch(VectorDB):
+    def __init__(self, client_pool: SearchClientPool = search_client_pool, index_resolver: SearchIndexResolver = search_index_resolver,
+                 executor: ThreadPoolExecutor = search_executor, query_timeout: float = Config.AZURE_SEARCH_QUERY_TIMEOUT_SECONDS, max_context_tokens: int = Config.RAG_CONTEXT_MAX_TOKENS):
+        self.client_pool = client_pool
+        self.index_resolver = index_resolver
+        self.executor = executor
+        self.query_timeout = query_timeout
+        self.max_context_tokens = max_context_tokens
+
     def create_collection(self, collection_name: str, overwrite: bool = False, get_or_create: bool = True):
         pass
     
@@ -51,63 +105,148 @@ class AzureAISearch(VectorDB):
         queries: List[str],
         collection_name: Union[str, None] = None,
         n_results: int = 10,
-        distance_threshold: float = 0,
+        distance_threshold: float = -1,
         **kwargs,
     ) -> QueryResults:
-        documents_all: List[List[Tuple[Document, float]]] = []
-        count = 0
-        for query in queries:
-            documents: List[Tuple[Document, float]] = []
-            for result in self._search(query):
-                documents.append(({
-                    "id": result["id"],
-                    "content": " ".join(c.text for c in result["@search.captions"]),
-                    "metadata": None,
-                    "embedding": None
-                }, result["@search.score"]))
-                count = count + 1
-            documents_all.append(documents)
-        return documents_all
-    
-    def _search(self, query: str, previous_day_index: int = 0):
+        """
+        Search for all queries concurrently. The results are in the same order as `queries`.
+        A query that fails or times out gets no documents, unless every query failed.
+        :param n_results: The number of documents to request for each query.
+        :param distance_threshold: Only documents with a distance up to this are returned. Not applied when negative.
+        """
+        results = self._run_queries(queries, partial(self._search, top=n_results))
+        return self._get_query_results(results, distance_threshold)
+
+    def _get_query_results(self, results, distance_threshold: float) -> QueryResults:
+        # Captions already used for an earlier document or query are dropped, so the same passage is only sent once,
+        # and the documents of all queries share one token budget
+        seen_captions = []
+        tokens = 0
+        query_results = []
+        for response in results:
+            documents, tokens = self._get_documents(response, distance_threshold, seen_captions, tokens)
+            query_results.append(documents)
+        return query_results
+
+    def _get_documents(self, response, distance_threshold: float, seen_captions: List[str], tokens: int) -> Tuple[List[Tuple[Document, float]], int]:
+        documents: List[Tuple[Document, float]] = []
+        for result in response:
+            # The semantic reranker scores from 0 to 4, higher is more relevant.
+            # The search service cannot filter on the reranker score, so the threshold is applied here.
+            distance = 1 - (result.get("@search.rerankerScore") or 0) / 4
+            if distance_threshold >= 0 and distance > distance_threshold:
+                continue
+            captions = []
+            for caption in result["@search.captions"] or []:
+                text = " ".join(caption.text.split())
+                if text and not self._is_seen_caption(text.lower(), seen_captions):
+                    captions.append(text)
+                    seen_captions.append(text.lower())
+            if not captions:
+                continue
+            content = " ".join(captions)
+            content_tokens = count_token(content)
+            if tokens + content_tokens > self.max_context_tokens:
+                break
+            tokens += content_tokens
+            documents.append(({
+                "id": result["id"],
+                "content": content,
+                "metadata": None,
+                "embedding": None
+            }, distance))
+        return documents, tokens
+
+    def _is_seen_caption(self, text: str, seen_captions: List[str]) -> bool:
+        # A caption that contains, or is contained in, one already used adds nothing new
+        return any(text in seen or seen in text for seen in seen_captions)
+
+    def _run_queries(self, queries: List[str], search: Callable[[str], Any]) -> List[Any]:
+        started = {}
+
+        def run(index: int, query: str):
+            started[index] = time.monotonic()
+            return search(query)
+
+        futures = {self.executor.submit(run, index, query): index for index, query in enumerate(queries)}
+        results: List[Any] = [None] * len(queries)
+        pending = set(futures)
+        while pending:
+            # Each query's timeout starts when a worker picks it up, not while it waits for a free one
+            deadlines = [started[futures[future]] + self.query_timeout for future in pending if futures[future] in started]
+            wait_time = max(min(deadlines) - time.monotonic(), 0) if deadlines else self.query_timeout
+            done, pending = wait(pending, timeout=wait_time, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[futures[future]] = future.exception() or future.result()
+            now = time.monotonic()
+            for future in [future for future in pending if futures[future] in started and now - started[futures[future]] >= self.query_timeout]:
+                # The worker finishes the request in the background and its result is dropped
+                pending.remove(future)
+                results[futures[future]] = TimeoutError(f"Search timed out after {self.query_timeout} seconds.")
+        return self._check_results(queries, results)
+
+    def _check_results(self, queries: List[str], results: List[Any]) -> List[Any]:
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors and len(errors) == len(results):
+            raise errors[0]
+        for query, result in zip(queries, results):
+            if isinstance(result, BaseException):
+                print(f"Search failed for query {query!r}: {result!r}")
+        return [[] if isinstance(result, BaseException) else result for result in results]
+
+    def get_index_name(self) -> str:
+        return build_config("1-home-index", date=self.index_resolver.get_index_date())
+
+    def _get_search_args(self, query: str, index_date: datetime, top: int):
+        index_name = build_config("1-home-index", date=index_date)
+        semantic_search_config = build_config("1-home-index-sc", date=index_date)
+        return index_name, {
+            "search_text": query,
+            "query_type": "semantic",
+            "semantic_configuration_name": semantic_search_config,
+            # Only the captions are used, so no answers are requested and captions come without highlight tags
+            "query_caption": "extractive|highlight-false",
+            "top": top,
+        }
+
+    def _search(self, query: str, top: int = 5, retry: bool = True):
         print("Performing search!")
-        search_endpoint = Config.AZURE_SEARCH_SERVICE_ENDPOINT
-        # index name is YYYYMMDD-1-home-index
-        index_name = build_config("1-home-index", previous_day_index=previous_day_index)
-        api_key = Config.AZURE_SEARCH_API_KEY
-        semantic_search_config = build_config("1-home-index-sc", previous_day_index=previous_day_index)
-        
-        if not api_key:
-            raise ValueError("No Azure Search API key provided.")
-        
-        search_client = SearchClient(search_endpoint, index_name, AzureKeyCredential(api_key))
+        index_date = self.index_resolver.get_index_date()
+        index_name, search_args = self._get_search_args(query, index_date, top)
         try:
-            raw_response = search_client.search(search_text=query,
-                query_type="semantic",
-                semantic_configuration_name=semantic_search_config,
-                query_caption="extractive",
-                query_answer="extractive|count-3",
-                top=5)
-            response = list(raw_response)
-        except Exception as e:
-            if previous_day_index <= 2 and isinstance(e, ResourceNotFoundError):
-                print(f"Resource not found error. Retrying with previous day. (curr_day - {previous_day_index})")
-                return self._search(query, previous_day_index=previous_day_index + 1)
+            search_client = self.client_pool.get_client(index_name)
+            response = list(search_client.search(**search_args))
+        except ResourceNotFoundError as e:
+            if retry:
+                # The resolved index was removed since it was found, so look for the newest one again
+                print(f"Search index {index_name} no longer exists.")
+                self.index_resolver.invalidate(index_date)
+                return self._search(query, top=top, retry=False)
             raise e
-            
-        output = []
-        for result in response:
-            output.append(result)
-        return output
+        return response
 
-def setup_rag_assistant(llm_config):
-    db = AzureAISearch()
+def build_retrieve_config():
+    if local_vector_db is not None:
+        return local_vector_db, {
+            "collection_name": Config.RAG_LOCAL_VECTOR_DB_COLLECTION,
+            # When set, new and changed files in this directory are added to the collection
+            "docs_path": Config.RAG_LOCAL_VECTOR_DB_DOCS_PATH,
+            "get_or_create": True,
+        }
+    return AzureAISearch(), {}
+
+def setup_rag_assistant(llm_config, graph: AgentGraph = None):
+    db, vector_db_config = build_retrieve_config()
+    rag_answer_cache = get_rag_answer_cache()
     rag_proxy_agent = RetrieveUserProxyAgent(
         name="rag_proxy_agent",
         human_input_mode="NEVER",
         retrieve_config={
             "task": "qa",
             "vector_db": db,
+            "distance_threshold": Config.RAG_DISTANCE_THRESHOLD,
+            "context_max_tokens": Config.RAG_CONTEXT_MAX_TOKENS,
+            **vector_db_config,
         },
     )
     
@@ -148,6 +287,9 @@ def setup_rag_assistant(llm_config):
     def trigger(sender):
         return sender not in [assistant] # To prevent the assistant from triggering itself
     
+    # The question being answered by the nested chat, so its answer can be cached
+    pending_answer = {}
+    
     def custom_summary_method(
                 sender: ConversableAgent,
                 recipient: ConversableAgent,
@@ -158,8 +300,25 @@ def setup_rag_assistant(llm_config):
                     last_msg_content = last_msg.get("content", None)
                     if last_msg_content == '':
                         return 'I do not know.'
+                    if last_msg_content and "question" in pending_answer:
+                        rag_answer_cache.put(pending_answer["question"], pending_answer["index_name"], last_msg_content)
                 return last_msg
     
+    def reply_from_cache(recipient, messages, sender, config):
+        pending_answer.clear()
+        question = extract_problem(messages[-1].get("content", ""))
+        try:
+            index_name = db.get_index_name()
+        except Exception as e:
+            print(f"Skipping the answer cache: {e}")
+            return False, None
+        answer = rag_answer_cache.get(question, index_name)
+        if answer is None:
+            pending_answer.update(question=question, index_name=index_name)
+            return False, None
+        print("Answering from the answer cache.")
+        return True, answer
+    
     assistant.register_nested_chats([
         {
             "recipient": rag_assistant_agent,
@@ -168,5 +327,19 @@ def setup_rag_assistant(llm_config):
             "max_turns": 1,
         },
     ], trigger=trigger)
+    # Registered last so it is checked before the nested chat
+    assistant.register_reply(trigger, reply_from_cache)
+
+    async def a_reply_off_loop(recipient, messages, sender, config):
+        # The cache lookup, the search and the nested chat are synchronous, so in async chats they run on a worker
+        # thread rather than blocking the event loop
+        reply = await asyncio.get_running_loop().run_in_executor(
+            None, partial(recipient.generate_reply, messages=messages, sender=sender, exclude=[a_reply_off_loop]))
+        return True, reply
+
+    # Checked first in async chats and skipped in sync ones, which use the synchronous replies directly
+    assistant.register_reply(trigger, a_reply_off_loop, ignore_async_in_sync_chat=True)
+    if graph is not None:
+        graph.add_agents(rag_proxy_agent, rag_assistant_agent)
         
     return assistant
\ No newline at end of file
@@ -0,0 +1,179 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Union
+import numpy as np
+
+
+@dataclass
+class _CachedAnswer:
+    answer: str
+    created_at: float
+    embedding: Optional[np.ndarray] = None
+
+
+def normalize_question(question: str) -> str:
+    question = re.sub(r"\s+", " ", question).strip().lower()
+    return question.rstrip("?.! ")
+
+
+def build_embedding_function(llm_config: dict, model: str) -> Callable[[Union[str, List[str]]], Union[List[float], List[List[float]]]]:
+    """
+    Build a function that embeds a text, or a list of texts in one request, with the same OpenAI or Azure OpenAI account as `llm_config`.
+    :param llm_config: The autogen LLM config from `Config.build_llm_config`.
+    :param model: The embedding model or Azure deployment name.
+    :return: The embedding function.
+    """
+    import openai
+    if llm_config.get("api_type") == "azure":
+        client = openai.AzureOpenAI(
+            api_key=llm_config.get("api_key"),
+            azure_endpoint=llm_config["base_url"],
+            api_version=llm_config["api_version"],
+            azure_ad_token_provider=llm_config.get("azure_ad_token_provider"),
+            http_client=llm_config.get("http_client"),
+        )
+    else:
+        client = openai.OpenAI(api_key=llm_config["api_key"], http_client=llm_config.get("http_client"))
+
+    def embed(text: Union[str, List[str]]):
+        data = client.embeddings.create(model=model, input=text).data
+        return data[0].embedding if isinstance(text, str) else [item.embedding for item in data]
+    return embed
+
+
+class RagAnswerCache:
+    """
+    Caches the answers of the system details assistant, in two levels.
+    The first level matches the normalized question exactly. The optional second level matches questions whose embedding
+    is at least `similarity_threshold` similar, when an `embedding_function` is given.
+    Entries are scoped to the search index they were answered from, so they all expire when a newer dated index is
+    resolved, or after `ttl_seconds` at the latest.
+    The second level keeps its embeddings in memory rather than in a `LocalVectorDB`: it holds at most `max_entries`
+    short-lived entries that are evicted one at a time, which a single matrix product searches exactly.
+    """
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 24 * 60 * 60, similarity_threshold: float = 0.95,
+                 embedding_function: Optional[Callable[[str], List[float]]] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.embedding_function = embedding_function
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.embedding_errors = 0
+        self._index_name = None
+        self._entries = OrderedDict()
+        self._embeddings = OrderedDict()
+        self._matrix = None
+        self._matrix_keys = []
+        self._lock = threading.Lock()
+
+    def _set_index(self, index_name: str):
+        # A newer index may answer differently, so nothing answered from the previous one is reused
+        if index_name != self._index_name:
+            self._index_name = index_name
+            self._entries.clear()
+            self._matrix = None
+
+    def _is_expired(self, entry: _CachedAnswer) -> bool:
+        return time.monotonic() - entry.created_at >= self.ttl_seconds
+
+    def _get_embedding(self, question: str) -> Optional[np.ndarray]:
+        if self.embedding_function is None:
+            return None
+        with self._lock:
+            embedding = self._embeddings.get(question)
+        if embedding is not None:
+            return embedding
+        try:
+            embedding = np.asarray(self.embedding_function(question), dtype=np.float32)
+        except Exception as e:
+            print(f"Failed to embed the question for the answer cache: {e}")
+            with self._lock:
+                self.embedding_errors += 1
+            return None
+        embedding /= max(np.linalg.norm(embedding), 1e-12)
+        with self._lock:
+            # Kept briefly so a miss followed by `put` embeds the question only once
+            self._embeddings[question] = embedding
+            while len(self._embeddings) > 64:
+                self._embeddings.popitem(last=False)
+        return embedding
+
+    def _find_similar(self, embedding: np.ndarray) -> Optional[_CachedAnswer]:
+        with self._lock:
+            if self._matrix is None:
+                self._matrix_keys = [key for key, entry in self._entries.items() if entry.embedding is not None and not self._is_expired(entry)]
+                self._matrix = np.stack([self._entries[key].embedding for key in self._matrix_keys]) if self._matrix_keys else np.zeros((0, len(embedding)), dtype=np.float32)
+            if len(self._matrix_keys) == 0 or self._matrix.shape[1] != len(embedding):
+                return None
+            similarities = self._matrix @ embedding
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                return None
+            entry = self._entries.get(self._matrix_keys[best])
+            if entry is None or self._is_expired(entry):
+                return None
+            self._entries.move_to_end(self._matrix_keys[best])
+            return entry
+
+    def get(self, question: str, index_name: str) -> Optional[str]:
+        """
+        Get the cached answer to a question.
+        :param question: The question as asked.
+        :param index_name: The search index the answer would come from.
+        :return: The answer or None.
+        """
+        key = normalize_question(question)
+        with self._lock:
+            self._set_index(index_name)
+            entry = self._entries.get(key)
+            if entry is not None and self._is_expired(entry):
+                del self._entries[key]
+                self._matrix = None
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry.answer
+
+        embedding = self._get_embedding(key)
+        entry = self._find_similar(embedding) if embedding is not None else None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.semantic_hits += 1
+            return entry.answer
+
+    def put(self, question: str, index_name: str, answer: str):
+        key = normalize_question(question)
+        embedding = self._get_embedding(key)
+        with self._lock:
+            self._set_index(index_name)
+            self._entries[key] = _CachedAnswer(answer, time.monotonic(), embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._embeddings.clear()
+            self._matrix = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "embedding_errors": self.embedding_errors,
+                "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+            }
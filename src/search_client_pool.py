@@ -0,0 +1,60 @@
+import threading
+from typing import Dict, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from azure.core.credentials import AzureKeyCredential
+from azure.core.pipeline.transport import RequestsTransport
+from azure.search.documents import SearchClient
+
+
+class SearchClientPool:
+    """
+    Long-lived search clients, one per index name, that share a connection pool to the search service.
+    Connections and TLS sessions are reused across queries instead of being set up for every search.
+    """
+    def __init__(self, endpoint: str, api_key: Optional[str], pool_size: int = 10, connection_timeout: float = 5, read_timeout: float = 30):
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self.connection_timeout = connection_timeout
+        self.read_timeout = read_timeout
+        self._clients: Dict[str, SearchClient] = {}
+        self._session = None
+        self._lock = threading.Lock()
+
+    def _get_credential(self) -> AzureKeyCredential:
+        if not self.api_key:
+            raise ValueError("No Azure Search API key provided.")
+        return AzureKeyCredential(self.api_key)
+
+    def get_client(self, index_name: str) -> SearchClient:
+        """
+        Get the client for an index, creating it on first use.
+        :param index_name: The search index name.
+        :return: The client.
+        """
+        client = self._clients.get(index_name)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(index_name)
+            if client is None:
+                if self._session is None:
+                    self._session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    self._session.mount("https://", adapter)
+                    self._session.mount("http://", adapter)
+                transport = RequestsTransport(session=self._session, session_owner=False,
+                                              connection_timeout=self.connection_timeout, read_timeout=self.read_timeout)
+                client = SearchClient(self.endpoint, index_name, self._get_credential(), transport=transport)
+                self._clients[index_name] = client
+        return client
+
+    def close(self):
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+            if self._session is not None:
+                self._session.close()
+                self._session = None
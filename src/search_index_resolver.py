@@ -0,0 +1,97 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+from azure.core.exceptions import ResourceNotFoundError
+from search_client_pool import SearchClientPool
+
+
+class SearchIndexResolver:
+    """
+    Finds the newest search index that exists and remembers it, so searches never probe missing indexes.
+    Indexes are named after the day they were built. Today's index is tried first, then up to `max_days_back` previous days.
+    The resolved date is kept for `ttl_seconds`, or until the date rolls over. After that the last known-good date keeps being
+    served while a background thread looks for a newer index.
+    """
+    def __init__(self, client_pool: SearchClientPool, get_index_name: Callable[[datetime], str], max_days_back: int = 3,
+                 ttl_seconds: float = 900, now: Callable[[], datetime] = datetime.now):
+        self.client_pool = client_pool
+        self.get_index_name = get_index_name
+        self.max_days_back = max_days_back
+        self.ttl_seconds = ttl_seconds
+        self.now = now
+        self._index_date: Optional[datetime] = None
+        self._resolved_at = 0
+        self._resolved_on = None
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+
+    def _is_fresh(self) -> bool:
+        return (self._index_date is not None
+                and time.monotonic() - self._resolved_at < self.ttl_seconds
+                and self.now().date() == self._resolved_on)
+
+    def _index_exists(self, index_name: str) -> bool:
+        try:
+            # Works with a query key, unlike reading the index definition
+            self.client_pool.get_client(index_name).get_document_count()
+            return True
+        except ResourceNotFoundError:
+            return False
+
+    def _resolve(self) -> datetime:
+        today = self.now()
+        checked = set()
+        for previous_day_index in range(self.max_days_back + 1):
+            date = today - timedelta(days=previous_day_index)
+            index_name = self.get_index_name(date)
+            if index_name in checked:
+                continue
+            checked.add(index_name)
+            if self._index_exists(index_name):
+                return date
+            print(f"Search index {index_name} does not exist.")
+        raise ResourceNotFoundError(f"No search index found in the last {self.max_days_back + 1} days.")
+
+    def _refresh(self):
+        try:
+            index_date = self._resolve()
+            with self._lock:
+                self._set_index_date(index_date)
+        except Exception as e:
+            # Keep serving the last known-good index
+            print(f"Failed to refresh the search index: {e}")
+        finally:
+            self._refresh_thread = None
+
+    def _set_index_date(self, index_date: datetime):
+        self._index_date = index_date
+        self._resolved_at = time.monotonic()
+        self._resolved_on = self.now().date()
+
+    def get_index_date(self) -> datetime:
+        """
+        Get the date of the newest available index.
+        Only blocks when there is no known-good index yet.
+        :return: The date to build the index name from.
+        """
+        if self._is_fresh():
+            return self._index_date
+        with self._lock:
+            if self._is_fresh():
+                return self._index_date
+            if self._index_date is None:
+                self._set_index_date(self._resolve())
+            elif self._refresh_thread is None:
+                self._refresh_thread = threading.Thread(target=self._refresh, daemon=True)
+                self._refresh_thread.start()
+            return self._index_date
+
+    def invalidate(self, index_date: datetime):
+        """
+        Forget a resolved index that turned out to be missing, e.g. because it was deleted.
+        :param index_date: The date that failed, so a concurrent refresh is not discarded.
+        """
+        with self._lock:
+            if self._index_date == index_date:
+                self._index_date = None
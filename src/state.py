@@ -3,7 +3,7 @@ Copyright (c) Microsoft Corporation. All rights reserved.
 Licensed under the MIT License.
 """
 
-from typing import Optional, List, Dict
+from typing import Optional
 
 from botbuilder.core import Storage, TurnContext
 from teams.state import ConversationState, TempState, TurnState, UserState
@@ -11,7 +11,8 @@ from autogen import ConversableAgent
 from datetime import datetime
 
 class AppConversationState(ConversationState):
-    message_history: List[Dict] | None = None
+    # Where the current group chat starts in the conversation's message log, None when there is none
+    message_log_start: int | None = None
     is_waiting_for_user_input: bool = False
     started_waiting_for_user_input_at: datetime | str | None = None
     spec_url: str | None = None
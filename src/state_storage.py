@@ -0,0 +1,306 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import uuid
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+from botbuilder.core import MemoryStorage, Storage, StoreItem
+
+from config import Config
+
+
+def _to_json_value(value):
+    if isinstance(value, datetime):
+        # AppConversationState accepts the ISO string back
+        return value.isoformat()
+    if isinstance(value, StoreItem) or hasattr(value, "__dict__"):
+        return vars(value)
+    raise TypeError(f"Cannot store a {type(value).__name__} in the conversation state")
+
+
+def _dumps(item) -> str:
+    return json.dumps(item, default=_to_json_value)
+
+
+def _get_e_tag(item) -> Optional[str]:
+    if isinstance(item, dict):
+        return item.get("e_tag")
+    return getattr(item, "e_tag", None)
+
+
+class _Shard:
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.lock = threading.Lock()
+
+    def read(self, keys: List[str]) -> Dict[str, str]:
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT key, value FROM state WHERE key IN ({','.join('?' * len(keys))})", keys
+            ).fetchall()
+        return dict(rows)
+
+    def write(self, changes: Dict[str, Optional[str]]):
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                for key, value in changes.items():
+                    if value is None:
+                        self.connection.execute("DELETE FROM state WHERE key = ?", (key,))
+                    else:
+                        self.connection.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, value))
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class ShardedSqliteStorage(Storage):
+    """
+    Bot state storage in SQLite files, sharded by conversation id so conversations do not contend for one file.
+    Writes are buffered and flushed every `flush_interval_seconds`, or as soon as `max_pending` keys are waiting,
+    so a turn does not wait for the disk. Reads see buffered writes. Writes still buffered when the process dies are lost,
+    so `a_close` must be awaited on shutdown.
+    State survives restarts of the instance that owns the files. Instances sharing state need a network storage behind
+    the same `Storage` interface, such as the botbuilder-azure ones, since SQLite is not safe on network file systems.
+    """
+    def __init__(self, path: str, shards: int = 8, flush_interval_seconds: float = 1.0, max_pending: int = 256):
+        super().__init__()
+        os.makedirs(path, exist_ok=True)
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_pending = max_pending
+        self._shards = [_Shard(os.path.join(path, f"state-{i}.sqlite3")) for i in range(shards)]
+        self._executor = ThreadPoolExecutor(max_workers=shards, thread_name_prefix="state-storage")
+        # None marks a buffered delete
+        self._pending: Dict[str, Optional[str]] = {}
+        self._flushing: Dict[str, Optional[str]] = {}
+        self._flush_lock = asyncio.Lock()
+        # Held from the etag check until the write is buffered, so two writes cannot both pass the check
+        self._write_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _get_shard(self, key: str) -> int:
+        # State keys end with the conversation (or user) id, e.g. "msteams/<bot id>/conversations/<conversation id>"
+        return zlib.crc32(key.rsplit("/", 1)[-1].encode()) % len(self._shards)
+
+    def _group_by_shard(self, keys) -> Dict[int, List[str]]:
+        groups = {}
+        for key in keys:
+            groups.setdefault(self._get_shard(key), []).append(key)
+        return groups
+
+    def _get_buffered(self, key: str):
+        if key in self._pending:
+            return True, self._pending[key]
+        if key in self._flushing:
+            return True, self._flushing[key]
+        return False, None
+
+    async def _read_values(self, keys: List[str]) -> Dict[str, str]:
+        values = {}
+        unbuffered = []
+        for key in keys:
+            is_buffered, value = self._get_buffered(key)
+            if not is_buffered:
+                unbuffered.append(key)
+            elif value is not None:
+                values[key] = value
+        if unbuffered:
+            loop = asyncio.get_running_loop()
+            groups = self._group_by_shard(unbuffered)
+            results = await asyncio.gather(*[
+                loop.run_in_executor(self._executor, self._shards[shard].read, shard_keys)
+                for shard, shard_keys in groups.items()
+            ])
+            for result in results:
+                for key, value in result.items():
+                    # A write may have been buffered while the shard was read
+                    is_buffered, buffered_value = self._get_buffered(key)
+                    if not is_buffered:
+                        values[key] = value
+                    elif buffered_value is not None:
+                        values[key] = buffered_value
+        return values
+
+    async def read(self, keys: List[str]):
+        if not keys:
+            return {}
+        return {key: json.loads(value) for key, value in (await self._read_values(keys)).items()}
+
+    async def write(self, changes: Dict[str, StoreItem]):
+        if changes is None:
+            raise Exception("Changes are required when writing")
+        if not changes:
+            return
+        async with self._write_lock:
+            stored = await self._read_values([key for key, change in changes.items() if _get_e_tag(change) not in (None, "*")])
+            for key, change in changes.items():
+                new_e_tag = _get_e_tag(change)
+                if new_e_tag == "":
+                    raise Exception("state_storage.write(): etag missing")
+                old_e_tag = _get_e_tag(json.loads(stored[key])) if key in stored else None
+                if old_e_tag is not None and new_e_tag not in (None, "*") and new_e_tag != old_e_tag:
+                    raise KeyError(f"Etag conflict.\nOriginal: {new_e_tag}\r\nCurrent: {old_e_tag}")
+                value = _dumps(change)
+                if new_e_tag is not None:
+                    value = json.loads(value)
+                    value["e_tag"] = uuid.uuid4().hex
+                    value = _dumps(value)
+                self._pending[key] = value
+        await self._after_buffering()
+
+    async def delete(self, keys: List[str]):
+        if not keys:
+            return
+        for key in keys:
+            self._pending[key] = None
+        await self._after_buffering()
+
+    async def _after_buffering(self):
+        if len(self._pending) >= self.max_pending:
+            await self.flush()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval_seconds)
+        try:
+            await self.flush()
+        except Exception as e:
+            # The changes are kept and retried on the next flush
+            print(f"Failed to flush the bot state: {e}")
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            self._flushing, self._pending = self._pending, {}
+            loop = asyncio.get_running_loop()
+            try:
+                groups = self._group_by_shard(self._flushing)
+                await asyncio.gather(*[
+                    loop.run_in_executor(
+                        self._executor, self._shards[shard].write, {key: self._flushing[key] for key in shard_keys}
+                    )
+                    for shard, shard_keys in groups.items()
+                ])
+            except Exception:
+                # Newer writes win over the ones that failed to flush
+                self._pending = {**self._flushing, **self._pending}
+                raise
+            finally:
+                self._flushing = {}
+
+    async def a_close(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+        self._executor.shutdown(wait=True)
+        for shard in self._shards:
+            shard.close()
+
+
+class LruCacheStorage(Storage):
+    """
+    An in-process LRU cache in front of another storage, holding at most `max_bytes` of recently used state.
+    Items are cached serialized, so each read returns its own copy and the cache size is known.
+    Another instance writing the same conversation is not seen until the item leaves the cache or `ttl_seconds` pass,
+    so keep the TTL short, or route each conversation to one instance, when scaled out.
+    """
+    def __init__(self, storage: Storage, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: float = 60):
+        super().__init__()
+        self.storage = storage
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+
+    def _put(self, key: str, value: str):
+        self._evict(key)
+        if len(value) > self.max_bytes:
+            return
+        self._entries[key] = (value, asyncio.get_running_loop().time())
+        self._size += len(value)
+        while self._size > self.max_bytes:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def _evict(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[0])
+
+    async def read(self, keys: List[str]):
+        data = {}
+        missing = []
+        now = asyncio.get_running_loop().time()
+        for key in keys or []:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[1] < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                data[key] = json.loads(entry[0])
+                self.hits += 1
+            else:
+                missing.append(key)
+        if missing:
+            self.misses += len(missing)
+            for key, item in (await self.storage.read(missing)).items():
+                self._put(key, _dumps(item))
+                data[key] = item
+        return data
+
+    async def write(self, changes: Dict[str, StoreItem]):
+        for key in changes or {}:
+            self._evict(key)
+        await self.storage.write(changes)
+        for key, change in (changes or {}).items():
+            # The storage sets a new e_tag on items that have one, so those are read back from it
+            if _get_e_tag(change) is None:
+                self._put(key, _dumps(change))
+
+    async def delete(self, keys: List[str]):
+        for key in keys or []:
+            self._evict(key)
+        await self.storage.delete(keys)
+
+    async def a_close(self):
+        self._entries.clear()
+        self._size = 0
+        if hasattr(self.storage, "a_close"):
+            await self.storage.a_close()
+
+
+def build_storage() -> Storage:
+    """
+    Build the bot state storage selected by `Config.STATE_STORAGE`.
+    :return: The storage.
+    """
+    if Config.STATE_STORAGE == "sqlite":
+        storage = ShardedSqliteStorage(
+            Config.STATE_STORAGE_PATH,
+            shards=Config.STATE_STORAGE_SHARDS,
+            flush_interval_seconds=Config.STATE_STORAGE_FLUSH_INTERVAL_SECONDS,
+        )
+    elif Config.STATE_STORAGE == "memory":
+        # Nothing to cache in front of
+        return MemoryStorage()
+    else:
+        raise ValueError(f"Unknown STATE_STORAGE {Config.STATE_STORAGE}, expected memory or sqlite")
+    if Config.STATE_STORAGE_CACHE_MAX_BYTES > 0:
+        storage = LruCacheStorage(storage, max_bytes=Config.STATE_STORAGE_CACHE_MAX_BYTES,
+                                  ttl_seconds=Config.STATE_STORAGE_CACHE_TTL_SECONDS)
+    return storage
@@ -1,4 +1,8 @@
+from .utils import get_quadratic_bezier_bbox
+
 class Curve:
+    __slots__ = ("category", "type", "name", "handleX", "handleY", "sourceX", "sourceY", "targetX", "targetY", "controlX", "controlY", "icons")
+
     def __init__(self, category, type, name: str, icons: dict, handleX, handleY, sourceX, sourceY, targetX, targetY):
         self.category = category
         self.type = type
@@ -11,4 +15,8 @@ class Curve:
         self.targetY = int(targetY)
         self.controlX = 2*self.handleX - self.sourceX/2 - self.targetX/2  # Initialize with default value
         self.controlY = 2*self.handleY - self.sourceY/2 - self.targetY/2  # Initialize with default value
-        self.icons = icons
\ No newline at end of file
+        self.icons = icons
+
+    # Gets the extents of the quadratic Bézier curve
+    def get_bbox(self):
+        return get_quadratic_bezier_bbox((self.sourceX, self.sourceY), (self.controlX, self.controlY), (self.targetX, self.targetY))
\ No newline at end of file
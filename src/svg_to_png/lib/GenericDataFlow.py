@@ -1,62 +1,81 @@
-import math
 import drawsvg as draw
+import numpy as np
 from .Curve import Curve
-from .utils import calculate_size, convert_base64_jpeg_to_png
+from .curves import get_curve_arrays, sample_quadratic_beziers
+from .utils import BoundingBox, calculate_size, convert_base64_jpeg_to_png
 
-def interpolate_quadratic_bezier(start, control, end):
-    def interpolator(t):
-        return [
-            (math.pow(1 - t, 2) * start[0]) +
-            (2 * (1 - t) * t * control[0]) +
-            (math.pow(t, 2) * end[0]),
-            (math.pow(1 - t, 2) * start[1]) +
-            (2 * (1 - t) * t * control[1]) +
-            (math.pow(t, 2) * end[1]),
-        ]
-    return interpolator
+# Arrowhead outline, drawn at ARROW_COUNT evenly spaced points along the curve
+ARROW_POINTS = [(12, 0), (-5, -8), (0, 0), (-5, 8)]
+ARROW_COUNT = 5
 
-def interpolate_quadratic_bezier_angle(start, control, end):
-    def interpolator(t):
-        tangent_x = (2 * (1 - t) * (control[0] - start[0])) + \
-                    (2 * t * (end[0] - control[0]))
-        tangent_y = (2 * (1 - t) * (control[1] - start[1])) + \
-                    (2 * t * (end[1] - control[1]))
+ARROW_TS = np.linspace(0, 1, ARROW_COUNT)
+# Decimals of the arrowhead rotation written to the SVG
+ANGLE_DECIMALS = 6
 
-        return math.atan2(tangent_y, tangent_x) * (180 / math.pi)
-    return interpolator
+def set_arrows(flows):
+    """
+    Samples the arrowhead positions and angles of many data flows in one batched call.
+    :param flows: The `GenericDataFlow` objects, typically all of a drawing surface.
+    """
+    if not flows:
+        return
+    points, angles = sample_quadratic_beziers(*get_curve_arrays(flows), ARROW_TS)
+    for flow, flow_points, flow_angles in zip(flows, points.tolist(), angles.tolist()):
+        flow.arrows = [(x, y, angle) for (x, y), angle in zip(flow_points, flow_angles)]
 
 class GenericDataFlow(Curve):
+    __slots__ = ("arrows",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # (x, y, angle) of each arrowhead, sampled on first use unless set in bulk with set_arrows
+        self.arrows = None
+
+    def get_arrows(self):
+        if self.arrows is None:
+            set_arrows([self])
+        return self.arrows
+
     def add_curve(self, d):
         curve = draw.Path(fill="none", stroke="black").M(self.sourceX, self.sourceY).Q(self.controlX, self.controlY, self.targetX, self.targetY)
         d.append(curve)
         
     def add_additional_arrows(self, d):
-        quadratic_interpolator = interpolate_quadratic_bezier([self.sourceX, self.sourceY], [self.controlX, self.controlY], [self.targetX, self.targetY])
-        # pts = 10
-        # for i in range(pts):
-        #     t = i / (pts - 1)
-        #     x, y = quadratic_interpolator(t)
-        #     # angle = interpolate_quadratic_bezier_angle([self.sourceX, self.sourceY], [self.controlX, self.controlY], [self.targetX, self.targetY])(t)
-        #     d.append(draw.Circle(x, y, 3, fill="black"))
-            
-        quadratic_angle_interpolator = interpolate_quadratic_bezier_angle([self.sourceX, self.sourceY], [self.controlX, self.controlY], [self.targetX, self.targetY])
-        pts = 5
-        for i in range(pts):
-            t = i / (pts - 1)
-            x, y = quadratic_interpolator(t)
-            angle = quadratic_angle_interpolator(t)
-            path = draw.Path(fill="black", transform=f"translate({x}, {y}) rotate({angle})").M(12, 0).L(-5, -8).L(0, 0).L(-5, 8).Z()
+        for x, y, angle in self.get_arrows():
+            # Rounded so the SVG does not depend on the last bit of the vectorized arctan2
+            path = draw.Path(fill="black", transform=f"translate({x}, {y}) rotate({round(angle, ANGLE_DECIMALS)})").M(*ARROW_POINTS[0]).L(*ARROW_POINTS[1]).L(*ARROW_POINTS[2]).L(*ARROW_POINTS[3]).Z()
             d.append(path)
+
+    def get_arrows_bbox(self):
+        arrows = np.array(self.get_arrows())
+        outline = np.array(ARROW_POINTS, dtype=float)
+        angles = np.radians(arrows[:, 2:3])
+        cos, sin = np.cos(angles), np.sin(angles)
+        xs = arrows[:, 0:1] + outline[:, 0] * cos - outline[:, 1] * sin
+        ys = arrows[:, 1:2] + outline[:, 0] * sin + outline[:, 1] * cos
+        return BoundingBox(float(xs.min()), float(xs.max()), float(ys.min()), float(ys.max()))
         
     def add_text(self, d):
         if not self.name:
             return
         newWidth, newHeight = calculate_size(self.name)
-        rect = draw.Rectangle(self.handleX - newWidth / 2 - 15, self.handleY + 20, newWidth + 20, max(newHeight, 27) + 2, fill='#E2F4C3', stroke='black', stroke_width=1, fill_opacity=0.5)
+        x, y, width, height = self.get_label_rect()
+        rect = draw.Rectangle(x, y, width, height, fill='#E2F4C3', stroke='black', stroke_width=1, fill_opacity=0.5)
         d.append(rect)
         label = draw.Text(self.name, 11, self.handleX - newWidth / 2 + 13, self.handleY + 36)
         d.append(label)
         
+    def get_label_rect(self):
+        newWidth, newHeight = calculate_size(self.name)
+        return self.handleX - newWidth / 2 - 15, self.handleY + 20, newWidth + 20, max(newHeight, 27) + 2
+
+    def get_bbox(self):
+        bounding_box = super().get_bbox().union(self.get_arrows_bbox())
+        if self.name:
+            x, y, width, height = self.get_label_rect()
+            bounding_box = bounding_box.union(BoundingBox(x, x + width, y, y + height))
+        return bounding_box
+
     def add_icon(self, d):
         newWidth, newHeight = calculate_size(self.name)
         icon = self.icons[self.type]
@@ -2,6 +2,8 @@ import drawsvg as draw
 from .Shape import Shape
 
 class GenericDataStore(Shape):
+    __slots__ = ()
+
     def convert_to_svg(self, d):
         rect = draw.Rectangle(self.left, self.top, self.width, self.height, fill='white', stroke='black', stroke_width=0.1)
         d.append(rect)
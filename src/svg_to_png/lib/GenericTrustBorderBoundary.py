@@ -3,6 +3,8 @@ from .utils import calculate_size
 import drawsvg as draw
 
 class GenericTrustBorderBoundary(Shape):
+    __slots__ = ()
+
     def convert_to_svg(self, d):
         d.append(draw.Rectangle(self.left, self.top, self.width, self.height, fill='white', stroke='red', stroke_opacity=1, stroke_dasharray=4, fill_opacity=0))
         self.add_text(d)
@@ -3,6 +3,8 @@ from .utils import calculate_size
 import drawsvg as draw
 
 class GenericTrustLineBoundary(Curve):
+    __slots__ = ()
+
     def convert_to_svg(self, d):
         curve = draw.Path(fill="none", stroke="red", stroke_dasharray=4).M(self.sourceX, self.sourceY).Q(self.controlX, self.controlY, self.targetX, self.targetY)
         d.append(curve)
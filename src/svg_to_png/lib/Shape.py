@@ -1,5 +1,5 @@
 import drawsvg as draw
-from .utils import calculate_size, convert_base64_jpeg_to_png, wrap_text
+from .utils import BoundingBox, calculate_size, convert_base64_jpeg_to_png, wrap_text
 
 NODE_TEXT_FONT_SIZE = 11
 INNER_TEXT_RATIO = 0.85
@@ -13,6 +13,8 @@ class SVG(draw.DrawingBasicElement):
         self.children.append(animate_element)
     
 class Shape:
+    __slots__ = ("category", "type", "name", "height", "width", "left", "top", "icons")
+
     def __init__(self, category, type, name: str, icons: dict, height, width, left, top):
         self.category = category
         self.type = type
@@ -23,6 +25,10 @@ class Shape:
         self.top = int(top) + 5
         self.icons = icons
 
+    # Gets the extents of the drawn outline. Text and icons are drawn inside it.
+    def get_bbox(self):
+        return BoundingBox(self.left, self.left + self.width, self.top, self.top + self.height)
+
     # Gets whether the text should be centered (normal for nodes, not for labels)
     def is_text_centered(self):
         return True
@@ -0,0 +1,101 @@
+import numpy as np
+
+# Roots this close to the ends of [0, 1] still count as on the curve
+EPSILON = 1e-9
+
+def get_curve_arrays(curves):
+    """
+    Gets the start, control and end points of the curves as (n, 2) arrays.
+    :param curves: The `Curve` objects.
+    :return: A tuple of start, control and end point arrays.
+    """
+    starts = np.array([(curve.sourceX, curve.sourceY) for curve in curves], dtype=float).reshape(-1, 2)
+    controls = np.array([(curve.controlX, curve.controlY) for curve in curves], dtype=float).reshape(-1, 2)
+    ends = np.array([(curve.targetX, curve.targetY) for curve in curves], dtype=float).reshape(-1, 2)
+    return starts, controls, ends
+
+def get_rect_array(shapes):
+    """
+    Gets the rectangles of the shapes as an (m, 4) array of [xmin, ymin, xmax, ymax].
+    :param shapes: The `Shape` objects.
+    :return: The rectangle array.
+    """
+    return np.array([(shape.left, shape.top, shape.left + shape.width, shape.top + shape.height) for shape in shapes], dtype=float).reshape(-1, 4)
+
+def sample_quadratic_beziers(starts, controls, ends, ts):
+    """
+    Samples positions and tangent angles of many quadratic Bézier curves at once.
+    :param starts: (n, 2) array of start points.
+    :param controls: (n, 2) array of control points.
+    :param ends: (n, 2) array of end points.
+    :param ts: (k,) array of curve parameters in [0, 1].
+    :return: A tuple of an (n, k, 2) array of points and an (n, k) array of tangent angles in degrees.
+    """
+    ts = np.asarray(ts, dtype=float)[None, :, None]
+    starts = starts[:, None, :]
+    controls = controls[:, None, :]
+    ends = ends[:, None, :]
+    points = ((1 - ts) ** 2 * starts) + (2 * (1 - ts) * ts * controls) + (ts ** 2 * ends)
+    tangents = (2 * (1 - ts) * (controls - starts)) + (2 * ts * (ends - controls))
+    angles = np.degrees(np.arctan2(tangents[..., 1], tangents[..., 0]))
+    return points, angles
+
+def get_quadratic_bezier_bboxes(starts, controls, ends):
+    """
+    Gets the exact bounding boxes of many quadratic Bézier curves at once.
+    :param starts: (n, 2) array of start points.
+    :param controls: (n, 2) array of control points.
+    :param ends: (n, 2) array of end points.
+    :return: An (n, 4) array of [xmin, ymin, xmax, ymax].
+    """
+    # The curve's extremes are at its end points or where the derivative is zero on an axis
+    denominators = starts - 2 * controls + ends
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ts = np.where(np.abs(denominators) >= EPSILON, (starts - controls) / denominators, 0)
+    ts = np.clip(np.nan_to_num(ts), 0, 1)
+    extremes = ((1 - ts) ** 2 * starts) + (2 * (1 - ts) * ts * controls) + (ts ** 2 * ends)
+    mins = np.minimum(np.minimum(starts, ends), extremes)
+    maxs = np.maximum(np.maximum(starts, ends), extremes)
+    return np.concatenate([mins, maxs], axis=1)
+
+def _solve_quadratic_beziers(starts, controls, ends, values):
+    # Solves B(t) = value for t along one axis. Inputs broadcast together; returns two (n, m) root arrays, NaN where there is no root.
+    a = starts - 2 * controls + ends
+    b = 2 * (controls - starts)
+    c = starts - values
+    with np.errstate(divide="ignore", invalid="ignore"):
+        discriminant = b ** 2 - 4 * a * c
+        sqrt_discriminant = np.sqrt(np.where(discriminant >= 0, discriminant, np.nan))
+        is_linear = np.abs(a) < EPSILON
+        linear_root = np.where(np.abs(b) >= EPSILON, -c / b, np.nan)
+        root_1 = np.where(is_linear, linear_root, (-b + sqrt_discriminant) / (2 * a))
+        root_2 = np.where(is_linear, np.nan, (-b - sqrt_discriminant) / (2 * a))
+    return root_1, root_2
+
+def get_curve_rect_pair_crossings(starts, controls, ends, rects):
+    """
+    Finds which curves cross the outline of their paired rectangle, e.g. for candidate pairs from a `SpatialIndex`.
+    :param starts: (n, 2) array of curve start points.
+    :param controls: (n, 2) array of curve control points.
+    :param ends: (n, 2) array of curve end points.
+    :param rects: (n, 4) array of [xmin, ymin, xmax, ymax] rectangles.
+    :return: An (n,) boolean array, True where curve i crosses the outline of rectangle i.
+    """
+    if len(starts) == 0:
+        return np.zeros(0, dtype=bool)
+    return _get_crossings(starts, controls, ends, rects)
+
+def _get_crossings(starts, controls, ends, rects):
+    # Inputs broadcast against each other on all but the last axis
+    crossing = np.zeros(np.broadcast_shapes(starts.shape[:-1], rects.shape[:-1]), dtype=bool)
+    for axis, other_axis, edge_columns, span_columns in [(0, 1, (0, 2), (1, 3)), (1, 0, (1, 3), (0, 2))]:
+        for edge_column in edge_columns:
+            roots = _solve_quadratic_beziers(
+                starts[..., axis], controls[..., axis], ends[..., axis], rects[..., edge_column])
+            for t in roots:
+                on_curve = (t >= -EPSILON) & (t <= 1 + EPSILON)
+                t = np.clip(np.nan_to_num(t), 0, 1)
+                other = ((1 - t) ** 2 * starts[..., other_axis]) + (2 * (1 - t) * t * controls[..., other_axis]) + (t ** 2 * ends[..., other_axis])
+                on_edge = (other >= rects[..., span_columns[0]]) & (other <= rects[..., span_columns[1]])
+                crossing |= on_curve & on_edge
+    return crossing
@@ -0,0 +1,126 @@
+import heapq
+import math
+from collections import defaultdict
+from .utils import BoundingBox
+
+class SpatialIndex:
+    """
+    Uniform grid over the bounding boxes of diagram elements.
+    Each item is registered in every cell its bounding box overlaps, so queries only look at the cells they touch
+    instead of scanning every element.
+    """
+    def __init__(self, cell_size: float):
+        if cell_size <= 0:
+            raise ValueError("cell_size must be positive")
+        self.cell_size = cell_size
+        self._items = []
+        self._bboxes = []
+        self._cells = defaultdict(list)
+
+    @classmethod
+    def from_items(cls, items_with_bboxes, cell_size: float = None) -> "SpatialIndex":
+        """
+        Build an index from (item, bounding box) pairs.
+        :param items_with_bboxes: The items and their `BoundingBox`.
+        :param cell_size: The grid cell size. Defaults to the average item extent.
+        :return: The index.
+        """
+        items_with_bboxes = list(items_with_bboxes)
+        if cell_size is None:
+            extents = [max(bbox.xmax - bbox.xmin, bbox.ymax - bbox.ymin) for _, bbox in items_with_bboxes]
+            cell_size = max(sum(extents) / len(extents), 1) if extents else 1
+        index = cls(cell_size)
+        for item, bbox in items_with_bboxes:
+            index.insert(item, bbox)
+        return index
+
+    def __len__(self):
+        return len(self._items)
+
+    def _get_cell_range(self, bbox: BoundingBox):
+        return (
+            math.floor(bbox.xmin / self.cell_size), math.floor(bbox.xmax / self.cell_size),
+            math.floor(bbox.ymin / self.cell_size), math.floor(bbox.ymax / self.cell_size),
+        )
+
+    def insert(self, item, bbox: BoundingBox):
+        item_id = len(self._items)
+        self._items.append(item)
+        self._bboxes.append(bbox)
+        x_start, x_end, y_start, y_end = self._get_cell_range(bbox)
+        for cell_x in range(x_start, x_end + 1):
+            for cell_y in range(y_start, y_end + 1):
+                self._cells[(cell_x, cell_y)].append(item_id)
+
+    def _get_candidates(self, bbox: BoundingBox):
+        x_start, x_end, y_start, y_end = self._get_cell_range(bbox)
+        seen = set()
+        # Iterate over whichever is smaller, the cells the query covers or the occupied cells
+        if (x_end - x_start + 1) * (y_end - y_start + 1) > len(self._cells):
+            cells = (ids for (cell_x, cell_y), ids in self._cells.items() if x_start <= cell_x <= x_end and y_start <= cell_y <= y_end)
+        else:
+            cells = (self._cells.get((cell_x, cell_y), ()) for cell_x in range(x_start, x_end + 1) for cell_y in range(y_start, y_end + 1))
+        for ids in cells:
+            for item_id in ids:
+                if item_id not in seen:
+                    seen.add(item_id)
+                    yield item_id
+
+    def query_range(self, bbox: BoundingBox):
+        """
+        Gets the items whose bounding box intersects `bbox`.
+        """
+        return [self._items[item_id] for item_id in self._get_candidates(bbox) if _intersects(self._bboxes[item_id], bbox)]
+
+    def query_containing(self, bbox: BoundingBox):
+        """
+        Gets the items whose bounding box fully contains `bbox`, e.g. the boundaries around a node.
+        """
+        return [self._items[item_id] for item_id in self._get_candidates(bbox) if _contains(self._bboxes[item_id], bbox)]
+
+    def nearest(self, x: float, y: float, k: int = 1):
+        """
+        Gets the `k` items whose bounding box is closest to the point, nearest first.
+        Items containing the point are at distance 0.
+        """
+        if not self._items or k <= 0:
+            return []
+        occupied_x = [cell_x for cell_x, _ in self._cells]
+        occupied_y = [cell_y for _, cell_y in self._cells]
+        center_x, center_y = math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+        max_ring = max(abs(center_x - min(occupied_x)), abs(center_x - max(occupied_x)),
+                       abs(center_y - min(occupied_y)), abs(center_y - max(occupied_y)))
+        seen = set()
+        best = []
+        for ring in range(max_ring + 1):
+            for cell in _get_ring(center_x, center_y, ring):
+                for item_id in self._cells.get(cell, ()):
+                    if item_id not in seen:
+                        seen.add(item_id)
+                        best.append((_distance(self._bboxes[item_id], x, y), item_id))
+            # Anything not seen yet is in a cell at least `ring` whole cells away from the point
+            if len(best) >= k and heapq.nsmallest(k, best)[-1][0] <= ring * self.cell_size:
+                break
+        return [self._items[item_id] for _, item_id in heapq.nsmallest(k, best)]
+
+def _get_ring(center_x, center_y, ring):
+    if ring == 0:
+        yield (center_x, center_y)
+        return
+    for cell_x in range(center_x - ring, center_x + ring + 1):
+        yield (cell_x, center_y - ring)
+        yield (cell_x, center_y + ring)
+    for cell_y in range(center_y - ring + 1, center_y + ring):
+        yield (center_x - ring, cell_y)
+        yield (center_x + ring, cell_y)
+
+def _intersects(first: BoundingBox, second: BoundingBox) -> bool:
+    return first.xmin <= second.xmax and second.xmin <= first.xmax and first.ymin <= second.ymax and second.ymin <= first.ymax
+
+def _contains(outer: BoundingBox, inner: BoundingBox) -> bool:
+    return outer.xmin <= inner.xmin and outer.ymin <= inner.ymin and outer.xmax >= inner.xmax and outer.ymax >= inner.ymax
+
+def _distance(bbox: BoundingBox, x: float, y: float) -> float:
+    dx = max(bbox.xmin - x, 0, x - bbox.xmax)
+    dy = max(bbox.ymin - y, 0, y - bbox.ymax)
+    return math.hypot(dx, dy)
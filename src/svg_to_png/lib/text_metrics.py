@@ -0,0 +1,80 @@
+from functools import lru_cache
+from io import BytesIO
+import os
+import threading
+from PIL import ImageFont
+
+# The scale factor
+SCALE_FACTOR = 64
+
+DEFAULT_FONT_PATH = os.path.join(os.path.dirname(__file__), "OpenSans-Regular.ttf")
+
+@lru_cache(maxsize=None)
+def _read_font_bytes(font_path):
+    with open(font_path, "rb") as font_file:
+        return font_file.read()
+
+class TextMetrics:
+    """
+    Measures text widths from cached per-glyph metrics instead of rendering through Pillow.
+    Glyph metrics are taken from Pillow at `font_size * scale_factor` the first time a glyph is seen,
+    so the results follow the same bounding box arithmetic as `get_text_width`.
+    """
+    def __init__(self, font_path=DEFAULT_FONT_PATH, font_size=11, scale_factor=SCALE_FACTOR):
+        self.font_size = font_size
+        self.scale_factor = scale_factor
+        self._font = ImageFont.truetype(BytesIO(_read_font_bytes(font_path)), font_size * scale_factor)
+        # glyph -> (advance, ink left, ink right), in scaled pixels relative to the pen position
+        self._glyphs = {}
+        # (glyph, glyph) -> adjustment applied to the pen position between the two glyphs
+        self._kerning = {}
+        self._lock = threading.Lock()
+
+    def _get_glyph(self, char):
+        glyph = self._glyphs.get(char)
+        if glyph is None:
+            with self._lock:
+                advance = self._font.getlength(char)
+                left, _, right, _ = self._font.getbbox(char)
+                glyph = (advance, left, right)
+                self._glyphs[char] = glyph
+        return glyph
+
+    def _get_kerning(self, left_char, right_char):
+        pair = (left_char, right_char)
+        kerning = self._kerning.get(pair)
+        if kerning is None:
+            with self._lock:
+                pair_advance = self._font.getlength(left_char + right_char)
+                kerning = pair_advance - self._font.getlength(left_char) - self._font.getlength(right_char)
+                self._kerning[pair] = kerning
+        return kerning
+
+    def get_text_width(self, text):
+        """
+        Calculate the width of the text, matching the Pillow bounding box of the rendered text.
+        :param text: The text to measure.
+        :return: The width of the text.
+        """
+        if not text:
+            return 0
+        pen = 0
+        x_min = 0
+        x_max = 0
+        previous = None
+        for char in text:
+            if previous is not None:
+                pen += self._get_kerning(previous, char)
+            advance, left, right = self._get_glyph(char)
+            # Glyphs without ink (e.g. spaces) only move the pen
+            if right > left:
+                x_min = min(x_min, pen + left)
+                x_max = max(x_max, pen + right)
+            pen += advance
+            x_max = max(x_max, pen)
+            previous = char
+        return (x_max - x_min) / self.scale_factor
+
+@lru_cache(maxsize=None)
+def get_text_metrics(font_size, font_path=DEFAULT_FONT_PATH):
+    return TextMetrics(font_path, font_size)
@@ -1,9 +1,11 @@
-import svgpathtools
 from PIL import ImageFont, ImageDraw, Image
 import base64
+import hashlib
+import threading
+from collections import OrderedDict
 from io import BytesIO
-import os
 import re
+from .text_metrics import DEFAULT_FONT_PATH, SCALE_FACTOR, get_text_metrics
 
 def calculate_size(name_arg):
     max_width = 0
@@ -33,24 +35,107 @@ class BoundingBox:
     def get_size(self):
         return (self.xmax - self.xmin, self.ymax - self.ymin)
 
-def get_bbox(svg_file):
-    paths, _ = svgpathtools.svgstr2paths(svg_file)
+    def union(self, other):
+        return BoundingBox(min(self.xmin, other.xmin), max(self.xmax, other.xmax), min(self.ymin, other.ymin), max(self.ymax, other.ymax))
 
-    for i, path in enumerate(paths):
-        if i == 0:
-            # Initialise the overall min-max with the first path
-            xmin, xmax, ymin, ymax = path.bbox()
-        else:
-            # Expand bounds to match path bounds if needed
-            p_xmin, p_xmax, p_ymin, p_ymax = path.bbox()
-            xmin = min(xmin, p_xmin)
-            xmax = max(xmax, p_xmax)
-            ymin = min(ymin, p_ymin)
-            ymax = max(ymax, p_ymax)
-    
-    return BoundingBox(xmin, xmax, ymin, ymax)
+    @staticmethod
+    def from_points(points):
+        xs = [x for x, _ in points]
+        ys = [y for _, y in points]
+        return BoundingBox(min(xs), max(xs), min(ys), max(ys))
 
-def convert_base64_jpeg_to_png(base64_jpeg_string):
+class BoundingBoxAccumulator:
+    """
+    Unions the bounding boxes reported by the shapes of a drawing.
+    """
+    def __init__(self):
+        self.bounding_box = None
+
+    def add(self, shape):
+        if shape is None:
+            return
+        bounding_box = shape.get_bbox()
+        if self.bounding_box is None:
+            self.bounding_box = BoundingBox(bounding_box.xmin, bounding_box.xmax, bounding_box.ymin, bounding_box.ymax)
+        else:
+            self.bounding_box = self.bounding_box.union(bounding_box)
+
+    def get_bbox(self):
+        if self.bounding_box is None:
+            return BoundingBox(0, 0, 0, 0)
+        return self.bounding_box
+
+def get_quadratic_bezier_bbox(start, control, end):
+    points = [start, end]
+    # The curve's extremes are at its end points or where the derivative is zero on an axis
+    for axis in (0, 1):
+        denominator = start[axis] - 2 * control[axis] + end[axis]
+        if denominator != 0:
+            t = (start[axis] - control[axis]) / denominator
+            if 0 < t < 1:
+                points.append((
+                    (1 - t) ** 2 * start[0] + 2 * (1 - t) * t * control[0] + t ** 2 * end[0],
+                    (1 - t) ** 2 * start[1] + 2 * (1 - t) * t * control[1] + t ** 2 * end[1],
+                ))
+    return BoundingBox.from_points(points)
+
+class IconCache:
+    """
+    Bounded, content-addressed cache of transcoded icons.
+    Keys are digests of the base64 source so identical icons share one entry across renders.
+    """
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(base64_string):
+        if isinstance(base64_string, str):
+            base64_string = base64_string.encode("ascii")
+        return hashlib.sha256(base64_string).hexdigest()
+
+    def get_or_create(self, base64_string, factory):
+        key = self.get_key(base64_string)
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        value = factory(base64_string)
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+# Shared by every render in the process. The KnowledgeBase only has a few dozen distinct icons.
+icon_cache = IconCache()
+
+def _transcode_base64_jpeg_to_png(base64_jpeg_string):
     # Decode the base64 string to bytes
     jpeg_bytes = base64.b64decode(base64_jpeg_string)
     image = Image.open(BytesIO(jpeg_bytes))
@@ -66,12 +151,13 @@ def convert_base64_jpeg_to_png(base64_jpeg_string):
     
     return png_bytes
 
-# The scale factor
-SCALE_FACTOR = 64
+def convert_base64_jpeg_to_png(base64_jpeg_string):
+    return icon_cache.get_or_create(base64_jpeg_string, _transcode_base64_jpeg_to_png)
 
 def get_text_width(text, font, font_size, scale_factor=SCALE_FACTOR):
     """
     Calculate the width of the text using a scaled-up font size for accuracy.
+    This renders through Pillow on every call; `TextMetrics.get_text_width` gives the same result from cached glyph metrics.
     :param text: The text to measure.
     :param font: The loaded ImageFont object.
     :param font_size: The original font size.
@@ -89,8 +175,6 @@ def get_text_width(text, font, font_size, scale_factor=SCALE_FACTOR):
 
     return width
 
-DEFAULT_FONT_PATH = os.path.join(os.path.dirname(__file__), "OpenSans-Regular.ttf")
-
 def wrap_text(text, max_width, font_size, font_path=DEFAULT_FONT_PATH):
     """
     Wrap the text so that it fits within the specified width.
@@ -100,7 +184,7 @@ def wrap_text(text, max_width, font_size, font_path=DEFAULT_FONT_PATH):
     :param font_path: The path to the font file.
     :return: A list of wrapped lines.
     """
-    font = ImageFont.truetype(font_path, font_size)
+    metrics = get_text_metrics(font_size, font_path)
 
     lines = []
     current_line = ""
@@ -117,7 +201,7 @@ def wrap_text(text, max_width, font_size, font_path=DEFAULT_FONT_PATH):
             word = parts[-1]
 
         test_line = f"{current_line} {word}".strip() if current_line else word
-        test_line_width = get_text_width(test_line, font, font_size)
+        test_line_width = metrics.get_text_width(test_line)
 
         if test_line_width <= max_width:
             current_line = test_line
@@ -130,7 +214,7 @@ def wrap_text(text, max_width, font_size, font_path=DEFAULT_FONT_PATH):
                 low, high = 0, len(word)
                 while low < high:
                     mid = (low + high) // 2
-                    if get_text_width(word[:mid + 1], font, font_size) <= max_width:
+                    if metrics.get_text_width(word[:mid + 1]) <= max_width:
                         low = mid + 1
                     else:
                         high = mid
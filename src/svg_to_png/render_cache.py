@@ -0,0 +1,172 @@
+import base64
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+from .svg_to_png import RenderResult, TabRenderResult
+
+
+class RenderCache:
+    """
+    Bounded LRU cache of rendered threat models, keyed by a hash of the uploaded bytes and the render options.
+    Entries evicted from memory are written to `spill_dir` when it is set, and read back from there on a miss.
+    """
+    def __init__(self, max_entries: int = 32, max_bytes: int = 64 * 1024 * 1024, spill_dir: Optional[str] = None, max_spill_bytes: int = 512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self.hits = 0
+        self.spill_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+
+    @staticmethod
+    def get_key(content: bytes, **options) -> str:
+        digest = hashlib.sha256(content)
+        digest.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    @staticmethod
+    def _get_size(result: RenderResult) -> int:
+        size = len(result.png) + (len(result.svg) if result.svg else 0)
+        if len(result.tabs) > 1:
+            size += sum(len(tab.png) + (len(tab.svg) if tab.svg else 0) for tab in result.tabs)
+        return size
+
+    def get(self, key: str) -> Optional[RenderResult]:
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+
+        result = self._read_spilled(key)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.spill_hits += 1
+        self.put(key, result)
+        return result
+
+    def put(self, key: str, result: RenderResult):
+        size = self._get_size(result)
+        if size > self.max_bytes:
+            self._spill(key, result)
+            return
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._get_size(self._entries.pop(key))
+            self._entries[key] = result
+            self._size += size
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                evicted_key, evicted_result = self._entries.popitem(last=False)
+                self._size -= self._get_size(evicted_result)
+                self.evictions += 1
+                evicted.append((evicted_key, evicted_result))
+        for evicted_key, evicted_result in evicted:
+            self._spill(evicted_key, evicted_result)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.hits = 0
+            self.spill_hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.spill_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "spill_hits": self.spill_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.spill_hits) / total if total else 0.0,
+            }
+
+    def _get_spill_paths(self, key: str):
+        return os.path.join(self.spill_dir, f"{key}.png"), os.path.join(self.spill_dir, f"{key}.json")
+
+    def _spill(self, key: str, result: RenderResult):
+        if not self.spill_dir:
+            return
+        png_path, meta_path = self._get_spill_paths(key)
+        try:
+            with open(png_path, "wb") as png_file:
+                png_file.write(result.png)
+            # The metadata is written last so a half written entry is never read back
+            with open(meta_path, "w", encoding="utf-8") as meta_file:
+                json.dump({
+                    "key_label_tuples": result.key_label_tuples,
+                    "svg": result.svg,
+                    "tabs": [{
+                        "name": tab.name,
+                        "png": base64.b64encode(tab.png).decode("ascii") if len(result.tabs) > 1 else None,
+                        "key_label_tuples": tab.key_label_tuples,
+                        "svg": tab.svg,
+                    } for tab in result.tabs],
+                }, meta_file)
+        except OSError as e:
+            print(f"Unable to spill rendered threat model to disk: {e}")
+            return
+        self._prune_spilled()
+
+    def _read_spilled(self, key: str) -> Optional[RenderResult]:
+        if not self.spill_dir:
+            return None
+        png_path, meta_path = self._get_spill_paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as meta_file:
+                meta = json.load(meta_file)
+            with open(png_path, "rb") as png_file:
+                png = png_file.read()
+        except (OSError, ValueError):
+            return None
+        return RenderResult(
+            png=png,
+            key_label_tuples=[tuple(key_label) for key_label in meta["key_label_tuples"]],
+            svg=meta.get("svg"),
+            tabs=[TabRenderResult(
+                name=tab["name"],
+                # A single tab's image is the result's image, so it is only stored once
+                png=base64.b64decode(tab["png"]) if tab["png"] is not None else png,
+                key_label_tuples=[tuple(key_label) for key_label in tab["key_label_tuples"]],
+                svg=tab["svg"],
+            ) for tab in meta.get("tabs", [])],
+        )
+
+    def _prune_spilled(self):
+        # Removes the least recently written entries once the spill directory is over its budget
+        try:
+            files = [entry for entry in os.scandir(self.spill_dir) if entry.is_file()]
+        except OSError:
+            return
+        total = sum(entry.stat().st_size for entry in files)
+        if total <= self.max_spill_bytes:
+            return
+        for entry in sorted(files, key=lambda entry: entry.stat().st_mtime):
+            if total <= self.max_spill_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,133 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Awaitable, Callable, Optional
+from .render_cache import RenderCache
+from .svg_to_png import RenderResult, combine_tab_results, render_threat_model_tab
+
+
+class RenderQueueFullError(Exception):
+    pass
+
+
+class RenderExecutor:
+    """
+    Renders threat models in a process pool so the caller's event loop is never blocked by parsing or rasterization.
+    The tabs of a model are rendered in parallel across the pool's workers. Workers are sent the document bytes and parse
+    them themselves, so the parsed document (with its icons) never travels between processes.
+    At most `max_queue_depth` renders may be running or waiting at once; further requests fail fast with `RenderQueueFullError`.
+    """
+    def __init__(self, max_workers: Optional[int] = None, timeout: float = 60, max_queue_depth: int = 8, cache: Optional[RenderCache] = None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_queue_depth = max_queue_depth
+        self.cache = cache
+        self._pending = 0
+        self._pool = None
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._pool
+
+    async def render(self, content: bytes, include_svg: bool = False) -> Optional[RenderResult]:
+        key = None
+        if self.cache is not None:
+            key = self.cache.get_key(content, include_svg=include_svg)
+            result = self.cache.get(key)
+            if result is not None:
+                return result
+
+        result = await self._run_limited(lambda futures: self._render(content, include_svg, futures))
+        if self.cache is not None and result is not None:
+            self.cache.put(key, result)
+        return result
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """
+        Run other work on a threat model in the pool, such as checks of its parsed document, under the same queue depth
+        and timeout as renders.
+        :param fn: A picklable function, e.g. one defined at module level.
+        :param args: The picklable arguments.
+        :return: The function's result.
+        """
+        async def run_in_pool(futures: list):
+            pool = self._get_pool()
+            try:
+                return await self._submit(pool, futures, fn, *args)
+            except BrokenProcessPool:
+                self._reset_pool(pool)
+                raise
+        return await self._run_limited(run_in_pool)
+
+    async def _run_limited(self, work: Callable[[list], Awaitable]) -> Any:
+        if self._pending >= self.max_queue_depth:
+            raise RenderQueueFullError(f"There are already {self._pending} threat models waiting to be rendered.")
+        self._pending += 1
+        futures = []
+        try:
+            return await asyncio.wait_for(work(futures), timeout=self.timeout)
+        finally:
+            # Work that has already started keeps its worker until it finishes, even after timing out,
+            # so the job counts against the queue depth until all of its pool futures are done
+            self._release_when_done(futures)
+
+    def _submit(self, pool: ProcessPoolExecutor, futures: list, fn: Callable, *args) -> asyncio.Future:
+        future = pool.submit(fn, *args)
+        futures.append(future)
+        return asyncio.wrap_future(future)
+
+    def _release_when_done(self, futures: list):
+        remaining = [future for future in futures if not future.done()]
+        if not remaining:
+            self._pending -= 1
+            return
+        loop = asyncio.get_running_loop()
+
+        def on_done(future):
+            remaining.remove(future)
+            if not remaining:
+                self._pending -= 1
+
+        def on_done_threadsafe(future):
+            # Pool futures complete on the pool's thread
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(on_done, future)
+        for future in list(remaining):
+            future.add_done_callback(on_done_threadsafe)
+
+    async def _render(self, content: bytes, include_svg: bool, futures: list) -> Optional[RenderResult]:
+        pool = self._get_pool()
+        try:
+            # The first tab's worker also finds out how many tabs there are
+            tab_count, first_tab = await self._submit(pool, futures, render_threat_model_tab, content, 0, include_svg)
+            if first_tab is None:
+                return None
+            # Tabs are independent, so each of the others is rendered by its own worker
+            other_tabs = await asyncio.gather(*[
+                self._submit(pool, futures, render_threat_model_tab, content, index, include_svg)
+                for index in range(1, tab_count)
+            ])
+            tab_results = [first_tab] + [tab for _, tab in other_tabs]
+            if len(tab_results) > 1:
+                return await self._submit(pool, futures, combine_tab_results, tab_results)
+            return combine_tab_results(tab_results)
+        except BrokenProcessPool:
+            self._reset_pool(pool)
+            raise
+
+    def _reset_pool(self, pool: ProcessPoolExecutor):
+        # A worker died (e.g. out of memory), so the next render starts a fresh pool.
+        # Concurrent renders on the same broken pool must not drop a pool that was started since.
+        if self._pool is pool:
+            self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self, wait: bool = True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
@@ -1,167 +1,185 @@
-import xml.etree.ElementTree as ET
-from xml.etree.ElementTree import Element
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from io import BytesIO
+from itertools import repeat
+from typing import List, Optional, Tuple, Union
 import drawsvg as draw
+from PIL import Image, ImageDraw, ImageFont
 from .lib.FreeTextAnnotation import FreeTextAnnotation
-from .lib.GenericDataFlow import GenericDataFlow
+from .lib.GenericDataFlow import GenericDataFlow, set_arrows
 from .lib.GenericProcess import GenericProcess
 from .lib.GenericTrustBorderBoundary import GenericTrustBorderBoundary
 from .lib.GenericTrustLineBoundary import GenericTrustLineBoundary
 from .lib.GenericDataStore import GenericDataStore
 from .lib.GenericExternalInteractor import GenericExternalInteractor
-from .lib.utils import get_bbox
-
-
-def build_tag(schema, tag):
-    return f'{schema}{tag}'
-
-
-def print_all(iter):
-    for elem in iter:
-        print(elem.tag, elem.attrib)
-        
-THREAT_MODELING_XMLNS = "{http://schemas.datacontract.org/2004/07/ThreatModeling.Model}"
-ABSTRACTS_XMLNS = "{http://schemas.datacontract.org/2004/07/ThreatModeling.Model.Abstracts}"
-ARRAY_XMLNS = "{http://schemas.microsoft.com/2003/10/Serialization/Arrays}"
-KNOWLEDGE_BASE_XMLNS = "{http://schemas.datacontract.org/2004/07/ThreatModeling.KnowledgeBase}"
-        
-def get_shape_details(shape):
-    height = shape.find(build_tag(ABSTRACTS_XMLNS, "Height")).text
-    width = shape.find(build_tag(ABSTRACTS_XMLNS, "Width")).text
-    left = shape.find(build_tag(ABSTRACTS_XMLNS, "Left")).text
-    top = shape.find(build_tag(ABSTRACTS_XMLNS, "Top")).text
-    
-    return height, width, left, top
-
-def get_curve_details(curve):
-    handleX = curve.find(build_tag(ABSTRACTS_XMLNS, "HandleX")).text
-    handleY = curve.find(build_tag(ABSTRACTS_XMLNS, "HandleY")).text
-    sourceX = curve.find(build_tag(ABSTRACTS_XMLNS, "SourceX")).text
-    sourceY = curve.find(build_tag(ABSTRACTS_XMLNS, "SourceY")).text
-    targetX = curve.find(build_tag(ABSTRACTS_XMLNS, "TargetX")).text
-    targetY = curve.find(build_tag(ABSTRACTS_XMLNS, "TargetY")).text
+from .lib.text_metrics import DEFAULT_FONT_PATH
+from .lib.utils import BoundingBoxAccumulator
+from .tm7_parser import DrawingSurface, ThreatModelDocument, ThreatModelElement, parse_tm7
+
+SHAPE_CLASSES = {
+    "GE.DS": GenericDataStore,
+    "GE.EI": GenericExternalInteractor,
+    "GE.P": GenericProcess,
+    "GE.TB.B": GenericTrustBorderBoundary,
+    "GE.A": FreeTextAnnotation,
+}
+
+CURVE_CLASSES = {
+    "GE.DF": GenericDataFlow,
+    "GE.TB.L": GenericTrustLineBoundary,
+}
+
+def build_element(el: ThreatModelElement, icons: dict):
+    shape_class = SHAPE_CLASSES.get(el.generic_type_id)
+    if shape_class:
+        return shape_class(el.generic_type_id, el.type, el.name, icons, el.height, el.width, el.left, el.top)
+    curve_class = CURVE_CLASSES.get(el.generic_type_id)
+    if curve_class:
+        return curve_class(el.generic_type_id, el.type, el.name, icons, el.handle_x, el.handle_y, el.source_x, el.source_y, el.target_x, el.target_y)
+    return None
+
+def build_surface_elements(surface: DrawingSurface, icons: dict):
+    """
+    Build the shapes and curves of a drawing surface in a single pass, in the order they are drawn:
+    nodes and annotations first, then lines, then trust boundaries so they are drawn on top.
+    """
+    shapes = []
+    boundaries = []
+    for border in surface.borders:
+        element = build_element(border, icons)
+        if element is None:
+            continue
+        if border.generic_type_id == "GE.TB.B":
+            boundaries.append(element)
+        else:
+            shapes.append(element)
+    lines = [element for element in (build_element(line, icons) for line in surface.lines) if element is not None]
+    return shapes + lines + boundaries
+
+TAB_TITLE_FONT_SIZE = 16
+TAB_TITLE_HEIGHT = 32
+TAB_SPACING = 20
+
+@dataclass
+class TabRenderResult:
+    name: str
+    png: bytes
+    key_label_tuples: List[Tuple[str, str]]
+    svg: Optional[str] = None
+
+@dataclass
+class RenderResult:
+    # The only tab's image, or a sheet with every tab stacked vertically
+    png: bytes
+    key_label_tuples: List[Tuple[str, str]]
+    # Only set for single tab models, see `tabs` for the SVG of each tab
+    svg: Optional[str] = None
+    tabs: List[TabRenderResult] = field(default_factory=list)
+
+def draw_tab(surface: DrawingSurface, icons: dict):
+    d = draw.Drawing(2000, 2000)
+    d.append(draw.elements.Raw('<style>@import url("https://fonts.googleapis.com/css?family=Open+Sans:400,400i,700,700i");</style>'))
+    bounding_box = BoundingBoxAccumulator()
+    elements = build_surface_elements(surface, icons)
+    set_arrows([element for element in elements if isinstance(element, GenericDataFlow)])
+    for element in elements:
+        element.convert_to_svg(d)
+        bounding_box.add(element)
     
-    return handleX, handleY, sourceX, sourceY, targetX, targetY
-
-def get_element_name(shape):
-    properties = shape.find(build_tag(ABSTRACTS_XMLNS, "Properties"))
-    any_type_properties = properties.findall(build_tag(ARRAY_XMLNS, "anyType"))
-    name = any_type_properties[1][2].text
-    return name if name else ""
-        
-def draw_element(el: Element, d, icons: dict):
-    generic_type_id = el.find(build_tag(ABSTRACTS_XMLNS, "GenericTypeId")).text
-    properties = el.find(build_tag(ABSTRACTS_XMLNS, "Properties"))
-    any_type_properties = properties.findall(build_tag(ARRAY_XMLNS, "anyType"))
-    type = any_type_properties[0][0].text
-    name = el.get('custom_key') if el.get('custom_key') else get_element_name(el)
-    if generic_type_id == "GE.DS":
-        shape = GenericDataStore(generic_type_id, type, name, icons, *get_shape_details(el))
-    elif generic_type_id == "GE.EI":
-        shape = GenericExternalInteractor(generic_type_id, type, name, icons, *get_shape_details(el))
-    elif generic_type_id == "GE.P":
-        shape = GenericProcess(generic_type_id, type, name, icons, *get_shape_details(el))
-    elif generic_type_id == "GE.TB.B":
-        shape = GenericTrustBorderBoundary(generic_type_id, type, name, icons, *get_shape_details(el))
-    elif generic_type_id == "GE.A":
-        shape = FreeTextAnnotation(generic_type_id, type, name, icons, *get_shape_details(el))
-    elif generic_type_id == "GE.DF":
-        shape = GenericDataFlow(generic_type_id, type, name, icons, *get_curve_details(el))
-    elif generic_type_id == "GE.TB.L":
-        shape = GenericTrustLineBoundary(generic_type_id, type, name, icons, *get_curve_details(el))
+    bounding_box = bounding_box.get_bbox()
+    bounding_box.add_padding(10)
+    width, height = bounding_box.get_size()
+    d.set_render_size(width, height)
+    d.view_box = (bounding_box.xmin,bounding_box.ymin) + (width, height)
+    return d, surface.get_key_label_tuples()
+
+def load_threat_model(file: str = None, svg_content: Union[str, bytes] = None) -> Tuple[dict, List[DrawingSurface]]:
+    document = parse_tm7(file=file, content=svg_content)
+    return document.icons, document.surfaces
+
+def render_tab(tab: DrawingSurface, icons: dict, index: int = 0, include_svg: bool = False) -> TabRenderResult:
+    name = tab.name if tab.name else f"Tab {index + 1}"
+    d, key_label_tuples = draw_tab(tab, icons)
+    svg = d.as_svg()
+    png = draw.Raster.from_svg(svg).png_data
+    return TabRenderResult(name=name, png=png, key_label_tuples=key_label_tuples, svg=svg if include_svg else None)
+
+@lru_cache(maxsize=4)
+def parse_threat_model_content(content: bytes) -> ThreatModelDocument:
+    # Cached in each process, so a worker doing several jobs on a model (e.g. rendering its tabs) parses it once
+    return parse_tm7(content=content)
+
+def render_threat_model_tab(content: bytes, index: int, include_svg: bool = False) -> Tuple[int, Optional[TabRenderResult]]:
+    """
+    Parse a threat model and render one of its tabs, so a process pool worker only has to be sent the document bytes.
+    :param content: The .tm7 document contents.
+    :param index: The index of the tab to render.
+    :param include_svg: Whether to also return the intermediate SVG text.
+    :return: The number of tabs in the model, and the rendered tab or None when there is no such tab.
+    """
+    document = parse_threat_model_content(content)
+    if index >= len(document.surfaces):
+        return len(document.surfaces), None
+    return len(document.surfaces), render_tab(document.surfaces[index], document.icons, index, include_svg)
+
+def stitch_tab_images(tabs: List[TabRenderResult]) -> bytes:
+    images = [Image.open(BytesIO(tab.png)) for tab in tabs]
+    width = max(image.width for image in images)
+    height = sum(TAB_TITLE_HEIGHT + image.height for image in images) + TAB_SPACING * (len(images) - 1)
+    sheet = Image.new("RGBA", (width, height), "WHITE")
+    draw_context = ImageDraw.Draw(sheet)
+    font = ImageFont.truetype(DEFAULT_FONT_PATH, TAB_TITLE_FONT_SIZE)
+    top = 0
+    for tab, image in zip(tabs, images):
+        draw_context.text((10, top + (TAB_TITLE_HEIGHT - TAB_TITLE_FONT_SIZE) / 2), tab.name, fill="black", font=font)
+        top += TAB_TITLE_HEIGHT
+        sheet.paste(image, (0, top), image if image.mode == "RGBA" else None)
+        top += image.height + TAB_SPACING
+    png_bytes_io = BytesIO()
+    sheet.save(png_bytes_io, format='PNG')
+    return png_bytes_io.getvalue()
+
+def combine_tab_results(tabs: List[TabRenderResult]) -> Optional[RenderResult]:
+    if not tabs:
+        return None
+    if len(tabs) == 1:
+        return RenderResult(png=tabs[0].png, key_label_tuples=tabs[0].key_label_tuples, svg=tabs[0].svg, tabs=tabs)
+    # Keys restart on every tab, so they are qualified with the tab they belong to
+    key_label_tuples = [(f"{key} ({tab.name})", label) for tab in tabs for key, label in tab.key_label_tuples]
+    return RenderResult(png=stitch_tab_images(tabs), key_label_tuples=key_label_tuples, tabs=tabs)
+
+def render_threat_model(file: str = None, svg_content: Union[str, bytes] = None, include_svg: bool = False, tab_executor: Optional[Executor] = None) -> Optional[RenderResult]:
+    """
+    Render every tab of a threat model to in-memory PNG bytes without touching the disk.
+    :param file: Path to the .tm7 file.
+    :param svg_content: The .tm7 document contents.
+    :param include_svg: Whether to also return the intermediate SVG text.
+    :param tab_executor: Optional executor used to render the tabs in parallel.
+    :return: The rendered PNG, the key/label pairs of the elements and optionally the SVG, plus the same for each tab.
+    """
+    icons, tabs = load_threat_model(file, svg_content)
+    if tab_executor is not None and len(tabs) > 1:
+        tab_results = list(tab_executor.map(render_tab, tabs, repeat(icons), range(len(tabs)), repeat(include_svg)))
     else:
-        shape = None
-        
-    if shape:
-        shape.convert_to_svg(d)
-
-def convert_svg_to_png(file: str = None, svg_content: str = None, out_file="result"):
-    if not file and not svg_content:
-        raise Exception("Either file or svg_content should be provided")
-    
-    ET.register_namespace(
-        'xmlns', 'http://schemas.datacontract.org/2004/07/ThreatModeling.Model')
-    if file:
-        tree = ET.parse(file)
-        root = tree.getroot()
+        tab_results = [render_tab(tab, icons, index, include_svg) for index, tab in enumerate(tabs)]
+    return combine_tab_results(tab_results)
+
+def convert_svg_to_png(file: str = None, svg_content: str = None, out_file="result", tab_executor: Optional[Executor] = None):
+    result = render_threat_model(file=file, svg_content=svg_content, include_svg=True, tab_executor=tab_executor)
+    if result is None:
+        return None
+    file_name = out_file
+    if len(result.tabs) > 1:
+        for index, tab in enumerate(result.tabs):
+            with open(f'{file_name}-{index + 1}.svg', 'w', encoding='utf-8') as svg_file:
+                svg_file.write(tab.svg)
+            with open(f'{file_name}-{index + 1}.png', 'wb') as png_file:
+                png_file.write(tab.png)
     else:
-        root = ET.fromstring(svg_content)
-        
-    knowledgeBase = root.find(build_tag(
-        THREAT_MODELING_XMLNS, 'KnowledgeBase'))
-    drawingSurfaceList = root.find(build_tag(
-        THREAT_MODELING_XMLNS, 'DrawingSurfaceList'))
-    icons = dict()
-    generic_icons = knowledgeBase.find(build_tag(
-        KNOWLEDGE_BASE_XMLNS, 'GenericElements')).findall(build_tag(
-        KNOWLEDGE_BASE_XMLNS, 'ElementType'))
-    for icon in generic_icons:
-        name = icon.find(build_tag(
-            KNOWLEDGE_BASE_XMLNS, 'Name')).text
-        image_source = icon.find(build_tag(
-            KNOWLEDGE_BASE_XMLNS, 'ImageSource')).text
-        icons[name] = image_source
-    standard_icons = knowledgeBase.find(build_tag(
-        KNOWLEDGE_BASE_XMLNS, 'StandardElements')).findall(build_tag(
-        KNOWLEDGE_BASE_XMLNS, 'ElementType'))
-    for icon in standard_icons:
-        name = icon.find(build_tag(
-            KNOWLEDGE_BASE_XMLNS, 'Name')).text
-        image_source = icon.find(build_tag(
-            KNOWLEDGE_BASE_XMLNS, 'ImageSource')).text
-        icons[name] = image_source
-    
-    tabs = drawingSurfaceList.findall(build_tag(THREAT_MODELING_XMLNS, "DrawingSurfaceModel"))
+        with open(f'{file_name}.svg', 'w', encoding='utf-8') as svg_file:
+            svg_file.write(result.svg)
+    with open(f'{file_name}.png', 'wb') as png_file:
+        png_file.write(result.png)
     
-    for tab in tabs:
-        tab_header = tab.findall(build_tag(THREAT_MODELING_XMLNS, "Header"))
-        tab_borders = tab.find(build_tag(THREAT_MODELING_XMLNS, "Borders"))
-        tab_lines = tab.find(build_tag(THREAT_MODELING_XMLNS, "Lines"))
-
-        d = draw.Drawing(2000, 2000)
-        d.append(draw.elements.Raw('<style>@import url("https://fonts.googleapis.com/css?family=Open+Sans:400,400i,700,700i");</style>'))
-        boundaries = []
-        shapes = []
-        borders = tab_borders.findall(build_tag(ARRAY_XMLNS, "KeyValueOfguidanyType"))
-        key_label_tuples = []
-        key_index = 0
-        
-        for border in borders:
-            value = border.find(build_tag(ARRAY_XMLNS, "Value"))
-            generic_type_id = value.find(build_tag(ABSTRACTS_XMLNS, "GenericTypeId")).text
-            if generic_type_id == "GE.TB.B":
-                user_friendly_key = "Boundary"
-                key = f'Boundary {key_index + 1}'
-                boundaries.append(value)
-            else:
-                if generic_type_id == "GE.A":
-                    user_friendly_key = "Annotation"
-                else:
-                    user_friendly_key = "Node"
-                shapes.append(value)
-            key = f'{user_friendly_key} {key_index + 1}'
-            name = get_element_name(value)
-            key_label_tuples.append((key, name))
-            #value.set('custom_key', key)
-            key_index += 1
-        
-        for shape in shapes:
-            draw_element(shape, d, icons)
-        
-        lines = tab_lines.findall(build_tag(ARRAY_XMLNS, "KeyValueOfguidanyType"))
-        for line in lines:
-            value = line.find(build_tag(ARRAY_XMLNS, "Value"))
-            draw_element(value, d, icons)
-            
-        for boundary in boundaries:
-            draw_element(boundary, d, icons)
-        
-        bounding_box = get_bbox(d.as_svg())
-        bounding_box.add_padding(10)
-        width, height = bounding_box.get_size()
-        d.set_render_size(width, height)
-        d.view_box = (bounding_box.xmin,bounding_box.ymin) + (width, height)
-        file_name = out_file
-        d.save_svg(f'{file_name}.svg')
-        d.save_png(f'{file_name}.png')
-        
-        return key_label_tuples
+    return result.key_label_tuples
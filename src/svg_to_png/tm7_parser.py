@@ -0,0 +1,187 @@
+from dataclasses import dataclass, field
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple, Union
+import xml.etree.ElementTree as ET
+from xml.etree.ElementTree import Element, ParseError
+
+THREAT_MODELING_XMLNS = "{http://schemas.datacontract.org/2004/07/ThreatModeling.Model}"
+ABSTRACTS_XMLNS = "{http://schemas.datacontract.org/2004/07/ThreatModeling.Model.Abstracts}"
+ARRAY_XMLNS = "{http://schemas.microsoft.com/2003/10/Serialization/Arrays}"
+KNOWLEDGE_BASE_XMLNS = "{http://schemas.datacontract.org/2004/07/ThreatModeling.KnowledgeBase}"
+
+DRAWING_SURFACE_MODEL_TAG = f"{THREAT_MODELING_XMLNS}DrawingSurfaceModel"
+HEADER_TAG = f"{THREAT_MODELING_XMLNS}Header"
+BORDERS_TAG = f"{THREAT_MODELING_XMLNS}Borders"
+LINES_TAG = f"{THREAT_MODELING_XMLNS}Lines"
+KNOWLEDGE_BASE_TAG = f"{THREAT_MODELING_XMLNS}KnowledgeBase"
+KEY_VALUE_TAG = f"{ARRAY_XMLNS}KeyValueOfguidanyType"
+KEY_TAG = f"{ARRAY_XMLNS}Key"
+VALUE_TAG = f"{ARRAY_XMLNS}Value"
+ANY_TYPE_TAG = f"{ARRAY_XMLNS}anyType"
+GENERIC_TYPE_ID_TAG = f"{ABSTRACTS_XMLNS}GenericTypeId"
+PROPERTIES_TAG = f"{ABSTRACTS_XMLNS}Properties"
+GENERIC_ELEMENTS_TAG = f"{KNOWLEDGE_BASE_XMLNS}GenericElements"
+STANDARD_ELEMENTS_TAG = f"{KNOWLEDGE_BASE_XMLNS}StandardElements"
+ELEMENT_TYPE_TAG = f"{KNOWLEDGE_BASE_XMLNS}ElementType"
+ELEMENT_TYPE_NAME_TAG = f"{KNOWLEDGE_BASE_XMLNS}Name"
+IMAGE_SOURCE_TAG = f"{KNOWLEDGE_BASE_XMLNS}ImageSource"
+
+# Errors parse_tm7 raises on a malformed document, e.g. invalid XML or missing or non-numeric fields
+PARSE_ERRORS = (ParseError, IndexError, AttributeError, ValueError)
+
+SHAPE_FIELDS = ["Height", "Width", "Left", "Top"]
+CURVE_FIELDS = ["HandleX", "HandleY", "SourceX", "SourceY", "TargetX", "TargetY"]
+
+BOUNDARY_TYPE_ID = "GE.TB.B"
+ANNOTATION_TYPE_ID = "GE.A"
+CURVE_TYPE_IDS = ["GE.DF", "GE.TB.L"]
+
+
+@dataclass(slots=True)
+class ThreatModelElement:
+    guid: str
+    generic_type_id: str
+    type: str
+    name: str
+    # Set for shapes (borders)
+    height: Optional[int] = None
+    width: Optional[int] = None
+    left: Optional[int] = None
+    top: Optional[int] = None
+    # Set for curves (lines)
+    handle_x: Optional[int] = None
+    handle_y: Optional[int] = None
+    source_x: Optional[int] = None
+    source_y: Optional[int] = None
+    target_x: Optional[int] = None
+    target_y: Optional[int] = None
+    source_guid: Optional[str] = None
+    target_guid: Optional[str] = None
+
+    def is_curve(self) -> bool:
+        return self.generic_type_id in CURVE_TYPE_IDS
+
+    def get_shape_details(self):
+        return self.height, self.width, self.left, self.top
+
+    def get_curve_details(self):
+        return self.handle_x, self.handle_y, self.source_x, self.source_y, self.target_x, self.target_y
+
+
+@dataclass(slots=True)
+class DrawingSurface:
+    name: str = ""
+    borders: List[ThreatModelElement] = field(default_factory=list)
+    lines: List[ThreatModelElement] = field(default_factory=list)
+
+    def get_key_label_tuples(self) -> List[Tuple[str, str]]:
+        key_label_tuples = []
+        for key_index, border in enumerate(self.borders):
+            if border.generic_type_id == BOUNDARY_TYPE_ID:
+                user_friendly_key = "Boundary"
+            elif border.generic_type_id == ANNOTATION_TYPE_ID:
+                user_friendly_key = "Annotation"
+            else:
+                user_friendly_key = "Node"
+            key_label_tuples.append((f'{user_friendly_key} {key_index + 1}', border.name))
+        return key_label_tuples
+
+
+@dataclass(slots=True)
+class ThreatModelDocument:
+    icons: Dict[str, str] = field(default_factory=dict)
+    surfaces: List[DrawingSurface] = field(default_factory=list)
+
+
+def _get_int(value: Element, tag: str) -> Optional[int]:
+    child = value.find(tag)
+    return int(child.text) if child is not None and child.text else None
+
+def _get_text(element: Element, tag: str) -> Optional[str]:
+    child = element.find(tag)
+    return child.text if child is not None else None
+
+def _read_element(key_value: Element) -> ThreatModelElement:
+    value = key_value.find(VALUE_TAG)
+    any_type_properties = value.find(PROPERTIES_TAG).findall(ANY_TYPE_TAG)
+    element = ThreatModelElement(
+        guid=_get_text(key_value, KEY_TAG),
+        generic_type_id=_get_text(value, GENERIC_TYPE_ID_TAG),
+        type=any_type_properties[0][0].text,
+        name=any_type_properties[1][2].text or "",
+    )
+    if element.is_curve():
+        (element.handle_x, element.handle_y, element.source_x, element.source_y,
+            element.target_x, element.target_y) = [_get_int(value, f"{ABSTRACTS_XMLNS}{tag}") for tag in CURVE_FIELDS]
+        element.source_guid = _get_text(value, f"{ABSTRACTS_XMLNS}SourceGuid")
+        element.target_guid = _get_text(value, f"{ABSTRACTS_XMLNS}TargetGuid")
+    else:
+        element.height, element.width, element.left, element.top = [_get_int(value, f"{ABSTRACTS_XMLNS}{tag}") for tag in SHAPE_FIELDS]
+    return element
+
+def _is_record(path: List[str]) -> bool:
+    # Records are the subtrees that are turned into model objects. Everything else is discarded as soon as it is parsed.
+    if len(path) < 3:
+        return False
+    tag, parent, grandparent = path[-1], path[-2], path[-3]
+    if tag == KEY_VALUE_TAG:
+        return parent in (BORDERS_TAG, LINES_TAG) and grandparent == DRAWING_SURFACE_MODEL_TAG
+    if tag == ELEMENT_TYPE_TAG:
+        return parent in (GENERIC_ELEMENTS_TAG, STANDARD_ELEMENTS_TAG) and grandparent == KNOWLEDGE_BASE_TAG
+    return False
+
+def parse_tm7(file: str = None, content: Union[str, bytes] = None) -> ThreatModelDocument:
+    """
+    Incrementally parse a .tm7 threat model into a compact typed model.
+    Each element, line and icon is converted as soon as its subtree is complete and then cleared,
+    so memory is bounded by the largest single record rather than the whole document.
+    :param file: Path to the .tm7 file.
+    :param content: The .tm7 document contents.
+    :return: The icons by element type name and the drawing surfaces.
+    """
+    if not file and not content:
+        raise Exception("Either file or content should be provided")
+    if not file:
+        file = BytesIO(content.encode("utf-8") if isinstance(content, str) else content)
+
+    document = ThreatModelDocument()
+    surface = None
+    path = []
+    open_elements = []
+    record_depth = None
+    for event, element in ET.iterparse(file, events=("start", "end")):
+        if event == "start":
+            path.append(element.tag)
+            open_elements.append(element)
+            if record_depth is None and _is_record(path):
+                record_depth = len(path)
+            elif element.tag == DRAWING_SURFACE_MODEL_TAG:
+                surface = DrawingSurface()
+            continue
+
+        if record_depth is not None and len(path) > record_depth:
+            # Part of a record that is still being built
+            path.pop()
+            open_elements.pop()
+            continue
+
+        if record_depth == len(path):
+            record_depth = None
+            if element.tag == ELEMENT_TYPE_TAG:
+                document.icons[_get_text(element, ELEMENT_TYPE_NAME_TAG)] = _get_text(element, IMAGE_SOURCE_TAG)
+            elif path[-2] == BORDERS_TAG:
+                surface.borders.append(_read_element(element))
+            else:
+                surface.lines.append(_read_element(element))
+        elif element.tag == HEADER_TAG and len(path) > 1 and path[-2] == DRAWING_SURFACE_MODEL_TAG:
+            surface.name = element.text or ""
+        elif element.tag == DRAWING_SURFACE_MODEL_TAG:
+            document.surfaces.append(surface)
+            surface = None
+
+        path.pop()
+        open_elements.pop()
+        element.clear()
+        if open_elements:
+            open_elements[-1].remove(element)
+    return document
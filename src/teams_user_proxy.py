@@ -44,6 +44,10 @@ class TeamsUserProxy(ConversableAgent):
             self.question_for_user = None
         return message
 
+    def reset(self):
+        super().reset()
+        self.question_for_user = None
+
     # Since this UserProxy is designed to be used asynchrnously
     # we exist the conversation, then wait asynchronously for the next user message
     def get_human_input(self, _prompt) -> str:
@@ -1,4 +1,5 @@
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
 from svg_to_png.svg_to_png import convert_svg_to_png
 
@@ -9,7 +10,8 @@ def main():
 
     input_file = sys.argv[1]
     output_filename = sys.argv[2]
-    convert_svg_to_png(file=input_file, out_file=output_filename)
+    with ProcessPoolExecutor() as tab_executor:
+        convert_svg_to_png(file=input_file, out_file=output_filename, tab_executor=tab_executor)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
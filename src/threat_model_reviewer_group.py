@@ -1,23 +1,33 @@
-from typing import Union
+from typing import Callable, List, Optional, Union
 from autogen import AssistantAgent, GroupChat, Agent
 from autogen.agentchat.contrib.multimodal_conversable_agent import MultimodalConversableAgent
-
 from botbuilder.core import TurnContext
 
+from agent_graph import AgentGraph
 from state import AppTurnState
+from svg_to_png.tm7_parser import DrawingSurface
+from threat_model_spec_checks import DEFAULT_SPEC_RULES, SpecFinding, ThreatModelSpecChecksCapability
 from threat_model_visualizer import ThreatModelImageAddToMessageCapability
 
-class ThreatModelReviewerGroup:
-    def __init__(self, llm_config, threat_model_spec: str = """
+DEFAULT_THREAT_MODEL_SPEC = """
 1. All nodes (boxes or nodes surrounded by a black border) should be inside a red boundary. Are there any nodes outside the red boundary?
 2. It should be clear to tell what each red boundary is.
 3. All arrows should be labeled (labels are inside green boxes).
 4. All labels for the arrows should have sequential numbers. These numbers indicate the order in which the flow happens. If all arrows do not contains labels, indicate which ones. Otherwise state the flow of data in the order that the arrow point
-"""):
+"""
+
+class ThreatModelReviewerGroup:
+    def __init__(self, llm_config, threat_model_spec: str = DEFAULT_THREAT_MODEL_SPEC, spec_rules: Optional[List[Callable[[DrawingSurface], List[SpecFinding]]]] = None):
         self.llm_config = llm_config
         self.threat_model_spec = threat_model_spec
+        # The default rules check the default spec, a custom spec needs its own rules
+        self.spec_rules = spec_rules if spec_rules is not None else (DEFAULT_SPEC_RULES if threat_model_spec == DEFAULT_THREAT_MODEL_SPEC else [])
+
+    async def prepare_turn(self, _context: TurnContext, state: AppTurnState):
+        if self.spec_rules:
+            await ThreatModelSpecChecksCapability(state, self.spec_rules).a_prepare()
 
-    def group_chat_builder(self, context: TurnContext, state: AppTurnState, user_agent: Agent) -> GroupChat:
+    def group_chat_builder(self, user_agent: Agent, graph: AgentGraph) -> GroupChat:
         group_chat_agents = [user_agent]
         questioner_agent = AssistantAgent(
             name="Questioner",
@@ -58,8 +68,9 @@ your clarifying question
             llm_config={"config_list": [self.llm_config],
                         "timeout": 60, "temperature": 0},
         )
-        threat_model_capability = ThreatModelImageAddToMessageCapability(context, say_when_evaluating=True, state=state, max_width=400)
+        threat_model_capability = ThreatModelImageAddToMessageCapability(None, say_when_evaluating=True, max_width=400)
         threat_model_capability.add_to_agent(answerer_agent)
+        graph.on_bind(threat_model_capability.bind)
 
         answer_evaluator_agent = AssistantAgent(
             name="Overall_spec_evaluator",
@@ -76,6 +87,13 @@ For each spec criteria that is not met, provide some action items on how to impr
                         "timeout": 60, "temperature": 0},
         )
 
+        if self.spec_rules:
+            # Geometry answers what it can up front, so the agents only need the picture for the rest
+            spec_checks_capability = ThreatModelSpecChecksCapability(rules=self.spec_rules)
+            for agent in [questioner_agent, answerer_agent, answer_evaluator_agent]:
+                spec_checks_capability.add_to_agent(agent)
+            graph.on_bind(lambda _context, state: spec_checks_capability.bind(state))
+
         for agent in [questioner_agent, answerer_agent, answer_evaluator_agent]:
             group_chat_agents.append(agent)
 
@@ -0,0 +1,271 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+import numpy as np
+from autogen.agentchat import ConversableAgent
+from autogen.agentchat.contrib.capabilities.agent_capability import AgentCapability
+from autogen.code_utils import content_str
+
+from config import Config
+from state import AppTurnState
+from svg_to_png.lib.curves import get_curve_rect_pair_crossings, get_quadratic_bezier_bboxes, get_rect_array
+from svg_to_png.lib.spatial_index import SpatialIndex
+from svg_to_png.lib.utils import BoundingBox
+from svg_to_png.render_executor import RenderQueueFullError
+from svg_to_png.svg_to_png import parse_threat_model_content
+from svg_to_png.tm7_parser import PARSE_ERRORS, DrawingSurface, ThreatModelDocument, ThreatModelElement
+from threat_model_visualizer import get_threat_model_input_file, render_executor
+
+NODE_TYPE_IDS = ["GE.P", "GE.DS", "GE.EI"]
+BOUNDARY_TYPE_ID = "GE.TB.B"
+DATA_FLOW_TYPE_ID = "GE.DF"
+FLOW_NUMBER_PATTERN = re.compile(r'^\s*\(?(\d+)')
+
+@dataclass
+class SpecFinding:
+    # None when the finding is informational rather than tied to a requirement
+    requirement: Optional[int]
+    passed: Optional[bool]
+    summary: str
+    details: List[str] = field(default_factory=list)
+
+def _is_labeled(element: ThreatModelElement) -> bool:
+    # New elements are named after their type until someone renames them
+    return bool(element.name.strip()) and element.name != element.type
+
+def _get_label(element: ThreatModelElement) -> str:
+    return element.name.strip() if element.name.strip() else f"unnamed {element.type}"
+
+def _get_bbox(element: ThreatModelElement) -> BoundingBox:
+    return BoundingBox(element.left, element.left + element.width, element.top, element.top + element.height)
+
+def _get_boundary_index(boundaries: List[ThreatModelElement]) -> SpatialIndex:
+    return SpatialIndex.from_items((index, _get_bbox(boundary)) for index, boundary in enumerate(boundaries))
+
+def check_nodes_inside_boundaries(surface: DrawingSurface) -> List[SpecFinding]:
+    nodes = [border for border in surface.borders if border.generic_type_id in NODE_TYPE_IDS]
+    boundaries = [border for border in surface.borders if border.generic_type_id == BOUNDARY_TYPE_ID]
+    spatial_index = _get_boundary_index(boundaries)
+    outside = [node for node in nodes if not spatial_index.query_containing(_get_bbox(node))]
+    if not outside:
+        return [SpecFinding(1, True, f"All {len(nodes)} nodes are inside a red boundary.")]
+    details = []
+    for node in outside:
+        # The closest boundary is likely the one the node was meant to be in
+        nearest = spatial_index.nearest(node.left + node.width / 2, node.top + node.height / 2)
+        details.append(f"{_get_label(node)} (nearest boundary: {_get_label(boundaries[nearest[0]])})" if nearest else _get_label(node))
+    return [SpecFinding(1, False, f"{len(outside)} of {len(nodes)} nodes are not fully inside a red boundary.", details)]
+
+def check_boundaries_labeled(surface: DrawingSurface) -> List[SpecFinding]:
+    boundaries = [border for border in surface.borders if border.generic_type_id == BOUNDARY_TYPE_ID]
+    unlabeled = [boundary for boundary in boundaries if not _is_labeled(boundary)]
+    if not unlabeled:
+        return [SpecFinding(2, True, "Every red boundary has a name.",
+                            [boundary.name for boundary in boundaries])]
+    return [SpecFinding(2, False, f"{len(unlabeled)} of {len(boundaries)} red boundaries have no name.",
+                        [_get_label(boundary) for boundary in unlabeled])]
+
+def check_flows_labeled(surface: DrawingSurface) -> List[SpecFinding]:
+    flows = [line for line in surface.lines if line.generic_type_id == DATA_FLOW_TYPE_ID]
+    names = {border.guid: _get_label(border) for border in surface.borders}
+    unlabeled = [flow for flow in flows if not _is_labeled(flow)]
+    if not unlabeled:
+        return [SpecFinding(3, True, f"All {len(flows)} arrows are labeled.")]
+    return [SpecFinding(3, False, f"{len(unlabeled)} of {len(flows)} arrows are not labeled.",
+                        [f"{names.get(flow.source_guid, 'unknown')} -> {names.get(flow.target_guid, 'unknown')}" for flow in unlabeled])]
+
+def check_flow_sequence(surface: DrawingSurface) -> List[SpecFinding]:
+    flows = [line for line in surface.lines if line.generic_type_id == DATA_FLOW_TYPE_ID]
+    names = {border.guid: _get_label(border) for border in surface.borders}
+    numbered = []
+    unnumbered = []
+    for flow in flows:
+        match = FLOW_NUMBER_PATTERN.match(flow.name)
+        if match:
+            numbered.append((int(match.group(1)), flow))
+        else:
+            unnumbered.append(flow)
+    numbered.sort(key=lambda number_flow: number_flow[0])
+    numbers = [number for number, _ in numbered]
+    order = [f"{number}. {names.get(flow.source_guid, 'unknown')} -> {names.get(flow.target_guid, 'unknown')}: {flow.name.strip()}" for number, flow in numbered]
+    problems = [f"Arrow without a number: {_get_label(flow)}" for flow in unnumbered]
+    duplicates = sorted({number for number in numbers if numbers.count(number) > 1})
+    if duplicates:
+        problems.append(f"Repeated numbers: {', '.join(str(number) for number in duplicates)}")
+    missing = sorted(set(range(1, len(flows) + 1)) - set(numbers))
+    if missing:
+        problems.append(f"Missing numbers: {', '.join(str(number) for number in missing)}")
+    if not problems:
+        return [SpecFinding(4, True, f"The {len(flows)} arrow labels are numbered 1 to {len(flows)}. The data flows in this order:", order)]
+    return [SpecFinding(4, False, "The arrow labels are not numbered sequentially.", problems + order)]
+
+def describe_boundary_crossings(surface: DrawingSurface) -> List[SpecFinding]:
+    flows = [line for line in surface.lines if line.generic_type_id == DATA_FLOW_TYPE_ID]
+    boundaries = [border for border in surface.borders if border.generic_type_id == BOUNDARY_TYPE_ID]
+    if not flows or not boundaries:
+        return []
+    starts, controls, ends = _get_flow_arrays(flows)
+    spatial_index = _get_boundary_index(boundaries)
+    # Only boundaries whose rectangle overlaps the curve's bounding box can be crossed by it
+    pairs = [
+        (flow_index, boundary_index)
+        for flow_index, (xmin, ymin, xmax, ymax) in enumerate(get_quadratic_bezier_bboxes(starts, controls, ends).tolist())
+        for boundary_index in sorted(spatial_index.query_range(BoundingBox(xmin, xmax, ymin, ymax)))
+    ]
+    if not pairs:
+        return []
+    flow_indexes, boundary_indexes = np.array(pairs).T
+    crossing = get_curve_rect_pair_crossings(
+        starts[flow_indexes], controls[flow_indexes], ends[flow_indexes], get_rect_array(boundaries)[boundary_indexes])
+    crossed = {}
+    for flow_index, boundary_index, crosses in zip(flow_indexes, boundary_indexes, crossing):
+        if crosses:
+            crossed.setdefault(flow_index, []).append(_get_label(boundaries[boundary_index]))
+    details = [f"{_get_label(flows[flow_index])} crosses {', '.join(names)}" for flow_index, names in sorted(crossed.items())]
+    if not details:
+        return []
+    return [SpecFinding(None, None, "These arrows cross a red boundary:", details)]
+
+def _get_flow_arrays(flows: List[ThreatModelElement]):
+    starts = np.array([(flow.source_x, flow.source_y) for flow in flows], dtype=float)
+    ends = np.array([(flow.target_x, flow.target_y) for flow in flows], dtype=float)
+    handles = np.array([(flow.handle_x, flow.handle_y) for flow in flows], dtype=float)
+    # The handle is the curve's midpoint, so the control point is derived the same way as in Curve
+    controls = 2 * handles - starts / 2 - ends / 2
+    return starts, controls, ends
+
+DEFAULT_SPEC_RULES: List[Callable[[DrawingSurface], List[SpecFinding]]] = [
+    check_nodes_inside_boundaries,
+    check_boundaries_labeled,
+    check_flows_labeled,
+    check_flow_sequence,
+    describe_boundary_crossings,
+]
+
+def evaluate_spec(document: ThreatModelDocument, rules: List[Callable[[DrawingSurface], List[SpecFinding]]] = DEFAULT_SPEC_RULES) -> Dict[str, List[SpecFinding]]:
+    """
+    Evaluate the spec rules against every drawing surface of a parsed threat model.
+    :param document: The parsed threat model.
+    :param rules: The rules to evaluate.
+    :return: The findings of each surface, keyed by surface name.
+    """
+    findings = {}
+    for index, surface in enumerate(document.surfaces):
+        name = surface.name if surface.name else f"Tab {index + 1}"
+        findings[name] = [finding for rule in rules for finding in rule(surface)]
+    return findings
+
+def format_findings(findings: Dict[str, List[SpecFinding]]) -> str:
+    lines = []
+    for surface_name, surface_findings in findings.items():
+        if len(findings) > 1:
+            lines.append(f"{surface_name}:")
+        for finding in surface_findings:
+            if finding.requirement is None:
+                lines.append(f"- Note: {finding.summary}")
+            else:
+                status = "met" if finding.passed else "NOT met"
+                lines.append(f"- Spec requirement {finding.requirement} ({status}): {finding.summary}")
+            lines.extend(f"    - {detail}" for detail in finding.details)
+    return "\n".join(lines)
+
+def build_findings_message(content: bytes, rules: List[Callable[[DrawingSurface], List[SpecFinding]]] = DEFAULT_SPEC_RULES) -> str:
+    """
+    Parse a threat model and format its spec findings. Runs in the render pool, which caches the parsed document.
+    :param content: The .tm7 document contents.
+    :param rules: The rules to evaluate, defined at module level so they can be sent to the pool.
+    :return: The formatted findings, empty when the document cannot be checked.
+    """
+    try:
+        return format_findings(evaluate_spec(parse_threat_model_content(content), rules))
+    except PARSE_ERRORS as e:
+        print(f"Unable to check the threat model against the spec: {e!r}")
+        return ""
+
+class SpecFindingsCache:
+    """
+    Bounded LRU cache of formatted spec findings, keyed by a hash of the uploaded bytes and the rules.
+    """
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(content: bytes, rules: List[Callable[[DrawingSurface], List[SpecFinding]]]) -> str:
+        digest = hashlib.sha256(content)
+        for rule in rules:
+            digest.update(f"{rule.__module__}.{rule.__qualname__}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            findings_message = self._entries.get(key)
+            if findings_message is not None:
+                self._entries.move_to_end(key)
+            return findings_message
+
+    def put(self, key: str, findings_message: str):
+        with self._lock:
+            self._entries[key] = findings_message
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+spec_findings_cache = SpecFindingsCache(max_entries=Config.THREAT_MODEL_RENDER_CACHE_MAX_ENTRIES)
+
+class ThreatModelSpecChecksCapability(AgentCapability):
+    """
+    Adds the spec findings computed from the uploaded .tm7 file to the agents' system messages,
+    so the agents only need the picture for what the geometry cannot answer.
+    The findings are computed by `a_prepare` before the chat runs, binding only reads them from the cache.
+    """
+    def __init__(self, state: AppTurnState = None, rules: List[Callable[[DrawingSurface], List[SpecFinding]]] = DEFAULT_SPEC_RULES):
+        super().__init__()
+        self.state = state
+        self.rules = rules
+        self.findings_message = None
+        # The agents and their system messages without findings
+        self._agents = []
+
+    def bind(self, state: AppTurnState):
+        self.state = state
+        self.findings_message = self.get_findings_message() if state is not None else None
+        for agent, system_message in self._agents:
+            if self.findings_message:
+                agent.update_system_message(f"""{system_message}
+
+These spec requirements were checked directly from the threat model file and are reliable:
+{self.findings_message}
+Use these results as answers. Do not ask questions about requirements that are already met or NOT met here, only about what is left.""")
+            else:
+                agent.update_system_message(system_message)
+
+    def add_to_agent(self, agent: ConversableAgent):
+        self._agents.append((agent, content_str(agent.system_message)))
+
+    def _get_key(self) -> Optional[str]:
+        input_file = get_threat_model_input_file(self.state)
+        if input_file is None or input_file.content_type in ('image/jpeg', 'image/png'):
+            return None
+        return spec_findings_cache.get_key(input_file.content, self.rules)
+
+    async def a_prepare(self):
+        # Checks an uploaded threat model in the render pool, once per file, so binding only gets cache hits
+        key = self._get_key()
+        if key is None or spec_findings_cache.get(key) is not None:
+            return
+        try:
+            findings_message = await render_executor.run(build_findings_message, get_threat_model_input_file(self.state).content, self.rules)
+        except (RenderQueueFullError, TimeoutError, BrokenProcessPool) as e:
+            print(f"Unable to check the threat model against the spec: {e!r}")
+            return
+        spec_findings_cache.put(key, findings_message)
+
+    def get_findings_message(self) -> Optional[str]:
+        key = self._get_key()
+        return (spec_findings_cache.get(key) or None) if key is not None else None
@@ -1,4 +1,5 @@
 import io
+from concurrent.futures.process import BrokenProcessPool
 from typing import Union
 from PIL import Image
 from botbuilder.schema import Activity, ActivityTypes, Attachment
@@ -10,38 +11,114 @@ from autogen.agentchat.contrib.img_utils import pil_to_data_uri
 from teams.input_file import InputFile
 from botbuilder.core import TurnContext
 
+from attachment_store import attachment_store
+from config import Config
 from state import AppTurnState
-from svg_to_png.svg_to_png import convert_svg_to_png
+from svg_to_png.render_cache import RenderCache
+from svg_to_png.render_executor import RenderExecutor, RenderQueueFullError
+from svg_to_png.svg_to_png import RenderResult
+from svg_to_png.tm7_parser import PARSE_ERRORS
 from asyncio import ensure_future
 
+render_cache = RenderCache(
+    max_entries=Config.THREAT_MODEL_RENDER_CACHE_MAX_ENTRIES,
+    max_bytes=Config.THREAT_MODEL_RENDER_CACHE_MAX_BYTES,
+    spill_dir=Config.THREAT_MODEL_RENDER_CACHE_DIR,
+    max_spill_bytes=Config.THREAT_MODEL_RENDER_CACHE_MAX_SPILL_BYTES,
+)
+
+render_executor = RenderExecutor(
+    max_workers=Config.THREAT_MODEL_RENDER_POOL_SIZE,
+    timeout=Config.THREAT_MODEL_RENDER_TIMEOUT_SECONDS,
+    max_queue_depth=Config.THREAT_MODEL_RENDER_MAX_QUEUE_DEPTH,
+    cache=render_cache,
+)
+
+def get_threat_model_input_file(state: AppTurnState) -> Union[InputFile, None]:
+    """
+    Get the uploaded image or .tm7 threat model of a turn.
+    :param state: The turn state.
+    :return: The input file, or None when the turn has no image or threat model.
+    """
+    if state.temp.input_files and state.temp.input_files[0]:
+        if isinstance(state.temp.input_files[0], InputFile):
+            if state.temp.input_files[0].content_type == 'image/jpeg' or state.temp.input_files[0].content_type == 'image/png':
+                return state.temp.input_files[0]
+            elif state.temp.input_files[0].content_type == 'application/vnd.microsoft.teams.file.download.info':
+                # make sure it's a threat model file
+                if state.temp.input_files[0].content and isinstance(state.temp.input_files[0].content, bytes):
+                    if state.temp.input_files[0].content.startswith(b"<ThreatModel"):
+                        return state.temp.input_files[0]
+    return None
+
 class ThreatModelImageVisualizer():
-    def __init__(self, state: AppTurnState):
+    def __init__(self, state: AppTurnState = None):
+        self.state = state
+        self.img = None
+        self.extra_details = None
+
+    def bind(self, state: AppTurnState):
+        # Reuses this visualizer for another turn, forgetting the previous turn's image
         self.state = state
         self.img = None
         self.extra_details = None
     
     def extract_image_from_state(self):
+        input_file = self._get_input_file()
         img = None
         img_details = None
-        if self.state.temp.input_files and self.state.temp.input_files[0]:
-            if isinstance(self.state.temp.input_files[0], InputFile):
-                if self.state.temp.input_files[0].content_type == 'image/jpeg' or self.state.temp.input_files[0].content_type == 'image/png':
-                    img = self._get_image(self.state.temp.input_files[0])
-                elif self.state.temp.input_files[0].content_type == 'application/vnd.microsoft.teams.file.download.info':
-                    # make sure it's a threat model file
-                    if self.state.temp.input_files[0].content and isinstance(self.state.temp.input_files[0].content, bytes):
-                        if self.state.temp.input_files[0].content.startswith(b"<ThreatModel"):
-                            svg_str = self.state.temp.input_files[0].content.decode("utf-8")
-                            key_label_tuples = convert_svg_to_png(svg_content=svg_str, out_file="threat_model")
-                            img = self._get_image("threat_model.png")
-                            if key_label_tuples:
-                                for key, label in key_label_tuples:
-                                    img_details = img_details + f"\n{key}: {label}" if img_details else f"{key}: {label}"
+        if input_file is not None:
+            if input_file.content_type == 'image/jpeg' or input_file.content_type == 'image/png':
+                img = self._get_image(input_file)
+            else:
+                # Rendering would block the event loop, so only a model prerendered by a_prerender is shown
+                result = render_cache.get(render_cache.get_key(input_file.content, include_svg=False))
+                if result is None:
+                    print("The threat model has not been rendered yet, so it is left out.")
+                img, img_details = self._read_render_result(result)
         self.img = img
         self.extra_details = img_details
+
+    async def a_extract_image_from_state(self):
+        input_file = self._get_input_file()
+        img = None
+        img_details = None
+        if input_file is not None:
+            if input_file.content_type == 'image/jpeg' or input_file.content_type == 'image/png':
+                img = self._get_image(input_file)
+            else:
+                try:
+                    result = await render_executor.render(input_file.content)
+                except (RenderQueueFullError, TimeoutError, BrokenProcessPool) + PARSE_ERRORS as e:
+                    # A broken pool is replaced on the next render
+                    print(f"Unable to render the threat model: {e!r}")
+                    result = None
+                img, img_details = self._read_render_result(result)
+        self.img = img
+        self.extra_details = img_details
+
+    async def a_prerender(self):
+        # Renders an uploaded threat model into the render cache, so the synchronous extract_image_from_state only gets cache hits
+        input_file = self._get_input_file()
+        if input_file is not None and input_file.content_type not in ('image/jpeg', 'image/png'):
+            try:
+                await render_executor.render(input_file.content)
+            except (RenderQueueFullError, TimeoutError, BrokenProcessPool) + PARSE_ERRORS as e:
+                print(f"Unable to prerender the threat model: {e!r}")
+
+    def _get_input_file(self) -> Union[InputFile, None]:
+        return get_threat_model_input_file(self.state)
+
+    def _read_render_result(self, result: Union[RenderResult, None]):
+        img = self._get_image(result.png) if result else None
+        img_details = None
+        if result and result.key_label_tuples:
+            for key, label in result.key_label_tuples:
+                img_details = img_details + f"\n{key}: {label}" if img_details else f"{key}: {label}"
+        return img, img_details
     
-    def _get_image(self, input_file: Union[InputFile, str]):
-        img = Image.open(io.BytesIO(input_file.content) if isinstance(input_file, InputFile) else input_file)
+    def _get_image(self, input_file: Union[InputFile, bytes]):
+        img = Image.open(io.BytesIO(input_file.content if isinstance(input_file, InputFile) else input_file))
         return img
     
     def convert_to_jpeg_if_needed(self, image: Image.Image):
@@ -54,28 +131,39 @@ class ThreatModelImageVisualizer():
 
     
 class ThreatModelImageVisualizerCapability(AgentCapability, ThreatModelImageVisualizer):
-    def __init__(self, state: AppTurnState):
+    def __init__(self, state: AppTurnState = None):
         super().__init__()
         super(AgentCapability, self).__init__(state)
     
     def add_to_agent(self, agent: AssistantAgent):
         agent.register_reply([Agent, None], self._reply_with_image, remove_other_reply_funcs=True)
+        # Async chats render in the process pool, sync chats only get a model that was prerendered
+        agent.register_reply([Agent, None], self._a_reply_with_image, ignore_async_in_sync_chat=True)
         
     def _reply_with_image(self, self2, messages, sender, config):
         if self.img is None:
             self.extract_image_from_state()
-            if self.img:
-                jpeg = self.convert_to_jpeg_if_needed(self.img)
-                if jpeg:
-                    self.img = jpeg
-            
+            self._convert_img_to_jpeg()
+        return self._get_reply()
+
+    async def _a_reply_with_image(self, self2, messages, sender, config):
+        if self.img is None:
+            await self.a_extract_image_from_state()
+            self._convert_img_to_jpeg()
+        return self._get_reply()
+
+    def _convert_img_to_jpeg(self):
+        if self.img:
+            jpeg = self.convert_to_jpeg_if_needed(self.img)
+            if jpeg:
+                self.img = jpeg
+
+    def _get_reply(self):
         if self.img:
-            return [True, self._convert_image_to_data_uri(self.img)]
+            # The transcript gets a handle, the image is only inlined when it is sent
+            return [True, attachment_store.put_image(self.img)]
         else:
             return [True, "No threat model available"]
-        
-    def _convert_image_to_data_uri(self, image: Image.Image):
-        return pil_to_data_uri(image)
 
 class ThreatModelImageAddToMessageCapability(AgentCapability, ThreatModelImageVisualizer):
     def __init__(self, context: TurnContext, say_when_evaluating: bool, max_width: int, **kwargs):
@@ -85,11 +173,19 @@ class ThreatModelImageAddToMessageCapability(AgentCapability, ThreatModelImageVi
         
         super().__init__()
         super(AgentCapability, self).__init__(**kwargs)
+
+    def bind(self, context: TurnContext, state: AppTurnState):
+        self.context = context
+        super().bind(state)
     
     def add_to_agent(self, agent: MultimodalConversableAgent):
         agent.register_hook("process_all_messages_before_reply", self._add_image_to_messages)
         
     def _add_image_to_messages(self, messages):
+        messages = [
+            {**message, "content": attachment_store.rehydrate(message.get("content"))} if isinstance(message, dict) else message
+            for message in messages
+        ]
         if self.img is None:
             self.extract_image_from_state()
             if self.img:
@@ -97,7 +193,7 @@ class ThreatModelImageAddToMessageCapability(AgentCapability, ThreatModelImageVi
                 if jpeg:
                     # Unfortunately autogen currently doesn't support async nested chats.
                     # So we need to do this "fire and forget" hack to send the image.
-                    ensure_future(self._say_when_evaluating(jpeg))
+                    ensure_future(self._say_when_evaluating(self.context, jpeg))
                 self.resize(self.max_width)
         if self.img:
             messages = messages.copy()
@@ -125,11 +221,12 @@ class ThreatModelImageAddToMessageCapability(AgentCapability, ThreatModelImageVi
         hsize = int((float(self.img.size[1]) * float(wpercent)))
         self.img = new_img.resize((max_width, hsize))
     
-    async def _say_when_evaluating(self, img: Image.Image):
+    async def _say_when_evaluating(self, context: TurnContext, img: Image.Image):
+        # Takes the context it was scheduled with, as the capability may already be bound to a later turn when this runs
         if self.say_when_evaluating:
             jpeg = self.convert_to_jpeg_if_needed(img)
             if jpeg:
-                await self.context.send_activity(
+                await context.send_activity(
                     Activity(
                         type=ActivityTypes.message,
                         text="Here is the threat model we are evaluating",
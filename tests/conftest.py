@@ -0,0 +1,10 @@
+"""
+Copyright (c) Microsoft Corporation. All rights reserved.
+Licensed under the MIT License.
+"""
+
+import os
+
+# Config reads the bot credentials when it is imported
+os.environ.setdefault("BOT_ID", "test-bot-id")
+os.environ.setdefault("BOT_PASSWORD", "test-bot-password")
@@ -0,0 +1,37 @@
+"""
+Copyright (c) Microsoft Corporation. All rights reserved.
+Licensed under the MIT License.
+"""
+
+import pytest
+from autogen import ConversableAgent, GroupChat, GroupChatManager
+
+from agent_graph import AgentGraph, AgentGraphPool
+
+
+def build_graph():
+    graph = AgentGraph()
+    graph.user_proxy = ConversableAgent("User", llm_config=False, human_input_mode="NEVER")
+    assistant = ConversableAgent("Assistant", llm_config=False, human_input_mode="NEVER")
+    group_chat = GroupChat(agents=[graph.user_proxy, assistant], messages=[], send_introductions=True)
+    graph.manager = GroupChatManager(group_chat, llm_config=False)
+    graph.add_group_chat(group_chat, graph.manager)
+    return graph
+
+
+@pytest.mark.asyncio
+async def test_reset_restores_send_introductions():
+    pool = AgentGraphPool(build_graph, max_idle=1)
+
+    async with pool.acquire(None, None) as graph:
+        await graph.manager.a_resume(messages=[
+            {"role": "user", "name": "User", "content": "Review my service."},
+            {"role": "user", "name": "Assistant", "content": "Which data does it store?"},
+        ])
+        assert graph.manager.groupchat.send_introductions is False
+
+    async with pool.acquire(None, None) as reused:
+        assert reused is graph
+        assert reused.manager.groupchat.send_introductions is True
+        assert reused.manager.groupchat.messages == []
+    assert pool.built == 1
@@ -0,0 +1,120 @@
+"""
+Copyright (c) Microsoft Corporation. All rights reserved.
+Licensed under the MIT License.
+"""
+
+import math
+
+import numpy as np
+import pytest
+
+from svg_to_png.lib.curves import get_curve_rect_pair_crossings, get_quadratic_bezier_bboxes, sample_quadratic_beziers
+
+# (start, control, end) of each curve
+CURVES = [
+    ((0, 0), (50, 100), (100, 0)),
+    ((10, 20), (10, 20), (90, 20)),
+    ((100, 100), (0, 0), (0, 100)),
+    ((5, 5), (5, 5), (5, 5)),
+]
+
+
+def curve_arrays(curves):
+    return tuple(np.array([curve[i] for curve in curves], dtype=float).reshape(-1, 2) for i in range(3))
+
+
+def point_at(curve, t):
+    (x0, y0), (x1, y1), (x2, y2) = curve
+    return (
+        (1 - t) ** 2 * x0 + 2 * (1 - t) * t * x1 + t ** 2 * x2,
+        (1 - t) ** 2 * y0 + 2 * (1 - t) * t * y1 + t ** 2 * y2,
+    )
+
+
+def angle_at(curve, t):
+    (x0, y0), (x1, y1), (x2, y2) = curve
+    dx = 2 * (1 - t) * (x1 - x0) + 2 * t * (x2 - x1)
+    dy = 2 * (1 - t) * (y1 - y0) + 2 * t * (y2 - y1)
+    return math.degrees(math.atan2(dy, dx))
+
+
+def test_sample_matches_per_point_evaluation():
+    ts = [0, 0.25, 0.5, 0.75, 1]
+
+    points, angles = sample_quadratic_beziers(*curve_arrays(CURVES), ts)
+
+    assert points.shape == (len(CURVES), len(ts), 2)
+    assert angles.shape == (len(CURVES), len(ts))
+    for i, curve in enumerate(CURVES):
+        for j, t in enumerate(ts):
+            assert points[i, j].tolist() == pytest.approx(point_at(curve, t))
+            assert angles[i, j] == pytest.approx(angle_at(curve, t))
+
+
+def test_sample_tangent_angles():
+    _, angles = sample_quadratic_beziers(*curve_arrays(CURVES[:1]), [0, 0.5, 1])
+
+    assert angles[0].tolist() == pytest.approx([math.degrees(math.atan2(2, 1)), 0, -math.degrees(math.atan2(2, 1))])
+
+
+def test_sample_no_curves():
+    points, angles = sample_quadratic_beziers(*curve_arrays([]), [0, 1])
+
+    assert points.shape == (0, 2, 2)
+    assert angles.shape == (0, 2)
+
+
+def test_bboxes_are_exact():
+    bboxes = get_quadratic_bezier_bboxes(*curve_arrays(CURVES))
+
+    # The first curve peaks at t=0.5, halfway to its control point
+    assert bboxes[0].tolist() == pytest.approx([0, 0, 100, 50])
+    assert bboxes[1].tolist() == pytest.approx([10, 20, 90, 20])
+    assert bboxes[3].tolist() == pytest.approx([5, 5, 5, 5])
+
+
+def test_bboxes_contain_sampled_points():
+    rng = np.random.default_rng(7)
+    starts, controls, ends = (rng.uniform(-100, 100, size=(50, 2)) for _ in range(3))
+
+    bboxes = get_quadratic_bezier_bboxes(starts, controls, ends)
+    points, _ = sample_quadratic_beziers(starts, controls, ends, np.linspace(0, 1, 201))
+
+    assert np.all(points.min(axis=1) >= bboxes[:, :2] - 1e-9)
+    assert np.all(points.max(axis=1) <= bboxes[:, 2:] + 1e-9)
+    # Sampled densely enough to get close to the true extremes
+    assert np.allclose(points.min(axis=1), bboxes[:, :2], atol=0.1)
+    assert np.allclose(points.max(axis=1), bboxes[:, 2:], atol=0.1)
+
+
+@pytest.mark.parametrize("rect, expected", [
+    # Crosses the edges on the way up
+    ((0, 10, 80, 30), True),
+    # Contains the whole curve
+    ((-10, -10, 110, 60), False),
+    # Inside the area under the curve
+    ((40, 10, 60, 20), False),
+    # Crosses only the top edge, near the peak
+    ((40, 40, 60, 80), True),
+    # Touches the curve's peak
+    ((40, 50, 60, 80), True),
+    # Beside the curve
+    ((120, 0, 140, 20), False),
+])
+def test_pair_crossings(rect, expected):
+    starts, controls, ends = curve_arrays(CURVES[:1])
+
+    crossings = get_curve_rect_pair_crossings(starts, controls, ends, np.array([rect], dtype=float))
+
+    assert crossings.tolist() == [expected]
+
+
+def test_pair_crossings_of_straight_line():
+    starts, controls, ends = curve_arrays([CURVES[1]] * 3)
+    rects = np.array([(50, 0, 60, 40), (0, 0, 100, 40), (50, 30, 60, 40)], dtype=float)
+
+    assert get_curve_rect_pair_crossings(starts, controls, ends, rects).tolist() == [True, False, False]
+
+
+def test_pair_crossings_no_pairs():
+    assert get_curve_rect_pair_crossings(*curve_arrays([]), np.zeros((0, 4))).shape == (0,)
@@ -0,0 +1,137 @@
+"""
+Copyright (c) Microsoft Corporation. All rights reserved.
+Licensed under the MIT License.
+"""
+
+import pytest
+
+import history_compactor
+from history_compactor import HistoryCompactor, strip_images
+
+IMAGE_URI = "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8/5+hHgAHggJ/PchI7wAAAABJRU5ErkJggg=="
+
+
+@pytest.fixture(autouse=True)
+def count_words(monkeypatch):
+    # A token per word, so budgets are easy to reason about
+    monkeypatch.setattr(history_compactor, "count_token", lambda text: len(text.split()))
+
+
+def turn(i):
+    return [
+        {"role": "user", "name": "User", "content": f"question {i}"},
+        {"role": "user", "name": "Questioner", "content": f"answer {i}"},
+    ]
+
+
+def turns(start, end):
+    return [message for i in range(start, end) for message in turn(i)]
+
+
+class Summarizer:
+    def __init__(self):
+        self.blocks = []
+
+    def __call__(self, messages):
+        self.blocks.append([message["content"] for message in messages])
+        return " + ".join(message["content"] for message in messages)
+
+
+def test_strip_images_from_text():
+    assert strip_images(f"Here is the diagram: {IMAGE_URI} and more") == "Here is the diagram: <image image/png omitted> and more"
+    assert strip_images("no images") == "no images"
+    assert strip_images(None) is None
+
+
+def test_strip_images_from_content_parts():
+    content = [
+        {"type": "text", "text": f"Before <img {IMAGE_URI}>"},
+        {"type": "image_url", "image_url": {"url": IMAGE_URI}},
+        "plain",
+    ]
+
+    assert strip_images(content) == [
+        {"type": "text", "text": "Before <img <image image/png omitted>>"},
+        {"type": "text", "text": "<image omitted>"},
+        "plain",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_short_history_is_kept_without_images():
+    messages = turns(0, 3) + [{"role": "user", "name": "User", "content": [{"type": "image_url", "image_url": {"url": IMAGE_URI}}]}]
+    original = [dict(message) for message in messages]
+    compactor = HistoryCompactor(Summarizer(), keep_last_turns=4)
+
+    compacted = await compactor.a_compact(messages)
+
+    assert compacted[:-1] == turns(0, 3)
+    assert compacted[-1]["content"] == [{"type": "text", "text": "<image omitted>"}]
+    assert messages == original
+
+
+@pytest.mark.asyncio
+async def test_older_turns_are_summarized_in_blocks():
+    summarizer = Summarizer()
+    compactor = HistoryCompactor(summarizer, keep_last_turns=2)
+
+    compacted = await compactor.a_compact(turns(0, 7))
+
+    # Two complete blocks of two turns are summarized, the last three turns are kept verbatim
+    assert summarizer.blocks == [
+        ["question 0", "answer 0", "question 1", "answer 1"],
+        ["question 2", "answer 2", "question 3", "answer 3"],
+    ]
+    assert compacted[:2] == [
+        {"role": "assistant", "content": "Summary of earlier messages:\nquestion 0 + answer 0 + question 1 + answer 1"},
+        {"role": "assistant", "content": "Summary of earlier messages:\nquestion 2 + answer 2 + question 3 + answer 3"},
+    ]
+    assert compacted[2:] == turns(4, 7)
+
+
+@pytest.mark.asyncio
+async def test_block_summaries_are_cached():
+    summarizer = Summarizer()
+    compactor = HistoryCompactor(summarizer, keep_last_turns=2)
+
+    await compactor.a_compact(turns(0, 6))
+    compacted = await compactor.a_compact(turns(0, 8))
+
+    # The first two blocks did not change, so only the new third block is summarized
+    assert len(summarizer.blocks) == 3
+    assert (compactor.summary_hits, compactor.summary_misses) == (2, 3)
+    assert compacted[3:] == turns(6, 8)
+
+
+@pytest.mark.asyncio
+async def test_failed_summary_is_left_out():
+    def summarize(messages):
+        if messages[0]["content"] == "question 0":
+            raise RuntimeError("The LLM is unavailable.")
+        return "summary"
+    compactor = HistoryCompactor(summarize, keep_last_turns=2)
+
+    compacted = await compactor.a_compact(turns(0, 7))
+
+    assert compacted[0] == {"role": "assistant", "content": "Summary of earlier messages:\nsummary"}
+    assert compacted[1:] == turns(4, 7)
+    # A failed summary is not cached, so it is tried again next time
+    await compactor.a_compact(turns(0, 7))
+    assert compactor.summary_misses == 3
+
+
+@pytest.mark.asyncio
+async def test_oldest_messages_are_dropped_over_the_token_budget():
+    # Each message is 2 words plus 4 tokens of overhead
+    compactor = HistoryCompactor(None, max_tokens=20)
+
+    assert await compactor.a_compact(turns(0, 3)) == turns(0, 3)[-3:]
+    assert await compactor.a_compact(turns(0, 2)) == turns(0, 2)[-3:]
+
+
+@pytest.mark.asyncio
+async def test_last_message_is_kept_over_the_token_budget():
+    long_message = {"role": "user", "name": "User", "content": "word " * 100}
+    compactor = HistoryCompactor(None, max_tokens=20)
+
+    assert await compactor.a_compact(turns(0, 2) + [long_message]) == [long_message]
@@ -0,0 +1,128 @@
+"""
+Copyright (c) Microsoft Corporation. All rights reserved.
+Licensed under the MIT License.
+"""
+
+import numpy as np
+import pytest
+
+from local_vector_db import LocalVectorDB, _Collection
+
+DIM = 32
+CLUSTERS = 64
+CENTERS = np.random.default_rng(1).normal(size=(CLUSTERS, DIM))
+
+
+def clustered_embedding(texts):
+    # "<cluster> <seed>" is embedded near the cluster's center
+    embeddings = []
+    for text in texts:
+        cluster, seed = (int(part) for part in text.split())
+        embeddings.append(CENTERS[cluster] + 0.5 * np.random.default_rng(seed).normal(size=DIM))
+    return embeddings
+
+
+def ids(results):
+    return [document["id"] for document, _ in results]
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = LocalVectorDB(str(tmp_path))
+    db.create_collection("docs")
+    db.insert_docs([
+        {"id": "dpia", "content": "A data protection impact assessment is needed for high risk processing."},
+        {"id": "retention", "content": "Personal data retention periods must be documented."},
+        {"id": "encryption", "content": "Encrypt customer data at rest and in transit."},
+    ])
+    return db
+
+
+def test_insert_and_retrieve(db):
+    results = db.retrieve_docs(["how long can we keep personal data retention", "encrypt data in transit"], n_results=2)
+
+    assert [ids(result)[0] for result in results] == ["retention", "encryption"]
+    assert all(len(result) == 2 for result in results)
+    assert all(0 <= distance <= 2 for result in results for _, distance in result)
+
+
+def test_insert_existing_document_needs_upsert(db):
+    with pytest.raises(ValueError):
+        db.insert_docs([{"id": "dpia", "content": "Duplicate"}])
+
+    db.insert_docs([{"id": "dpia", "content": "Privacy reviews start with a questionnaire."}], upsert=True)
+
+    assert db.get_docs_by_ids(["dpia"])[0]["content"] == "Privacy reviews start with a questionnaire."
+    assert ids(db.retrieve_docs(["privacy review questionnaire"], n_results=1)[0]) == ["dpia"]
+
+
+def test_update_missing_document_raises(db):
+    with pytest.raises(ValueError):
+        db.update_docs([{"id": "missing", "content": "Nothing"}])
+
+
+def test_delete(db):
+    db.delete_docs(["retention"])
+
+    assert [document["id"] for document in db.get_docs_by_ids(["retention", "dpia"])] == ["dpia"]
+    assert "retention" not in ids(db.retrieve_docs(["personal data retention periods"], n_results=3)[0])
+
+
+def test_compact_after_deleting_most_documents(tmp_path):
+    db = LocalVectorDB(str(tmp_path))
+    db.create_collection("docs")
+    db.insert_docs([{"id": str(i), "content": f"document number {i} about topic{i}"} for i in range(100)])
+
+    db.delete_docs([str(i) for i in range(60)])
+
+    collection = db._get("docs")
+    assert collection.rows == 40
+    assert sorted(int(document["id"]) for document in db.get_docs_by_ids()) == list(range(60, 100))
+    assert ids(db.retrieve_docs(["topic75"], n_results=1)[0]) == ["75"]
+
+
+def test_reload_from_disk(db, tmp_path):
+    db.delete_docs(["dpia"])
+    expected = db.retrieve_docs(["customer data encryption"], n_results=3)
+
+    reloaded = LocalVectorDB(str(tmp_path))
+    reloaded.get_collection("docs")
+
+    assert sorted(document["id"] for document in reloaded.get_docs_by_ids()) == ["encryption", "retention"]
+    assert reloaded.retrieve_docs(["customer data encryption"], n_results=3) == expected
+
+
+def test_ivf_recall_against_exact_search(tmp_path):
+    docs = [{"id": str(i), "content": f"{i % CLUSTERS} {i}"} for i in range(4000)]
+    queries = [f"{i % CLUSTERS} {100000 + i}" for i in range(50)]
+    ivf_db = LocalVectorDB(str(tmp_path / "ivf"), embedding_function=clustered_embedding, exact_search_max_docs=500)
+    exact_db = LocalVectorDB(str(tmp_path / "exact"), embedding_function=clustered_embedding, exact_search_max_docs=10000)
+    for db in [ivf_db, exact_db]:
+        db.create_collection("docs")
+        db.insert_docs(docs)
+
+    ivf_results = ivf_db.retrieve_docs(queries, n_results=10)
+    exact_results = exact_db.retrieve_docs(queries, n_results=10)
+
+    assert ivf_db._get("docs").centroids is not None
+    assert exact_db._get("docs").centroids is None
+    recall = np.mean([len(set(ids(ivf)) & set(ids(exact))) / len(exact) for ivf, exact in zip(ivf_results, exact_results)])
+    assert recall >= 0.9
+
+
+def test_ivf_index_is_restored_on_reload(tmp_path, monkeypatch):
+    docs = [{"id": str(i), "content": f"{i % CLUSTERS} {i}"} for i in range(1000)]
+    db = LocalVectorDB(str(tmp_path), embedding_function=clustered_embedding, exact_search_max_docs=100)
+    db.create_collection("docs")
+    db.insert_docs(docs)
+    expected = db.retrieve_docs(["3 123456"], n_results=5)
+    centroids = db._get("docs").centroids
+
+    def train(*args, **kwargs):
+        raise AssertionError("The index should be loaded, not trained again")
+    monkeypatch.setattr(_Collection, "train", train)
+    reloaded = LocalVectorDB(str(tmp_path), embedding_function=clustered_embedding, exact_search_max_docs=100)
+    reloaded.get_collection("docs")
+
+    assert np.array_equal(reloaded._get("docs").centroids, centroids)
+    assert reloaded.retrieve_docs(["3 123456"], n_results=5) == expected
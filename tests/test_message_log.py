@@ -0,0 +1,168 @@
+"""
+Copyright (c) Microsoft Corporation. All rights reserved.
+Licensed under the MIT License.
+"""
+
+import os
+import sqlite3
+import zlib
+
+import pytest
+import pytest_asyncio
+
+from message_log import MemoryMessageLog, SqliteMessageLog
+
+SHARDS = 4
+
+
+def message(i):
+    return {"role": "user", "name": "User", "content": f"message {i}"}
+
+
+def messages(start, end):
+    return [message(i) for i in range(start, end)]
+
+
+@pytest_asyncio.fixture
+async def log(tmp_path):
+    log = SqliteMessageLog(str(tmp_path), shards=SHARDS)
+    yield log
+    await log.a_close()
+
+
+@pytest.fixture
+def reads(log, monkeypatch):
+    # The sequence numbers each read started from
+    reads = []
+    read = log._read
+
+    async def record_read(conversation_id, from_seq):
+        reads.append((conversation_id, from_seq))
+        return await read(conversation_id, from_seq)
+    monkeypatch.setattr(log, "_read", record_read)
+    return reads
+
+
+def rows_by_shard(path):
+    rows = {}
+    for shard in range(SHARDS):
+        connection = sqlite3.connect(os.path.join(path, f"messages-{shard}.sqlite3"))
+        rows[shard] = connection.execute("SELECT DISTINCT conversation_id FROM messages").fetchall()
+        connection.close()
+    return {shard: sorted(conversation_id for conversation_id, in ids) for shard, ids in rows.items()}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("log_type", ["memory", "sqlite"])
+async def test_round_trip(tmp_path, log_type):
+    log = MemoryMessageLog() if log_type == "memory" else SqliteMessageLog(str(tmp_path), shards=SHARDS)
+    start_seq = await log.a_start("conversation")
+    await log.a_append("conversation", messages(0, 2))
+    await log.a_append("conversation", [])
+    await log.a_append("conversation", messages(2, 3))
+
+    loaded = await log.a_load("conversation", start_seq)
+    loaded.append(message(99))
+
+    assert await log.a_load("conversation", start_seq) == messages(0, 3)
+    assert await log.a_load("other", 0) == []
+    if log_type == "sqlite":
+        await log.a_close()
+
+
+@pytest.mark.asyncio
+async def test_conversations_are_sharded(log, tmp_path):
+    conversation_ids = [f"conversation-{i}" for i in range(20)]
+    for conversation_id in conversation_ids:
+        await log.a_append(conversation_id, messages(0, 1))
+
+    expected = {shard: [] for shard in range(SHARDS)}
+    for conversation_id in conversation_ids:
+        expected[zlib.crc32(conversation_id.encode()) % SHARDS].append(conversation_id)
+    assert rows_by_shard(tmp_path) == {shard: sorted(ids) for shard, ids in expected.items()}
+    assert sum(1 for ids in expected.values() if ids) > 1
+
+
+@pytest.mark.asyncio
+async def test_start_drops_the_previous_chat_but_keeps_numbering(log):
+    first_start = await log.a_start("conversation")
+    await log.a_append("conversation", messages(0, 3))
+
+    second_start = await log.a_start("conversation")
+
+    assert (first_start, second_start) == (0, 3)
+    assert await log._read("conversation", 0) == []
+    # The heads table keeps the next sequence number while the chat has no messages
+    assert await log.a_start("conversation") == 3
+    await log.a_append("conversation", messages(3, 4))
+    assert await log._read("conversation", 0) == [(3, message(3))]
+    assert await log.a_load("conversation", second_start) == messages(3, 4)
+
+
+@pytest.mark.asyncio
+async def test_load_reads_only_the_tail(log, reads, tmp_path):
+    start_seq = await log.a_start("conversation")
+    await log.a_append("conversation", messages(0, 3))
+
+    assert await log.a_load("conversation", start_seq) == messages(0, 3)
+    # Another process appends to the same log
+    other = SqliteMessageLog(str(tmp_path), shards=SHARDS)
+    await other.a_append("conversation", messages(3, 5))
+    await other.a_close()
+    assert await log.a_load("conversation", start_seq) == messages(0, 5)
+    assert await log.a_load("conversation", start_seq) == messages(0, 5)
+
+    # Each load reads on from the last message it has seen
+    assert reads == [("conversation", 3), ("conversation", 3), ("conversation", 5)]
+
+
+@pytest.mark.asyncio
+async def test_evicted_conversation_is_read_again(tmp_path, monkeypatch):
+    log = SqliteMessageLog(str(tmp_path), shards=SHARDS, cache_max_conversations=1)
+    reads = []
+    read = log._read
+
+    async def record_read(conversation_id, from_seq):
+        reads.append((conversation_id, from_seq))
+        return await read(conversation_id, from_seq)
+    monkeypatch.setattr(log, "_read", record_read)
+    for conversation_id in ["a", "b"]:
+        await log.a_start(conversation_id)
+        await log.a_append(conversation_id, messages(0, 2))
+
+    assert await log.a_load("b", 0) == messages(0, 2)
+    assert await log.a_load("a", 0) == messages(0, 2)
+    await log.a_close()
+
+    # "a" was evicted when "b" started, and "b" when "a" was loaded
+    assert reads == [("b", 2), ("a", 0)]
+
+
+@pytest.mark.asyncio
+async def test_stale_start_is_not_served_from_the_cache(log, reads):
+    old_start = await log.a_start("conversation")
+    await log.a_append("conversation", messages(0, 2))
+    new_start = await log.a_start("conversation")
+    await log.a_append("conversation", messages(2, 3))
+
+    assert await log.a_load("conversation", new_start) == messages(2, 3)
+    assert await log.a_load("conversation", old_start) == messages(2, 3)
+    assert reads == [("conversation", 3), ("conversation", 0)]
+
+
+@pytest.mark.asyncio
+async def test_append_after_reload(tmp_path):
+    log = SqliteMessageLog(str(tmp_path), shards=SHARDS)
+    start_seq = await log.a_start("conversation")
+    await log.a_append("conversation", messages(0, 2))
+    await log.a_close()
+
+    reloaded = SqliteMessageLog(str(tmp_path), shards=SHARDS)
+    try:
+        assert await reloaded.a_load("conversation", start_seq) == messages(0, 2)
+        await reloaded.a_append("conversation", messages(2, 4))
+        assert await reloaded.a_load("conversation", start_seq) == messages(0, 4)
+        assert await reloaded._read("conversation", 2) == [(2, message(2)), (3, message(3))]
+        assert await reloaded.a_start("conversation") == 4
+    finally:
+        await reloaded.a_close()
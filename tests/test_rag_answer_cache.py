@@ -0,0 +1,135 @@
+"""
+Copyright (c) Microsoft Corporation. All rights reserved.
+Licensed under the MIT License.
+"""
+
+import numpy as np
+import pytest
+
+import rag_answer_cache
+from rag_answer_cache import RagAnswerCache, normalize_question
+
+INDEX = "20240601-1-home-index"
+
+# Questions embedded along fixed directions, so their cosine similarities are known
+EMBEDDINGS = {
+    "which team owns the payments service": [1, 0, 0],
+    "who owns the payments service": [0.98, np.sqrt(1 - 0.98 ** 2), 0],
+    "who owns payments": [0.9, np.sqrt(1 - 0.9 ** 2), 0],
+    "where is customer data stored": [0, 0, 1],
+}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rag_answer_cache.time, "monotonic", clock)
+    return clock
+
+
+def embed(text):
+    embed.calls.append(text)
+    return EMBEDDINGS[text]
+
+
+@pytest.fixture
+def semantic_cache(clock):
+    embed.calls = []
+    return RagAnswerCache(ttl_seconds=60, similarity_threshold=0.95, embedding_function=embed)
+
+
+@pytest.mark.parametrize("question", [
+    "Which team owns the payments service?",
+    "  which   team owns the\npayments service ",
+    "WHICH TEAM OWNS THE PAYMENTS SERVICE?!",
+])
+def test_normalize_question(question):
+    assert normalize_question(question) == "which team owns the payments service"
+
+
+def test_exact_hit_on_normalized_question(clock):
+    cache = RagAnswerCache()
+    cache.put("Which team owns the payments service?", INDEX, "The payments team.")
+
+    assert cache.get("which team owns the  payments service", INDEX) == "The payments team."
+    assert cache.get("Which team owns the billing service?", INDEX) is None
+    assert cache.stats()["exact_hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = RagAnswerCache(ttl_seconds=60)
+    cache.put("Who owns payments?", INDEX, "The payments team.")
+
+    clock.now += 59
+    assert cache.get("Who owns payments?", INDEX) == "The payments team."
+    clock.now += 1
+    assert cache.get("Who owns payments?", INDEX) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_newer_index_drops_all_entries(clock):
+    cache = RagAnswerCache()
+    cache.put("Who owns payments?", INDEX, "The payments team.")
+
+    assert cache.get("Who owns payments?", "20240602-1-home-index") is None
+    # Going back to the previous index does not bring its answers back
+    assert cache.get("Who owns payments?", INDEX) is None
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = RagAnswerCache(max_entries=2)
+    cache.put("first", INDEX, "1")
+    cache.put("second", INDEX, "2")
+    cache.get("first", INDEX)
+    cache.put("third", INDEX, "3")
+
+    assert [cache.get(question, INDEX) for question in ["first", "second", "third"]] == ["1", None, "3"]
+
+
+def test_semantic_hit_above_threshold(semantic_cache):
+    semantic_cache.put("Which team owns the payments service?", INDEX, "The payments team.")
+
+    assert semantic_cache.get("Who owns the payments service?", INDEX) == "The payments team."
+    assert semantic_cache.stats()["semantic_hits"] == 1
+
+
+def test_semantic_miss_below_threshold(semantic_cache):
+    semantic_cache.put("Which team owns the payments service?", INDEX, "The payments team.")
+
+    assert semantic_cache.get("Who owns payments?", INDEX) is None
+    assert semantic_cache.get("Where is customer data stored?", INDEX) is None
+    assert semantic_cache.stats()["misses"] == 2
+
+
+def test_semantic_match_ignores_expired_entries(semantic_cache, clock):
+    semantic_cache.put("Which team owns the payments service?", INDEX, "The payments team.")
+
+    clock.now += 60
+    assert semantic_cache.get("Who owns the payments service?", INDEX) is None
+
+
+def test_miss_then_put_embeds_once(semantic_cache):
+    assert semantic_cache.get("Where is customer data stored?", INDEX) is None
+    semantic_cache.put("Where is customer data stored?", INDEX, "In the EU region.")
+
+    assert embed.calls == ["where is customer data stored"]
+
+
+def test_embedding_errors_fall_back_to_exact_matches(clock):
+    def failing_embed(text):
+        raise RuntimeError("The embedding service is unavailable.")
+    cache = RagAnswerCache(embedding_function=failing_embed)
+    cache.put("Who owns payments?", INDEX, "The payments team.")
+
+    assert cache.get("Who owns payments?", INDEX) == "The payments team."
+    assert cache.get("Who owns the payments service?", INDEX) is None
+    assert cache.stats()["embedding_errors"] == 2
@@ -0,0 +1,90 @@
+"""
+Copyright (c) Microsoft Corporation. All rights reserved.
+Licensed under the MIT License.
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from azure.core.exceptions import ResourceNotFoundError
+
+from search_client_pool import SearchClientPool
+
+
+class StubSearchHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like the search service
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        index_name = self.path.split("/indexes('")[1].split("')")[0]
+        self.server.requests.append((self.client_address, index_name, self.headers.get("api-key"), body))
+        if index_name == "missing-index":
+            self._send(404, {"error": {"code": "ResourceNotFound", "message": "The index was not found."}})
+            return
+        self._send(200, {"value": [{"@search.score": 1.0, "id": str(i), "title": body["search"]} for i in range(body.get("top", 2))]})
+
+    def _send(self, status: int, payload: dict):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubSearchHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def pool(stub_server):
+    pool = SearchClientPool(f"http://127.0.0.1:{stub_server.server_port}", "test-key", pool_size=2)
+    yield pool
+    pool.close()
+
+
+def test_get_client_reuses_the_client_of_an_index(pool):
+    assert pool.get_client("index-a") is pool.get_client("index-a")
+    assert pool.get_client("index-a") is not pool.get_client("index-b")
+
+
+def test_searches_share_one_connection(pool, stub_server):
+    for index_name in ["index-a", "index-b", "index-a"]:
+        results = list(pool.get_client(index_name).search(search_text="privacy", top=3))
+        assert [result["id"] for result in results] == ["0", "1", "2"]
+
+    assert [index_name for _, index_name, _, _ in stub_server.requests] == ["index-a", "index-b", "index-a"]
+    assert all(api_key == "test-key" for _, _, api_key, _ in stub_server.requests)
+    assert len({client_address for client_address, _, _, _ in stub_server.requests}) == 1
+
+
+def test_missing_index_raises_resource_not_found(pool):
+    with pytest.raises(ResourceNotFoundError):
+        list(pool.get_client("missing-index").search(search_text="privacy"))
+
+
+def test_close_drops_the_clients(pool, stub_server):
+    client = pool.get_client("index-a")
+    pool.close()
+
+    new_client = pool.get_client("index-a")
+    assert new_client is not client
+    assert [result["id"] for result in new_client.search(search_text="privacy", top=1)] == ["0"]
+
+
+def test_missing_api_key_raises():
+    with pytest.raises(ValueError):
+        SearchClientPool("http://127.0.0.1:1", None).get_client("index-a")
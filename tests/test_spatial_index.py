@@ -0,0 +1,155 @@
+"""
+Copyright (c) Microsoft Corporation. All rights reserved.
+Licensed under the MIT License.
+"""
+
+import math
+import random
+
+import pytest
+
+from svg_to_png.lib import spatial_index
+from svg_to_png.lib.spatial_index import SpatialIndex
+from svg_to_png.lib.utils import BoundingBox
+
+
+def random_bboxes(seed: int, count: int, extent: float = 1000, max_size: float = 120):
+    rng = random.Random(seed)
+    bboxes = []
+    for _ in range(count):
+        x, y = rng.uniform(-extent, extent), rng.uniform(-extent, extent)
+        bboxes.append(BoundingBox(x, x + rng.uniform(0, max_size), y, y + rng.uniform(0, max_size)))
+    return bboxes
+
+
+def intersects(first, second):
+    return first.xmin <= second.xmax and second.xmin <= first.xmax and first.ymin <= second.ymax and second.ymin <= first.ymax
+
+
+def contains(outer, inner):
+    return outer.xmin <= inner.xmin and outer.ymin <= inner.ymin and outer.xmax >= inner.xmax and outer.ymax >= inner.ymax
+
+
+def distance(bbox, x, y):
+    return math.hypot(max(bbox.xmin - x, 0, x - bbox.xmax), max(bbox.ymin - y, 0, y - bbox.ymax))
+
+
+@pytest.fixture
+def bboxes():
+    return random_bboxes(1, 300)
+
+
+@pytest.mark.parametrize("cell_size", [None, 7, 250, 5000])
+def test_query_range_matches_scan(bboxes, cell_size):
+    index = SpatialIndex.from_items(enumerate(bboxes), cell_size)
+
+    for query in random_bboxes(2, 100, max_size=600):
+        expected = [i for i, bbox in enumerate(bboxes) if intersects(bbox, query)]
+        assert sorted(index.query_range(query)) == expected
+
+
+def test_query_range_does_not_repeat_items_spanning_cells():
+    index = SpatialIndex(10)
+    index.insert("wide", BoundingBox(0, 95, 0, 95))
+
+    assert index.query_range(BoundingBox(-50, 150, -50, 150)) == ["wide"]
+
+
+def test_query_containing_matches_scan(bboxes):
+    index = SpatialIndex.from_items(enumerate(bboxes))
+
+    for query in random_bboxes(3, 100, max_size=20):
+        expected = [i for i, bbox in enumerate(bboxes) if contains(bbox, query)]
+        assert sorted(index.query_containing(query)) == expected
+
+
+@pytest.mark.parametrize("query, expected", [
+    # Touching edges intersect, even when they fall on a cell boundary
+    (BoundingBox(100, 110, 0, 10), ["left"]),
+    (BoundingBox(90, 100, 0, 10), ["left"]),
+    (BoundingBox(-10, 0, 0, 10), ["left"]),
+    # Negative coordinates are in the cells below zero
+    (BoundingBox(-100.5, -100.5, -20, -20), ["negative"]),
+    (BoundingBox(-99.9, -99.9, 0, 0), []),
+    (BoundingBox(100.001, 150, 0, 10), []),
+])
+def test_cell_boundary_edges(query, expected):
+    index = SpatialIndex(100)
+    index.insert("left", BoundingBox(0, 100, 0, 100))
+    index.insert("negative", BoundingBox(-200, -100.5, -100, -0.5))
+
+    assert index.query_range(query) == expected
+
+
+def test_item_on_cell_boundary_is_registered_in_both_cells():
+    index = SpatialIndex(100)
+    index.insert("edge", BoundingBox(100, 100, 50, 50))
+
+    assert index.query_range(BoundingBox(99, 99.9999, 0, 100)) == []
+    assert index.query_range(BoundingBox(0, 100, 0, 100)) == ["edge"]
+    assert index.query_range(BoundingBox(100, 150, 0, 100)) == ["edge"]
+
+
+def test_invalid_cell_size():
+    with pytest.raises(ValueError):
+        SpatialIndex(0)
+
+
+@pytest.mark.parametrize("k", [1, 3, 10])
+def test_nearest_matches_scan(bboxes, k):
+    index = SpatialIndex.from_items(enumerate(bboxes))
+    rng = random.Random(4)
+
+    for _ in range(100):
+        x, y = rng.uniform(-1500, 1500), rng.uniform(-1500, 1500)
+        expected = sorted(distance(bbox, x, y) for bbox in bboxes)[:k]
+        assert [distance(bboxes[i], x, y) for i in index.nearest(x, y, k)] == pytest.approx(expected)
+
+
+def test_nearest_containing_item_is_at_distance_zero():
+    index = SpatialIndex(10)
+    index.insert("near", BoundingBox(52, 53, 52, 53))
+    index.insert("around", BoundingBox(0, 100, 0, 100))
+
+    assert index.nearest(50, 50, k=2) == ["around", "near"]
+
+
+def test_nearest_of_empty_index():
+    assert SpatialIndex(10).nearest(0, 0) == []
+    index = SpatialIndex.from_items([("a", BoundingBox(0, 1, 0, 1))])
+    assert index.nearest(0, 0, k=0) == []
+    assert index.nearest(0, 0, k=5) == ["a"]
+
+
+def test_nearest_stops_once_no_unseen_cell_can_be_closer(monkeypatch):
+    index = SpatialIndex(10)
+    index.insert("near", BoundingBox(14, 16, 4, 6))
+    index.insert("far", BoundingBox(1000, 1001, 1000, 1001))
+    rings = []
+    get_ring = spatial_index._get_ring
+
+    def record_ring(center_x, center_y, ring):
+        rings.append(ring)
+        return get_ring(center_x, center_y, ring)
+    monkeypatch.setattr(spatial_index, "_get_ring", record_ring)
+
+    assert index.nearest(5, 5) == ["near"]
+    # "near" is found in the first ring and is within one cell, so the rings out to "far" are never searched
+    assert rings == [0, 1]
+
+
+def test_nearest_keeps_searching_until_the_kth_item_is_certain(monkeypatch):
+    index = SpatialIndex(10)
+    # Found first, in the next ring of cells, but further away than the item two cells over
+    index.insert("diagonal", BoundingBox(19, 20, 19, 20))
+    index.insert("straight", BoundingBox(25, 26, 0, 1))
+    rings = []
+    get_ring = spatial_index._get_ring
+
+    def record_ring(center_x, center_y, ring):
+        rings.append(ring)
+        return get_ring(center_x, center_y, ring)
+    monkeypatch.setattr(spatial_index, "_get_ring", record_ring)
+
+    assert index.nearest(0, 0) == ["straight"]
+    assert rings == [0, 1, 2]
@@ -0,0 +1,140 @@
+"""
+Copyright (c) Microsoft Corporation. All rights reserved.
+Licensed under the MIT License.
+"""
+
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+from state_storage import ShardedSqliteStorage
+
+KEY = "msteams/bot/conversations/a"
+OTHER_KEY = "msteams/bot/conversations/b"
+
+
+@pytest_asyncio.fixture
+async def storage(tmp_path):
+    # Only flushed when a test asks for it, or when max_pending keys are waiting
+    storage = ShardedSqliteStorage(str(tmp_path), shards=4, flush_interval_seconds=3600, max_pending=4)
+    yield storage
+    await storage.a_close()
+
+
+async def read_from_disk(path, keys):
+    storage = ShardedSqliteStorage(str(path), shards=4)
+    try:
+        return await storage.read(keys)
+    finally:
+        await storage.a_close()
+
+
+@pytest.mark.asyncio
+async def test_round_trip(storage):
+    await storage.write({KEY: {"turn": 1, "history": ["hi"]}, OTHER_KEY: {"turn": 2}})
+
+    assert await storage.read([KEY, OTHER_KEY, "missing"]) == {KEY: {"turn": 1, "history": ["hi"]}, OTHER_KEY: {"turn": 2}}
+    await storage.flush()
+    assert await storage.read([KEY]) == {KEY: {"turn": 1, "history": ["hi"]}}
+
+    await storage.delete([KEY])
+    assert await storage.read([KEY, OTHER_KEY]) == {OTHER_KEY: {"turn": 2}}
+
+
+@pytest.mark.asyncio
+async def test_etag_conflict(storage):
+    await storage.write({KEY: {"e_tag": "*", "turn": 1}})
+    e_tag = (await storage.read([KEY]))[KEY]["e_tag"]
+    await storage.flush()
+
+    with pytest.raises(KeyError):
+        await storage.write({KEY: {"e_tag": "stale", "turn": 2}})
+    await storage.write({KEY: {"e_tag": e_tag, "turn": 2}})
+
+    item = (await storage.read([KEY]))[KEY]
+    assert item["turn"] == 2
+    assert item["e_tag"] not in (e_tag, "*")
+    # The etag that was just replaced is stale now
+    with pytest.raises(KeyError):
+        await storage.write({KEY: {"e_tag": e_tag, "turn": 3}})
+
+
+@pytest.mark.asyncio
+async def test_concurrent_writes_with_the_same_etag(storage):
+    await storage.write({KEY: {"e_tag": "*", "turn": 1}})
+    e_tag = (await storage.read([KEY]))[KEY]["e_tag"]
+    # Flushed, so the etag check reads the shard on a worker thread
+    await storage.flush()
+
+    results = await asyncio.gather(
+        storage.write({KEY: {"e_tag": e_tag, "turn": 2}}),
+        storage.write({KEY: {"e_tag": e_tag, "turn": 3}}),
+        return_exceptions=True,
+    )
+
+    assert results[0] is None
+    assert isinstance(results[1], KeyError)
+    assert (await storage.read([KEY]))[KEY]["turn"] == 2
+
+
+@pytest.mark.asyncio
+async def test_flushes_at_max_pending(storage, tmp_path):
+    keys = [f"msteams/bot/conversations/{i}" for i in range(4)]
+    await storage.write({key: {"turn": 1} for key in keys[:3]})
+
+    assert await read_from_disk(tmp_path, keys) == {}
+
+    await storage.write({keys[3]: {"turn": 1}})
+
+    assert await read_from_disk(tmp_path, keys) == {key: {"turn": 1} for key in keys}
+
+
+@pytest.mark.asyncio
+async def test_flushes_after_interval(tmp_path):
+    storage = ShardedSqliteStorage(str(tmp_path), shards=4, flush_interval_seconds=0.01)
+    try:
+        await storage.write({KEY: {"turn": 1}})
+        await asyncio.sleep(0.2)
+
+        assert await read_from_disk(tmp_path, [KEY]) == {KEY: {"turn": 1}}
+    finally:
+        await storage.a_close()
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_is_requeued(storage, tmp_path, monkeypatch):
+    await storage.write({KEY: {"turn": 1}, OTHER_KEY: {"turn": 1}})
+    shard = storage._shards[storage._get_shard(KEY)]
+    write = shard.write
+
+    def fail_once(changes):
+        monkeypatch.setattr(shard, "write", write)
+        raise OSError("disk full")
+    monkeypatch.setattr(shard, "write", fail_once)
+
+    with pytest.raises(OSError):
+        await storage.flush()
+    # Still readable, and a newer write wins over the one that failed to flush
+    assert (await storage.read([KEY]))[KEY] == {"turn": 1}
+    await storage.write({KEY: {"turn": 2}})
+    await storage.flush()
+
+    assert await read_from_disk(tmp_path, [KEY, OTHER_KEY]) == {KEY: {"turn": 2}, OTHER_KEY: {"turn": 1}}
+
+
+@pytest.mark.asyncio
+async def test_state_survives_close_and_restart(tmp_path):
+    storage = ShardedSqliteStorage(str(tmp_path), shards=4, flush_interval_seconds=3600)
+    await storage.write({KEY: {"e_tag": "*", "turn": 1}, OTHER_KEY: {"turn": 1}})
+    await storage.delete([OTHER_KEY])
+    e_tag = (await storage.read([KEY]))[KEY]["e_tag"]
+    await storage.a_close()
+
+    restarted = ShardedSqliteStorage(str(tmp_path), shards=4, flush_interval_seconds=3600)
+    try:
+        assert await restarted.read([KEY, OTHER_KEY]) == {KEY: {"e_tag": e_tag, "turn": 1}}
+        with pytest.raises(KeyError):
+            await restarted.write({KEY: {"e_tag": "stale", "turn": 2}})
+    finally:
+        await restarted.a_close()
@@ -0,0 +1,63 @@
+"""
+Copyright (c) Microsoft Corporation. All rights reserved.
+Licensed under the MIT License.
+"""
+
+import random
+import string
+
+import pytest
+from PIL import ImageFont
+
+from svg_to_png.lib import utils
+from svg_to_png.lib.text_metrics import DEFAULT_FONT_PATH, get_text_metrics
+from svg_to_png.lib.utils import get_text_width, wrap_text
+
+FONT_SIZES = [9, 11, 14]
+ALPHABET = string.ascii_letters + string.digits + string.punctuation + "     éüßÅ–’"
+
+
+def random_texts(seed: int, count: int, max_length: int):
+    rng = random.Random(seed)
+    return [
+        "".join(rng.choice(ALPHABET) for _ in range(rng.randint(1, max_length)))
+        for _ in range(count)
+    ]
+
+
+class PillowTextMetrics:
+    """
+    Measures every text by rendering it through Pillow, as wrap_text did before TextMetrics.
+    """
+
+    def __init__(self, font_size: int, font_path: str):
+        self.font_size = font_size
+        self.font = ImageFont.truetype(font_path, font_size)
+
+    def get_text_width(self, text):
+        return get_text_width(text, self.font, self.font_size)
+
+
+@pytest.mark.parametrize("font_size", FONT_SIZES)
+def test_widths_match_pillow(font_size):
+    font = ImageFont.truetype(DEFAULT_FONT_PATH, font_size)
+    metrics = get_text_metrics(font_size)
+    texts = ["", " ", "AV", "To", "Web Application", "Azure SQL Database", "fi ffi"]
+    texts += random_texts(font_size, 150, 24)
+
+    for text in texts:
+        assert metrics.get_text_width(text) == get_text_width(text, font, font_size), text
+
+
+@pytest.mark.parametrize("font_size", FONT_SIZES)
+def test_wrap_text_matches_pillow(font_size, monkeypatch):
+    rng = random.Random(100 + font_size)
+    texts = ["Customer Identity Service", "A\nmulti line\n\nlabel", "Averyveryverylongwordwithoutanyspaces"]
+    texts += [" ".join(random_texts(rng.random(), rng.randint(1, 8), 12)) for _ in range(40)]
+    max_widths = [20, 45.5, 80, 160]
+
+    wrapped = [wrap_text(text, max_width, font_size) for text in texts for max_width in max_widths]
+    monkeypatch.setattr(utils, "get_text_metrics", PillowTextMetrics)
+    expected = [wrap_text(text, max_width, font_size) for text in texts for max_width in max_widths]
+
+    assert wrapped == expected
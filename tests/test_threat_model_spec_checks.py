@@ -0,0 +1,191 @@
+"""
+Copyright (c) Microsoft Corporation. All rights reserved.
+Licensed under the MIT License.
+"""
+
+from svg_to_png.tm7_parser import DrawingSurface, ThreatModelDocument, ThreatModelElement
+from threat_model_spec_checks import (
+    build_findings_message,
+    check_boundaries_labeled,
+    check_flow_sequence,
+    check_flows_labeled,
+    check_nodes_inside_boundaries,
+    describe_boundary_crossings,
+    evaluate_spec,
+    format_findings,
+)
+
+
+def node(guid, name, left, top, width=50, height=50, generic_type_id="GE.P"):
+    return ThreatModelElement(guid, generic_type_id, "Process", name, height=height, width=width, left=left, top=top)
+
+
+def boundary(guid, name, left, top, width, height):
+    return ThreatModelElement(guid, "GE.TB.B", "Trust Boundary", name, height=height, width=width, left=left, top=top)
+
+
+def flow(name, source, target, handle=None, source_guid="web", target_guid="db"):
+    # The handle is the curve's midpoint, so a straight flow has its handle halfway
+    handle = handle or ((source[0] + target[0]) / 2, (source[1] + target[1]) / 2)
+    return ThreatModelElement(
+        f"flow-{name}", "GE.DF", "Generic Data Flow", name, handle_x=handle[0], handle_y=handle[1],
+        source_x=source[0], source_y=source[1], target_x=target[0], target_y=target[1], source_guid=source_guid, target_guid=target_guid)
+
+
+def surface(borders=(), lines=()):
+    return DrawingSurface("Diagram 1", list(borders), list(lines))
+
+
+NODES = [
+    node("web", "Web App", 20, 20),
+    node("db", "Orders DB", 320, 20, generic_type_id="GE.DS"),
+]
+BOUNDARIES = [
+    boundary("frontend", "Frontend", 0, 0, 200, 100),
+    boundary("backend", "Backend", 300, 0, 200, 100),
+]
+
+
+def test_nodes_inside_boundaries():
+    [finding] = check_nodes_inside_boundaries(surface(NODES + BOUNDARIES))
+
+    assert finding.requirement == 1
+    assert finding.passed
+
+
+def test_node_partly_outside_boundary():
+    # Overlapping a boundary is not enough, the node must be fully inside one
+    straddling = node("api", "API", 180, 20)
+    outside = node("user", "", 600, 20, generic_type_id="GE.EI")
+
+    [finding] = check_nodes_inside_boundaries(surface(NODES + BOUNDARIES + [straddling, outside]))
+
+    assert not finding.passed
+    assert finding.summary.startswith("2 of 4 nodes")
+    assert finding.details == ["API (nearest boundary: Frontend)", "unnamed Process (nearest boundary: Backend)"]
+
+
+def test_nodes_without_boundaries():
+    [finding] = check_nodes_inside_boundaries(surface(NODES))
+
+    assert not finding.passed
+    assert finding.details == ["Web App", "Orders DB"]
+
+
+def test_node_on_boundary_edge_is_inside():
+    on_edge = node("cache", "Cache", 150, 50)
+
+    [finding] = check_nodes_inside_boundaries(surface(BOUNDARIES + [on_edge]))
+
+    assert finding.passed
+
+
+def test_boundaries_labeled():
+    [finding] = check_boundaries_labeled(surface(BOUNDARIES))
+
+    assert finding.passed
+    assert finding.details == ["Frontend", "Backend"]
+
+
+def test_unlabeled_boundaries():
+    # New boundaries are named after their type until someone renames them
+    default_name = boundary("b1", "Trust Boundary", 0, 200, 100, 100)
+    blank = boundary("b2", "  ", 200, 200, 100, 100)
+
+    [finding] = check_boundaries_labeled(surface(BOUNDARIES + [default_name, blank]))
+
+    assert not finding.passed
+    assert finding.summary.startswith("2 of 4")
+    assert finding.details == ["Trust Boundary", "unnamed Trust Boundary"]
+
+
+def test_unlabeled_flows():
+    flows = [
+        flow("1. Places order", (70, 45), (320, 45)),
+        flow("Generic Data Flow", (320, 60), (70, 60), source_guid="db", target_guid="web"),
+        flow("", (70, 80), (320, 80), target_guid="missing"),
+    ]
+
+    [finding] = check_flows_labeled(surface(NODES, flows))
+
+    assert not finding.passed
+    assert finding.details == ["Orders DB -> Web App", "Web App -> unknown"]
+
+
+def test_flows_labeled():
+    [finding] = check_flows_labeled(surface(NODES, [flow("1. Places order", (70, 45), (320, 45))]))
+
+    assert finding.passed
+
+
+def test_flow_sequence():
+    flows = [
+        flow("(2) Returns order", (320, 60), (70, 60), source_guid="db", target_guid="web"),
+        flow("1. Places order", (70, 45), (320, 45)),
+    ]
+
+    [finding] = check_flow_sequence(surface(NODES, flows))
+
+    assert finding.passed
+    assert finding.details == ["1. Web App -> Orders DB: 1. Places order", "2. Orders DB -> Web App: (2) Returns order"]
+
+
+def test_flow_sequence_problems():
+    flows = [
+        flow("1. Places order", (70, 45), (320, 45)),
+        flow("1. Reads order", (70, 60), (320, 60)),
+        flow("4. Returns order", (320, 80), (70, 80), source_guid="db", target_guid="web"),
+        flow("Writes audit log", (70, 90), (320, 90)),
+    ]
+
+    [finding] = check_flow_sequence(surface(NODES, flows))
+
+    assert not finding.passed
+    assert finding.details[:3] == [
+        "Arrow without a number: Writes audit log",
+        "Repeated numbers: 1",
+        "Missing numbers: 2, 3",
+    ]
+
+
+def test_boundary_crossings():
+    flows = [
+        # From the frontend into the backend
+        flow("1. Places order", (70, 45), (320, 45)),
+        # Stays inside the frontend
+        flow("2. Renders page", (20, 30), (150, 30), source_guid="web", target_guid="web"),
+        # Curves out of the frontend and back in
+        flow("3. Calls itself", (50, 80), (150, 80), handle=(100, 150), source_guid="web", target_guid="web"),
+    ]
+
+    [finding] = describe_boundary_crossings(surface(NODES + BOUNDARIES, flows))
+
+    assert finding.requirement is None
+    assert finding.details == ["1. Places order crosses Frontend, Backend", "3. Calls itself crosses Frontend"]
+
+
+def test_no_boundary_crossings():
+    flows = [flow("1. Renders page", (20, 30), (150, 30), source_guid="web", target_guid="web")]
+
+    assert describe_boundary_crossings(surface(NODES + BOUNDARIES, flows)) == []
+    assert describe_boundary_crossings(surface(NODES, flows)) == []
+
+
+def test_format_findings_of_several_surfaces():
+    document = ThreatModelDocument(surfaces=[surface(BOUNDARIES), DrawingSurface("", [boundary("b", "", 0, 0, 10, 10)])])
+
+    message = format_findings(evaluate_spec(document, [check_boundaries_labeled]))
+
+    assert message.splitlines() == [
+        "Diagram 1:",
+        "- Spec requirement 2 (met): Every red boundary has a name.",
+        "    - Frontend",
+        "    - Backend",
+        "Tab 2:",
+        "- Spec requirement 2 (NOT met): 1 of 1 red boundaries have no name.",
+        "    - unnamed Trust Boundary",
+    ]
+
+
+def test_unparseable_threat_model_has_no_findings():
+    assert build_findings_message(b"<ThreatModel><broken") == ""